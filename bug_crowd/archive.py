@@ -0,0 +1,269 @@
+import datetime
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import Future
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+# The first bytes of an archive's data file.
+_MAGIC = b'BCARCHV1'
+
+# A record's key length and compressed payload length, followed by the key
+# and the payload.
+_RECORD_HEADER = struct.Struct('>II')
+
+# An index entry: the digest of a record's key and the record's offset.
+_INDEX_ENTRY = struct.Struct('>16sQ')
+
+# Headers describing the encoding of the body as it was sent, which no longer
+# applies to the decoded body that is stored.
+_TRANSFER_HEADERS = ('content-encoding', 'transfer-encoding',
+                     'content-length')
+
+
+class ResponseArchive(object):
+    """ An append-only archive of api responses, for recording a client's
+        traffic and replaying it later without a network.
+
+        Responses are stored in the data file at path as zlib compressed
+        records keyed by their request's method, url, including its query,
+        and a digest of its body. Records are located through a sidecar
+        index, at path + '.idx', of fixed size entries that is read when
+        the archive is opened, and read from a memory map of the data file.
+        A response recorded again replaces the earlier one for replay,
+        except for 304 responses, which are not recorded.
+        Records written after the index, as when recording was
+        interrupted, are indexed when the archive is next opened, and a
+        partly written last record is discarded.
+
+        An archive opened with mode 'a' records the responses of clients
+        given it as their archive, and one opened with mode 'r' replays
+        them.
+    """
+
+    def __init__(self, path, mode='r', compression_level=6):
+        if mode not in ('r', 'a'):
+            raise ValueError("mode must be 'r' or 'a'")
+        self.path = path
+        self.mode = mode
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+        self._offsets = {}
+        self._map = None
+        if mode == 'a' and not os.path.exists(path):
+            with open(path, 'wb') as data_file:
+                data_file.write(_MAGIC)
+        self._data_file = open(path, 'r+b' if mode == 'a' else 'rb')
+        if self._data_file.read(len(_MAGIC)) != _MAGIC:
+            self._data_file.close()
+            raise ValueError('%s is not a response archive' % path)
+        self._index_file = None
+        try:
+            self._load()
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def recording(self):
+        """ Returns whether responses are recorded rather than replayed. """
+        return self.mode == 'a'
+
+    def _load(self):
+        """ reads the index and indexes any records written after it. """
+        index_path = self.path + '.idx'
+        entries = b''
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as index_file:
+                entries = index_file.read()
+        entries = entries[:len(entries) - len(entries) % _INDEX_ENTRY.size]
+        data_size = os.fstat(self._data_file.fileno()).st_size
+        end = len(_MAGIC)
+        for digest, offset in _INDEX_ENTRY.iter_unpack(entries):
+            if offset >= data_size:
+                entries = b''
+                self._offsets.clear()
+                end = len(_MAGIC)
+                break
+            self._offsets[digest] = offset
+            end = max(end, offset)
+        self._remap()
+        if self._offsets:
+            end = self._get_record_end(end)
+            if end is None:
+                entries = b''
+                self._offsets.clear()
+                end = len(_MAGIC)
+        unindexed = []
+        while end < data_size:
+            record_end = self._get_record_end(end)
+            if record_end is None:
+                break
+            digest = _get_digest(self._read_key(end))
+            unindexed.append(_INDEX_ENTRY.pack(digest, end))
+            self._offsets[digest] = end
+            end = record_end
+        if self.mode == 'r':
+            return
+        if end < data_size:
+            self._data_file.truncate(end)
+            self._remap()
+        self._index_file = open(index_path, 'wb' if not entries else 'r+b')
+        self._index_file.truncate(len(entries))
+        self._index_file.seek(len(entries))
+        self._index_file.write(b''.join(unindexed))
+        self._index_file.flush()
+        self._data_file.seek(end)
+
+    def _remap(self):
+        """ maps the data file as it now is into memory. """
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._data_file.fileno(), 0,
+                              access=mmap.ACCESS_READ)
+
+    def _get_record_end(self, offset):
+        """ returns the offset following the record at the given offset, or
+            None if it is incomplete.
+        """
+        header_end = offset + _RECORD_HEADER.size
+        if header_end > len(self._map):
+            return None
+        key_size, payload_size = _RECORD_HEADER.unpack_from(self._map, offset)
+        end = header_end + key_size + payload_size
+        return end if end <= len(self._map) else None
+
+    def _read_key(self, offset):
+        key_size, _ = _RECORD_HEADER.unpack_from(self._map, offset)
+        start = offset + _RECORD_HEADER.size
+        return bytes(self._map[start:start + key_size])
+
+    def record(self, resp, *args, **kwargs):
+        """ A requests response hook storing the response, with its content,
+            under its request. 304 responses to cache revalidations are not
+            stored, so that the response they revalidated is replayed. The
+            content of a streamed response is read whole when it is stored,
+            so pages are not streamed while recording.
+        """
+        if resp.status_code == 304:
+            return resp
+        request = resp.request
+        key = _get_key(request.method, request.url, request.body)
+        meta = {
+            'status_code': resp.status_code,
+            'reason': resp.reason,
+            'url': resp.url,
+            'encoding': resp.encoding,
+            'headers': [
+                [name, value] for name, value in resp.headers.items()
+                if name.lower() not in _TRANSFER_HEADERS],
+        }
+        payload = zlib.compress(
+            json.dumps(meta).encode('utf-8') + b'\n' + (resp.content or b''),
+            self.compression_level)
+        with self._lock:
+            if not self.recording or self._data_file.closed:
+                raise ValueError('The archive is not open for recording')
+            offset = self._data_file.tell()
+            self._data_file.write(
+                _RECORD_HEADER.pack(len(key), len(payload)) + key + payload)
+            self._data_file.flush()
+            digest = _get_digest(key)
+            self._index_file.write(_INDEX_ENTRY.pack(digest, offset))
+            self._index_file.flush()
+            self._offsets[digest] = offset
+        return resp
+
+    def get(self, method, uri, **kwargs):
+        """ Returns the archived response to a request with the given method
+            and uri and the params, json or data given, or None.
+        """
+        request = requests.Request(
+            method.upper(), uri, params=kwargs.get('params', None),
+            json=kwargs.get('json', None),
+            data=kwargs.get('data', None)).prepare()
+        key = _get_key(request.method, request.url, request.body)
+        with self._lock:
+            offset = self._offsets.get(_get_digest(key))
+            if offset is None:
+                return None
+            if self._get_record_end(offset) is None:
+                self._remap()
+            if self._read_key(offset) != key:
+                return None
+            key_size, payload_size = _RECORD_HEADER.unpack_from(
+                self._map, offset)
+            start = offset + _RECORD_HEADER.size + key_size
+            payload = self._map[start:start + payload_size]
+        meta, _, content = zlib.decompress(payload).partition(b'\n')
+        meta = json.loads(meta.decode('utf-8'))
+        resp = requests.Response()
+        resp.status_code = meta['status_code']
+        resp.reason = meta['reason']
+        resp.url = meta['url']
+        resp.encoding = meta['encoding']
+        resp.headers = CaseInsensitiveDict(meta['headers'])
+        resp._content = content
+        resp._content_consumed = True
+        resp.elapsed = datetime.timedelta(0)
+        resp.request = request
+        return resp
+
+    def replay(self, method, uri, **kwargs):
+        """ Returns a completed future of the archived response to a request,
+            as for get, failing with a LookupError if there is none.
+        """
+        future = Future()
+        try:
+            resp = self.get(method, uri, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            return future
+        if resp is None:
+            future.set_exception(LookupError(
+                'No archived response for %s %s' % (method.upper(), uri)))
+        else:
+            future.set_result(resp)
+        return future
+
+    def __len__(self):
+        """ Returns the number of distinct requests archived. """
+        with self._lock:
+            return len(self._offsets)
+
+    def close(self):
+        """ Closes the archive's files. """
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            for archive_file in (self._data_file, self._index_file):
+                if archive_file is not None:
+                    archive_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _get_key(method, url, body):
+    """ returns the key a request's response is archived under. """
+    key = '%s %s' % (method, url)
+    if body:
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        key += ' ' + hashlib.blake2b(body, digest_size=16).hexdigest()
+    return key.encode('utf-8')
+
+
+def _get_digest(key):
+    return hashlib.blake2b(key, digest_size=16).digest()
@@ -0,0 +1,182 @@
+import asyncio
+import collections
+import json
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+from .client import (
+    BaseBugcrowdClient,
+    _get_comment_payload,
+    _get_create_submission_payload,
+    _get_remaining_page_offsets,
+    _get_submissions_params,
+    _get_transition_payload,
+    _get_update_submission_payload,
+    _get_uuid,
+)
+
+
+class AsyncBugcrowdClient(BaseBugcrowdClient):
+    """ A Bugcrowd api client for use with asyncio.
+
+        All requests share a single keep-alive connection pool and the
+        number of concurrent requests is bounded by a semaphore rather
+        than a thread pool. Requires the aiohttp package, which can be
+        installed with ``pip install bug-crowd-api-client[async]``.
+    """
+
+    # The number of submission pages get_submissions keeps in flight.
+    default_prefetch_pages = 5
+
+    def __init__(self, api_token, **kwargs):
+        """ Creates an asyncio Bugcrowd api client.
+            max_concurrency bounds the number of requests in flight and
+            max_connections the size of the connection pool. An existing
+            aiohttp.ClientSession may be provided with the session
+            parameter, in which case it will not be closed by close().
+        """
+        if aiohttp is None:
+            raise ImportError(
+                'The aiohttp package is required to use the '
+                'AsyncBugcrowdClient.')
+        super(AsyncBugcrowdClient, self).__init__(api_token, **kwargs)
+        self.max_concurrency = kwargs.get('max_concurrency', 100)
+        self.max_connections = kwargs.get(
+            'max_connections', self.max_concurrency)
+        self._session = kwargs.get('session', None)
+        self._owns_session = self._session is None
+        self._semaphore = None
+
+    @property
+    def session(self):
+        """ Returns the aiohttp session used to send requests, creating
+            it on first use so that it is bound to the running loop.
+        """
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections)
+            self._session = aiohttp.ClientSession(
+                connector=connector, headers=self.get_default_headers())
+            self._owns_session = True
+        return self._session
+
+    async def close(self):
+        """ Closes the underlying session if it is owned by the client. A
+            session given to the client is kept for later requests.
+        """
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def request(self, method, uri, **kwargs):
+        """ Sends a request and returns its decoded json body, or None if
+            the response has no body. aiohttp.ClientResponseError is
+            raised for error responses.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            async with self.session.request(method, uri, **kwargs) as resp:
+                resp.raise_for_status()
+                body = await resp.read()
+        if not body:
+            return None
+        return json.loads(body.decode('utf-8'))
+
+    async def get_bounties(self):
+        """ Returns bounties. """
+        data = await self.request('GET', self.get_api_uri('bounties'))
+        return data['bounties']
+
+    async def get_submissions(self, bounty, **kwargs):
+        """ Asynchronously yields submissions for the given bounty or
+            bounty uuid. Accepts the same params and prefetch_pages
+            parameters as BugcrowdClient.get_submissions.
+        """
+        params = kwargs.get('params', None)
+        prefetch_pages = kwargs.get('prefetch_pages',
+                                    self.default_prefetch_pages)
+        if prefetch_pages < 1:
+            raise ValueError('prefetch_pages must be at least 1')
+        submissions_uri = self.get_api_uri_for_bounty_submissions(bounty)
+        params = _get_submissions_params(params)
+        data = await self.request('GET', submissions_uri, params=params)
+        submissions = data.get('submissions', [])
+        offsets = iter(_get_remaining_page_offsets(params, data['meta']))
+        pending_fetches = collections.deque()
+
+        def fetch_next_page():
+            offset = next(offsets, None)
+            if offset is not None:
+                request_params = params.copy()
+                request_params.update({'offset': offset})
+                pending_fetches.append(asyncio.ensure_future(self.request(
+                    'GET', submissions_uri, params=request_params)))
+
+        for _ in range(prefetch_pages):
+            fetch_next_page()
+        try:
+            for submission in submissions:
+                yield submission
+            while pending_fetches:
+                future_fetch = pending_fetches.popleft()
+                fetch_next_page()
+                data = await future_fetch
+                for submission in data['submissions']:
+                    yield submission
+        finally:
+            for future_fetch in pending_fetches:
+                future_fetch.cancel()
+
+    async def get_comments_for_submission(self, submission):
+        """ Returns comment information for the given submission or
+        submission uuid.
+        """
+        comments_uri = self.get_api_uri_for_submission_comments(submission)
+        return await self.request('GET', comments_uri)
+
+    async def get_attachments_for_submission(self, submission):
+        """ Returns attachment information for the given submission or
+        submission uuid.
+        """
+        attach_uri = self.get_api_uri_for_submission_attachments(submission)
+        return await self.request('GET', attach_uri)
+
+    async def create_submission(self, bounty, submission_fields):
+        """ Creates a submission in the given bounty or bounty uuid and
+            returns the response body.
+        """
+        uri = self.get_api_uri_for_bounty_submissions(_get_uuid(bounty))
+        payload = _get_create_submission_payload(submission_fields)
+        return await self.request('POST', uri, json=payload)
+
+    async def update_submission(self, submission, **kwargs):
+        """ Updates the given submission and returns the response body. """
+        uri = self.get_api_uri_for_submission(submission)
+        payload = _get_update_submission_payload(**kwargs)
+        return await self.request('PUT', uri, json=payload)
+
+    async def comment_on_submission(self, submission, comment_text,
+                                    comment_type='note'):
+        """ Comments on the given submission and returns the response
+            body.
+        """
+        uri = self.get_api_uri_for_submission_comments(submission)
+        payload = _get_comment_payload(comment_text, comment_type)
+        return await self.request('POST', uri, json=payload)
+
+    async def transition_submission(self, submission, state, **kwargs):
+        """ Transitions the given submission or submission uuid to a
+            different state and returns the response body.
+        """
+        uri = self.get_api_uri_for_submission(submission) + '/transition'
+        payload = _get_transition_payload(state, **kwargs)
+        return await self.request('POST', uri, json=payload)
@@ -0,0 +1,312 @@
+import collections
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .batch import BatchReport
+from .client import _get_uuid
+
+
+_UNSAFE_CHARACTERS_RE = re.compile(r'[^\w.\- ]')
+
+
+class AttachmentResult(object):
+    """ The outcome of downloading an attachment.
+
+        status is 'downloaded', 'resumed' when a partial download was
+        continued, 'duplicate' when the content was already stored for
+        another attachment, 'skipped' when it had already been downloaded
+        and None when the download failed.
+    """
+
+    __slots__ = ('submission_uuid', 'attachment', 'path', 'status',
+                 'size', 'sha256', 'error')
+
+    def __init__(self, submission_uuid, attachment, path=None, status=None,
+                 size=None, sha256=None, error=None):
+        self.submission_uuid = submission_uuid
+        self.attachment = attachment
+        self.path = path
+        self.status = status
+        self.size = size
+        self.sha256 = sha256
+        self.error = error
+
+    @property
+    def ok(self):
+        """ Returns whether the attachment was downloaded. """
+        return self.error is None
+
+
+class AttachmentStore(object):
+    """ A directory of downloaded attachments.
+
+        Each attachment is saved as <submission uuid>/<file name>, where
+        file names are made safe and those of a submission's attachments
+        that would otherwise be the same are numbered apart. Content
+        is stored once, under .objects by its sha256 digest, and hard
+        linked into place, so identical attachments only use disk space
+        once. Downloads in progress are kept under .partial so they can be
+        resumed, and manifest.json records the size and digest of each
+        completed download so it can be verified and skipped later.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._manifest_path = os.path.join(directory, 'manifest.json')
+        for name in ('.objects', '.partial'):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+        try:
+            with open(self._manifest_path) as f:
+                self._manifest = json.load(f)
+        except FileNotFoundError:
+            self._manifest = {}
+
+    def get_path(self, submission_uuid, file_name):
+        """ Returns the path an attachment is saved to. """
+        return os.path.join(self.directory, submission_uuid,
+                            _get_safe_file_name(file_name))
+
+    def get_partial_path(self, submission_uuid, file_name):
+        """ Returns the path an attachment is downloaded to. """
+        return os.path.join(self.directory, '.partial', '%s-%s.part' % (
+            submission_uuid, _get_safe_file_name(file_name)))
+
+    def get_entry(self, submission_uuid, file_name):
+        """ Returns the size and sha256 digest recorded for an attachment,
+            or None if it has not been downloaded.
+        """
+        with self._lock:
+            return self._manifest.get(
+                _get_manifest_key(submission_uuid, file_name))
+
+    def add(self, submission_uuid, file_name, partial_path, size, sha256):
+        """ Moves a completed download into place, returning its path and
+            whether its content was already stored.
+        """
+        path = self.get_path(submission_uuid, file_name)
+        object_path = os.path.join(self.directory, '.objects', sha256)
+        with self._lock:
+            duplicate = os.path.exists(object_path)
+            if duplicate:
+                os.unlink(partial_path)
+            else:
+                os.replace(partial_path, object_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.lexists(path):
+                os.unlink(path)
+            try:
+                os.link(object_path, path)
+            except OSError:
+                shutil.copyfile(object_path, path)
+            self._manifest[_get_manifest_key(submission_uuid, file_name)] = {
+                'size': size, 'sha256': sha256}
+        return path, duplicate
+
+    def save(self):
+        """ Writes the manifest. """
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self._manifest, f)
+                os.replace(tmp_path, self._manifest_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+
+def download_attachments(client, submissions, directory, **kwargs):
+    """ Downloads the attachments of the given submissions into directory,
+        an AttachmentStore path, and returns a BatchReport of
+        AttachmentResults in submission order.
+
+        Up to max_in_flight attachments are downloaded at a time, each
+        streamed to disk chunk_size bytes at a time. An interrupted
+        download is resumed with a range request, both when retried, up to
+        max_attempts times, and when the attachments are downloaded again
+        later. Downloads are checked against the attachment's file_size and
+        already downloaded attachments are skipped, after checking their
+        sha256 digest when verify is set.
+    """
+    max_in_flight = kwargs.get('max_in_flight', 4)
+    if max_in_flight < 1:
+        raise ValueError('max_in_flight must be at least 1')
+    store = AttachmentStore(directory)
+    session = _create_download_session(client)
+    download = _Downloader(session, store, kwargs)
+    results = []
+    pending = collections.deque()
+    try:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for submission in client.enrich_submissions(
+                    submissions, include=('attachments',),
+                    max_in_flight=max_in_flight):
+                submission_uuid = _get_uuid(submission)
+                attachments = submission['attachments'].get(
+                    'file_attachments', [])
+                for attachment, file_name in zip(
+                        attachments, _get_unique_file_names(attachments)):
+                    if len(pending) >= max_in_flight:
+                        results.append(pending.popleft().result())
+                    pending.append(executor.submit(
+                        download, submission_uuid, attachment, file_name))
+            while pending:
+                results.append(pending.popleft().result())
+    finally:
+        for future in pending:
+            future.cancel()
+        store.save()
+    return BatchReport(results)
+
+
+def _create_download_session(client):
+    """ returns a session sharing the client's connection pool that sends
+        no credentials, since attachment urls are pre-signed, and asks for
+        uncompressed content so ranges are byte offsets of the file. The
+        session holds nothing but the borrowed adapter, so it is not closed,
+        which would close the pool for every client of the transport.
+    """
+    session = requests.Session()
+    session.mount('https://', client.transport.adapter)
+    session.mount('http://', client.transport.adapter)
+    session.headers.update(client.transport.get_default_headers())
+    session.headers['Accept-Encoding'] = 'identity'
+    return session
+
+
+class _Downloader(object):
+    """ downloads single attachments into a store. """
+
+    def __init__(self, session, store, kwargs):
+        self.session = session
+        self.store = store
+        self.chunk_size = kwargs.get('chunk_size', 64 * 1024)
+        self.max_attempts = kwargs.get('max_attempts', 3)
+        self.verify = kwargs.get('verify', True)
+
+    def __call__(self, submission_uuid, attachment, file_name):
+        result = AttachmentResult(submission_uuid, attachment)
+        try:
+            self._download(result, file_name)
+        except Exception as e:
+            result.error = e
+        return result
+
+    def _download(self, result, file_name):
+        expected_size = result.attachment.get('file_size')
+        entry = self.store.get_entry(result.submission_uuid, file_name)
+        path = self.store.get_path(result.submission_uuid, file_name)
+        if entry is not None and self._is_complete(path, entry):
+            result.path = path
+            result.status = 'skipped'
+            result.size = entry['size']
+            result.sha256 = entry['sha256']
+            return
+        partial_path = self.store.get_partial_path(
+            result.submission_uuid, file_name)
+        resumed = False
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                resumed = self._fetch(
+                    result.attachment['s3_signed_url'], partial_path,
+                    expected_size) or resumed
+                break
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError):
+                if attempt == self.max_attempts:
+                    raise
+        size, sha256 = _hash_file(partial_path, self.chunk_size)
+        if expected_size is not None and size != expected_size:
+            os.unlink(partial_path)
+            raise ValueError('Expected %d bytes for %s but got %d' % (
+                expected_size, result.attachment['file_name'], size))
+        result.path, duplicate = self.store.add(
+            result.submission_uuid, file_name, partial_path, size, sha256)
+        result.size = size
+        result.sha256 = sha256
+        if duplicate:
+            result.status = 'duplicate'
+        else:
+            result.status = 'resumed' if resumed else 'downloaded'
+
+    def _is_complete(self, path, entry):
+        """ returns whether the file at path matches a manifest entry. """
+        try:
+            if os.path.getsize(path) != entry['size']:
+                return False
+        except OSError:
+            return False
+        return (not self.verify or
+                _hash_file(path, self.chunk_size)[1] == entry['sha256'])
+
+    def _fetch(self, uri, partial_path, expected_size):
+        """ downloads uri to partial_path, continuing from any content
+            already there, and returns whether it was resumed.
+        """
+        offset = 0
+        if os.path.exists(partial_path):
+            offset = os.path.getsize(partial_path)
+        if offset and offset == expected_size:
+            return True
+        headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+        with self.session.get(uri, headers=headers, stream=True) as resp:
+            if resp.status_code == 416:
+                os.unlink(partial_path)
+                return self._fetch(uri, partial_path, expected_size)
+            resp.raise_for_status()
+            resumed = bool(offset) and resp.status_code == 206
+            with open(partial_path, 'ab' if resumed else 'wb') as f:
+                for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+        return resumed
+
+
+def _hash_file(path, chunk_size):
+    """ returns the size and sha256 hex digest of a file. """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+
+def _get_safe_file_name(file_name):
+    """ returns the file name with any path or unusual characters
+        replaced.
+    """
+    name = _UNSAFE_CHARACTERS_RE.sub('_', os.path.basename(file_name))
+    return name.lstrip('.') or 'attachment'
+
+
+def _get_unique_file_names(attachments):
+    """ returns the safe file names to save the given attachments of a
+        submission as, numbering names that are already taken, ignoring
+        case, so that no two attachments share a path.
+    """
+    names = []
+    taken = set()
+    for attachment in attachments:
+        name = _get_safe_file_name(attachment['file_name'])
+        root, extension = os.path.splitext(name)
+        number = 1
+        while name.lower() in taken:
+            number += 1
+            name = '%s-%d%s' % (root, number, extension)
+        taken.add(name.lower())
+        names.append(name)
+    return names
+
+
+def _get_manifest_key(submission_uuid, file_name):
+    return '%s/%s' % (submission_uuid, file_name)
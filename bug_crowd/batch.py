@@ -0,0 +1,101 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# The client methods that may be used in a batch.
+BATCH_METHODS = frozenset([
+    'create_submission',
+    'update_submission',
+    'comment_on_submission',
+    'transition_submission',
+])
+
+
+class BatchOperation(object):
+    """ A call to one of the client's write methods. """
+
+    __slots__ = ('method', 'args', 'kwargs')
+
+    def __init__(self, method, *args, **kwargs):
+        if method not in BATCH_METHODS:
+            raise ValueError('%s can not be used in a batch' % method)
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return 'BatchOperation(%r, *%r, **%r)' % (
+            self.method, self.args, self.kwargs)
+
+
+class OperationResult(object):
+    """ The outcome of a BatchOperation. """
+
+    __slots__ = ('operation', 'response', 'error', 'latency')
+
+    def __init__(self, operation, response=None, error=None, latency=0.0):
+        self.operation = operation
+        self.response = response
+        self.error = error
+        self.latency = latency
+
+    @property
+    def ok(self):
+        """ Returns whether the operation succeeded. """
+        return self.error is None
+
+
+class BatchReport(object):
+    """ The results of a batch, in the order of its operations. """
+
+    def __init__(self, results):
+        self.results = results
+
+    @property
+    def succeeded(self):
+        """ Returns the results of the operations that succeeded. """
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self):
+        """ Returns the results of the operations that failed. """
+        return [result for result in self.results if not result.ok]
+
+    def __len__(self):
+        return len(self.results)
+
+    def __iter__(self):
+        return iter(self.results)
+
+
+def run_batch(client, operations, **kwargs):
+    """ Runs the given BatchOperations with at most max_in_flight of them
+        in progress at a time and returns a BatchReport.
+
+        Requests go through the client's scheduler so are rate limited and
+        retried as usual. A failing operation, whether through invalid
+        arguments or an error response, is recorded in the report and does
+        not stop the rest of the batch.
+    """
+    max_in_flight = kwargs.get('max_in_flight', 10)
+    if max_in_flight < 1:
+        raise ValueError('max_in_flight must be at least 1')
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = [executor.submit(_run_operation, client, operation)
+                   for operation in operations]
+        return BatchReport([future.result() for future in futures])
+
+
+def _run_operation(client, operation):
+    """ runs the given operation and returns its OperationResult. """
+    started_at = time.monotonic()
+    resp = None
+    try:
+        method = getattr(client, operation.method)
+        resp = method(*operation.args, **operation.kwargs).result()
+        resp.raise_for_status()
+    except Exception as e:
+        return OperationResult(operation, response=resp, error=e,
+                               latency=time.monotonic() - started_at)
+    return OperationResult(operation, response=resp,
+                           latency=time.monotonic() - started_at)
@@ -0,0 +1,348 @@
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+from .batch import BatchOperation, run_batch
+from .client import BugcrowdClient
+from .fake_server import FakeBugcrowdServer
+from .instrumentation import Instrumentation
+from .scheduler import RequestScheduler
+from .transport import Transport
+
+
+class _LatencyRecorder(Instrumentation):
+    """ records the latency of every request. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+
+    def request_finished(self, span):
+        with self._lock:
+            self.latencies.append(span.latency)
+
+
+def _percentile(values, percent):
+    """ returns the given percentile of the values by nearest rank. """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[min(len(values), max(1, rank)) - 1]
+
+
+def _get_peak_rss():
+    """ returns the peak resident set size of the process in bytes, which
+        for a scenario run with _run_isolated is that of the scenario alone.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def create_client(server, workers):
+    """ Returns a BugcrowdClient for the given fake server using the given
+        number of session workers.
+    """
+    recorder = _LatencyRecorder()
+    client = BugcrowdClient('benchmark-token', instrumentation=recorder,
+                            scheduler=RequestScheduler(backoff_factor=0.01),
+                            transport=Transport(max_workers=workers))
+    client.base_uri = server.base_uri
+    return client, recorder
+
+
+def _run_scenario(name, server, workers, run, **details):
+    """ runs a scenario and returns its results. """
+    client, recorder = create_client(server, workers)
+    requests_before = server.request_count
+    started_at = time.monotonic()
+    items = run(client)
+    duration = time.monotonic() - started_at
+    client.transport.close()
+    requests = server.request_count - requests_before
+    result = {
+        'scenario': name,
+        'workers': workers,
+        'items': items,
+        'requests': requests,
+        'seconds': duration,
+        'requests_per_second': requests / duration if duration else None,
+        'p50_latency': _percentile(recorder.latencies, 50),
+        'p99_latency': _percentile(recorder.latencies, 99),
+        'peak_rss': _get_peak_rss(),
+    }
+    result.update(details)
+    return result
+
+
+def benchmark_get_submissions(server, workers, page_size):
+    """ Benchmarks reading every submission of the first bounty. """
+    bounty = server.bounties[0]
+
+    def run(client):
+        params = {'sort': 'newest', 'offset': 0, 'limit': page_size}
+        return sum(1 for _ in client.get_submissions(bounty, params=params))
+    return _run_scenario('get_submissions', server, workers, run,
+                         page_size=page_size)
+
+
+def benchmark_bulk_writes(server, workers, count):
+    """ Benchmarks transitioning submissions with run_batch. """
+    submissions = server.submissions[server.bounties[0]['uuid']][:count]
+
+    def run(client):
+        operations = [
+            BatchOperation('transition_submission', submission, 'triaged')
+            for submission in submissions]
+        report = run_batch(client, operations, max_in_flight=workers)
+        return len(report.succeeded)
+    return _run_scenario('bulk_writes', server, workers, run)
+
+
+def benchmark_enrichment(server, workers, count):
+    """ Benchmarks fetching comments and attachments of submissions. """
+    submissions = server.submissions[server.bounties[0]['uuid']][:count]
+
+    def run(client):
+        return sum(1 for _ in client.enrich_submissions(
+            submissions, max_in_flight=workers))
+    return _run_scenario('enrichment', server, workers, run)
+
+
+class _ServerView(object):
+    """ the parts of a FakeBugcrowdServer used by a scenario run in another
+        process, which counts the requests itself.
+    """
+
+    def __init__(self, base_uri, bounties, submissions):
+        self.base_uri = base_uri
+        self.bounties = bounties
+        self.submissions = submissions
+        self.request_count = 0
+
+
+# The scenarios run by run_benchmarks, each taking the server, the number of
+# workers and a page size or number of submissions.
+_SCENARIOS = {
+    'get_submissions': benchmark_get_submissions,
+    'bulk_writes': benchmark_bulk_writes,
+    'enrichment': benchmark_enrichment,
+}
+
+
+def _get_subprocess_env():
+    """ returns the environment for interpreters importing this package. """
+    env = dict(os.environ)
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        path for path in (package_dir, env.get('PYTHONPATH')) if path)
+    return env
+
+
+def _run_isolated(server, name, workers, size):
+    """ runs a scenario against the server in a fresh interpreter, so that
+        its peak_rss is its own and excludes the server and earlier
+        scenarios, and returns its results.
+    """
+    bounty = server.bounties[0]
+    submissions = []
+    if name != 'get_submissions':
+        submissions = server.submissions[bounty['uuid']][:size]
+    state = {
+        'scenario': name,
+        'workers': workers,
+        'size': size,
+        'base_uri': server.base_uri,
+        'bounties': [bounty],
+        'submissions': {bounty['uuid']: submissions},
+    }
+    requests_before = server.request_count
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'bug_crowd.benchmark', '--run-scenario'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        env=_get_subprocess_env())
+    output, _ = process.communicate(json.dumps(state).encode('utf-8'))
+    if process.returncode:
+        raise RuntimeError('The %s scenario failed' % name)
+    result = json.loads(output.decode('utf-8'))
+    result['requests'] = requests = server.request_count - requests_before
+    duration = result['seconds']
+    result['requests_per_second'] = requests / duration if duration else None
+    return result
+
+
+def _run_scenario_state(state):
+    """ runs the scenario described by state in this process. """
+    server = _ServerView(state['base_uri'], state['bounties'],
+                         state['submissions'])
+    return _SCENARIOS[state['scenario']](
+        server, state['workers'], state['size'])
+
+
+# Times a cold start of the client in a fresh interpreter: importing it,
+# creating a client and building a uri, which should not import requests, and
+# its first request to the server at the given uri.
+_COLD_START_SCRIPT = """
+import json
+import sys
+import time
+
+started_at = time.perf_counter()
+from bug_crowd.client import BugcrowdClient
+imported_at = time.perf_counter()
+client = BugcrowdClient('benchmark-token')
+client.base_uri = sys.argv[1]
+client.get_api_uri_for_bounty_submissions({'uuid': 'bounty'})
+created_at = time.perf_counter()
+requests_imported = 'requests' in sys.modules
+client.get_bounties()
+requested_at = time.perf_counter()
+json.dump({
+    'import_seconds': imported_at - started_at,
+    'client_seconds': created_at - imported_at,
+    'first_request_seconds': requested_at - created_at,
+    'requests_imported': requests_imported,
+}, sys.stdout)
+"""
+
+
+def benchmark_cold_start(server, runs=5):
+    """ Benchmarks importing the client, creating a client and sending its
+        first request in fresh interpreters, returning the median times of
+        the given number of runs.
+    """
+    env = _get_subprocess_env()
+    timings = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', _COLD_START_SCRIPT, server.base_uri],
+            env=env)
+        timings.append(json.loads(output.decode('utf-8')))
+    result = {'scenario': 'cold_start', 'runs': runs}
+    for name in ('import_seconds', 'client_seconds', 'first_request_seconds'):
+        result[name] = _percentile([t[name] for t in timings], 50)
+    result['requests_imported'] = any(t['requests_imported'] for t in timings)
+    return result
+
+
+def run_benchmarks(**kwargs):
+    """ Runs every benchmark scenario against a fake server and returns
+        their results. Each scenario runs in its own interpreter so that
+        its peak_rss is not that of the server or of earlier scenarios.
+    """
+    page_sizes = kwargs.get('page_sizes', (25, 100, 250))
+    worker_counts = kwargs.get('worker_counts', (1, 5, 20))
+    submissions = kwargs.get('submissions', 1000)
+    write_count = kwargs.get('write_count', 200)
+    server = FakeBugcrowdServer(
+        submissions_per_bounty=submissions,
+        latency=kwargs.get('latency', 0.005),
+        rate_limit_ratio=kwargs.get('rate_limit_ratio', 0),
+        error_ratio=kwargs.get('error_ratio', 0))
+    results = []
+    with server:
+        for workers in worker_counts:
+            for page_size in page_sizes:
+                results.append(_run_isolated(
+                    server, 'get_submissions', workers, page_size))
+            results.append(_run_isolated(
+                server, 'bulk_writes', workers, write_count))
+            results.append(_run_isolated(
+                server, 'enrichment', workers, write_count))
+    return results
+
+
+def _format_results(results):
+    """ returns the results as a text table. """
+    columns = [
+        ('scenario', '%-16s'), ('workers', '%7s'), ('page_size', '%9s'),
+        ('items', '%6s'), ('requests', '%8s'),
+        ('requests_per_second', '%8.1f'), ('p50_latency', '%11.4f'),
+        ('p99_latency', '%11.4f'), ('peak_rss', '%11s')]
+    widths = [len(fmt % (0.0 if 'f' in fmt else '')) for _, fmt in columns]
+    names = ['req/s' if name == 'requests_per_second' else name
+             for name, _ in columns]
+    lines = [' '.join(name[:width].rjust(width)
+                      for name, width in zip(names, widths))]
+    for result in results:
+        cells = []
+        for (name, fmt), width in zip(columns, widths):
+            value = result.get(name)
+            cells.append('-'.rjust(width) if value is None else fmt % value)
+        lines.append(' '.join(cells))
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None):
+    """ Runs the benchmarks and prints their results. """
+    parser = argparse.ArgumentParser(
+        description='Benchmark the Bugcrowd client against a local fake '
+                    'Bugcrowd api.')
+    parser.add_argument('--quick', action='store_true',
+                        help='run a small, fast set of scenarios')
+    parser.add_argument('--submissions', type=int, default=1000)
+    parser.add_argument('--writes', type=int, default=200,
+                        help='the number of bulk writes and enrichments')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds of latency added to every response')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0)
+    parser.add_argument('--error-ratio', type=float, default=0)
+    parser.add_argument('--page-sizes', default='25,100,250')
+    parser.add_argument('--workers', default='1,5,20')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as json')
+    parser.add_argument('--cold-start', type=int, metavar='RUNS',
+                        help='only time importing the client and its first '
+                             'request over the given number of runs')
+    parser.add_argument('--run-scenario', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.run_scenario:
+        json.dump(_run_scenario_state(json.load(sys.stdin)), sys.stdout)
+        return 0
+    if args.cold_start:
+        with FakeBugcrowdServer(submissions_per_bounty=0,
+                                latency=args.latency) as server:
+            result = benchmark_cold_start(server, args.cold_start)
+        if args.json:
+            json.dump(result, sys.stdout, indent=2)
+            sys.stdout.write('\n')
+        else:
+            sys.stdout.write(''.join(
+                '%s: %s\n' % (name, result[name]) for name in sorted(result)))
+        return 0
+    kwargs = {
+        'submissions': args.submissions,
+        'write_count': args.writes,
+        'latency': args.latency,
+        'rate_limit_ratio': args.rate_limit_ratio,
+        'error_ratio': args.error_ratio,
+        'page_sizes': [int(x) for x in args.page_sizes.split(',')],
+        'worker_counts': [int(x) for x in args.workers.split(',')],
+    }
+    if args.quick:
+        kwargs.update(submissions=200, write_count=20, page_sizes=[50],
+                      worker_counts=[5])
+    results = run_benchmarks(**kwargs)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        sys.stdout.write(_format_results(results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class CacheEntry(object):
+    """ A cached api response. """
+
+    __slots__ = ('uri', 'data', 'etag', 'last_modified', 'stored_at')
+
+    def __init__(self, uri, data, etag, last_modified, stored_at):
+        self.uri = uri
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+
+    def get_conditional_headers(self):
+        """ Returns the headers used to revalidate the entry. """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache(object):
+    """ A sqlite backed cache of decoded api responses keyed on their uri.
+
+        Entries younger than ttl seconds are used without contacting the
+        api, older entries are revalidated with conditional requests. Once
+        more than max_entries responses are cached the least recently used
+        are evicted.
+    """
+
+    def __init__(self, path=':memory:', ttl=0, max_entries=1000,
+                 clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'uri TEXT PRIMARY KEY, data TEXT NOT NULL, etag TEXT, '
+                'last_modified TEXT, stored_at REAL NOT NULL, '
+                'accessed_at REAL NOT NULL)')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS responses_accessed_at '
+                'ON responses (accessed_at)')
+
+    def get(self, uri):
+        """ Returns the CacheEntry for the given uri or None. """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT data, etag, last_modified, stored_at FROM responses '
+                'WHERE uri = ?', (uri,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                'UPDATE responses SET accessed_at = ? WHERE uri = ?',
+                (self._clock(), uri))
+        data, etag, last_modified, stored_at = row
+        return CacheEntry(uri, json.loads(data), etag, last_modified,
+                          stored_at)
+
+    def is_fresh(self, entry):
+        """ Returns whether the entry can be used without revalidation. """
+        return self._clock() - entry.stored_at < self.ttl
+
+    def set(self, uri, data, etag=None, last_modified=None):
+        """ Caches the decoded response for the given uri. """
+        now = self._clock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (uri, data, etag, '
+                'last_modified, stored_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (uri, json.dumps(data), etag, last_modified, now, now))
+            self._conn.execute(
+                'DELETE FROM responses WHERE uri IN (SELECT uri FROM '
+                'responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,))
+
+    def refresh(self, uri):
+        """ Marks the entry for the given uri as having been revalidated. """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE responses SET stored_at = ? WHERE uri = ?',
+                (self._clock(), uri))
+
+    def invalidate(self, uri):
+        """ Removes the entries for the given uri and the uris beneath it. """
+        prefix = uri.rstrip('/') + '/'
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM responses WHERE uri = ? OR '
+                'substr(uri, 1, ?) = ?', (uri, len(prefix), prefix))
+
+    def clear(self):
+        """ Removes every entry. """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM responses')
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self):
+        """ Closes the underlying database connection. """
+        self._conn.close()
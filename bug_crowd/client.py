@@ -1,86 +1,40 @@
-from urllib.parse import quote as url_quote
+import collections
+import datetime
+import functools
+import json
+import threading
+import time
+from urllib.parse import quote as url_quote, urlsplit
 
-from requests_futures.sessions import FuturesSession
+from .instrumentation import CallStats, RequestSpan, get_endpoint
+from .scheduler import RequestScheduler, get_timeout
+from .streaming import iter_array_items
+from .transport import Transport
 
 
 def _get_uuid(obj):
-    """ returns the uuid of a bounty or submission object. """
+    """ returns the uuid of a bounty or submission object or model. """
     if isinstance(obj, str):
         return obj
     return obj['uuid']
 
 
-class BugcrowdClient(object):
+class BaseBugcrowdClient(object):
+    """ Functionality shared by the Bugcrowd api clients that does not
+        depend on how requests are sent.
+    """
 
     def __init__(self, api_token, **kwargs):
-        """ Creates a Bugcrowd api client. """
         self._api_token = api_token
-        self.session = FuturesSession(max_workers=5)
         self.base_uri = 'https://api.bugcrowd.com/'
-        self.session.headers.update({
+
+    def get_default_headers(self):
+        """ Returns the headers sent with every api request. """
+        return {
             'Accept': 'application/vnd.bugcrowd.v3+json',
             'Authorization': 'Token %s' % self._api_token,
             'user-agent': 'Bugcrowd Python Client',
-        })
-
-    def get_bounties(self):
-        """ Returns bounties. """
-        resp = self.session.get(self.get_api_uri('bounties')).result()
-        resp.raise_for_status()
-        return resp.json()['bounties']
-
-    def get_submissions(self, bounty, **kwargs):
-        """ Yields submissions for the given bounty or bounty uuid.
-            By providing a params parameter submissions can be filtered
-            as per https://docs.bugcrowd.com/v1.0/docs/submission .
-        """
-        params = kwargs.get('params', None)
-        submissions_uri = self.get_api_uri_for_bounty_submissions(bounty)
-        submissions = []
-        if params is None:
-            params = {'sort': 'newest', 'offset': 0}
-        step = params.get('limit', 250)
-        params['limit'] = step
-        initial_response = self.session.get(
-            submissions_uri, params=params).result()
-        initial_response.raise_for_status()
-        data = initial_response.json()
-        submissions += data.get('submissions', [])
-        total = data['meta']['count']
-        total_hits = data['meta']['total_hits']
-        for submission in submissions:
-            yield submission
-        if total < total_hits:
-            async_fetches = []
-            for offset in range(step, total_hits, step):
-                request_params = params.copy()
-                request_params.update({'offset': offset})
-                async_fetches.append(
-                    self.session.get(submissions_uri, params=request_params))
-            for future_fetch in async_fetches:
-                fetch = future_fetch.result()
-                fetch.raise_for_status()
-                data = fetch.json()
-                for submission in data['submissions']:
-                    yield submission
-
-    def get_comments_for_submission(self, submission):
-        """ Returns comment information for the given submission or
-        submission uuid.
-        """
-        comments_uri = self.get_api_uri_for_submission_comments(submission)
-        resp = self.session.get(comments_uri).result()
-        resp.raise_for_status()
-        return resp.json()
-
-    def get_attachments_for_submission(self, submission):
-        """ Returns attachment information for the given submission or
-        submission uuid.
-        """
-        attach_uri = self.get_api_uri_for_submission_attachments(submission)
-        resp = self.session.get(attach_uri).result()
-        resp.raise_for_status()
-        return resp.json()
+        }
 
     def get_api_uri(self, path):
         """ Returns the full api uri for the given path. """
@@ -111,67 +65,768 @@ class BugcrowdClient(object):
         return self.get_api_uri_for_submission(
             submission) + '/file_attachments'
 
-    def create_submission(self, bounty, submission_fields):
+
+class BugcrowdClient(BaseBugcrowdClient):
+
+    # The number of submission pages get_submissions keeps in flight.
+    default_prefetch_pages = 5
+
+    # The number of bytes read at a time when streaming responses.
+    stream_chunk_size = 64 * 1024
+
+    def __init__(self, api_token, **kwargs):
+        """ Creates a Bugcrowd api client.
+            Requests are sent through the given RequestScheduler, or one
+            created with default settings, which rate limits and retries
+            them. A scheduler may be shared by several clients so that
+            they share a rate limit. Bounties, comments and attachments are
+            cached in the given ResponseCache, if any. Requests are
+            reported to the given Instrumentation, if any. The given
+            Transport, or one with five workers, sets the threads and
+            connection pool used and may be shared by several clients.
+            Unless single_flight is unset, concurrent identical GETs made
+            through fetch_json share one request and one decoded result.
+            Responses are recorded to the given ResponseArchive, if any,
+            when it is opened for recording, or otherwise served from it
+            without any requests being sent.
+        """
+        super(BugcrowdClient, self).__init__(api_token, **kwargs)
+        self.transport = kwargs.get('transport', None) or Transport()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.scheduler = kwargs.get('scheduler', None) or RequestScheduler()
+        self.cache = kwargs.get('cache', None)
+        self.instrumentation = kwargs.get('instrumentation', None)
+        self.single_flight = kwargs.get('single_flight', True)
+        self.archive = kwargs.get('archive', None)
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self._write_generations = collections.Counter()
+        self._write_generations_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """ Returns the FuturesSession requests are sent with, created on
+            first use so that clients only used for their uris never start
+            the transport.
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self.transport.create_session(
+                        self.get_default_headers())
+        return self._session
+
+    def request(self, method, uri, **kwargs):
+        """ Returns a future request sent through the client's scheduler, or
+            served from the client's archive when replaying one. A
+            TimeoutError is raised rather than waiting for the rate limit,
+            or a retry, past the time.monotonic deadline given as deadline.
+        """
+        deadline = kwargs.pop('deadline', None)
+        archive = self.archive
+        if archive is not None and not archive.recording:
+            return archive.replay(method, uri, **kwargs)
+        send = getattr(self.session, method.lower())
+        if archive is not None:
+            kwargs['hooks'] = {'response': archive.record}
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return self.scheduler.submit(
+                method, functools.partial(send, uri, **kwargs),
+                deadline=deadline)
+        span = RequestSpan(method, uri,
+                           get_endpoint(method, urlsplit(uri).path),
+                           queue_depth=self._get_queue_depth())
+        kwargs['hooks'] = {'response': span.on_response}
+        if archive is not None:
+            kwargs['hooks']['response'] = [span.on_response, archive.record]
+
+        def on_result(resp, error, attempts):
+            span.retries = attempts - 1
+            span.finish(resp, error)
+            instrumentation.request_finished(span)
+
+        instrumentation.request_started(span)
+        request = self.scheduler.submit(
+            method, functools.partial(send, uri, **kwargs), on_result,
+            deadline)
+        request.span = span
+        return request
+
+    def _get_queue_depth(self):
+        """ Returns the number of requests waiting for a session worker. """
+        work_queue = getattr(self.session.executor, '_work_queue', None)
+        return work_queue.qsize() if work_queue is not None else 0
+
+    def _decode_json(self, request, resp):
+        """ Returns the decoded json body of the response to the given
+            request, reporting the time taken to the client's
+            instrumentation.
+        """
+        span = getattr(request, 'span', None)
+        if span is None:
+            return resp.json()
+        started_at = time.monotonic()
+        data = resp.json()
+        self.instrumentation.response_decoded(
+            span, time.monotonic() - started_at)
+        return data
+
+    def get_json(self, uri, params=None):
+        """ Returns the decoded response of a GET request to the given uri,
+            using and updating the client's cache if it has one.
+        """
+        return self.fetch_json(uri, params).result()
+
+    def fetch_json(self, uri, params=None):
+        """ Returns a future-like object for the decoded response of a GET
+            request to the given uri, using and updating the client's cache
+            if it has one. Requests with params are not cached.
+
+            With single_flight set, a fetch of the same uri and params as
+            one still in flight shares its request and its decoded result,
+            which callers should therefore not modify.
+        """
+        if not self.single_flight:
+            return self._fetch_json(uri, params)
+        key = (uri, _get_params_key(params))
+        with self._in_flight_lock:
+            fetch = self._in_flight.get(key)
+            if fetch is not None and not fetch.done():
+                shared = True
+            else:
+                shared = False
+                fetch = self._in_flight[key] = self._fetch_json(uri, params)
+        if shared:
+            if self.instrumentation is not None:
+                self.instrumentation.request_coalesced(
+                    get_endpoint('GET', urlsplit(uri).path))
+        else:
+            fetch.add_done_callback(
+                lambda _: self._forget_fetch(key, fetch))
+        return fetch
+
+    def _fetch_json(self, uri, params):
+        """ Returns a new _JSONFetch for the given uri and params. """
+        kwargs = {} if params is None else {'params': params}
+        if self.cache is None or params is not None:
+            return _JSONFetch(self, uri, self.request('GET', uri, **kwargs))
+        entry = self.cache.get(uri)
+        if entry is not None and self.cache.is_fresh(entry):
+            return _JSONFetch(self, uri, None, entry)
+        headers = entry.get_conditional_headers() if entry else {}
+        return _JSONFetch(
+            self, uri, self.request('GET', uri, headers=headers), entry)
+
+    def _forget_fetch(self, key, fetch):
+        """ Stops sharing the given fetch once its request has finished. """
+        with self._in_flight_lock:
+            if self._in_flight.get(key) is fetch:
+                del self._in_flight[key]
+
+    def invalidate_submission(self, submission):
+        """ Removes cached responses for the given submission or
+            submission uuid. Responses to GETs sent before this are then
+            not cached once they arrive, nor shared with later fetches.
+        """
+        submission_uuid = _get_uuid(submission)
+        with self._in_flight_lock:
+            for key in list(self._in_flight):
+                if _get_submission_uuid(key[0]) == submission_uuid:
+                    del self._in_flight[key]
+        if self.cache is not None:
+            with self._write_generations_lock:
+                self._write_generations[_get_uuid(submission)] += 1
+            self.cache.invalidate(self.get_api_uri_for_submission(submission))
+
+    def _get_write_generation(self, uri):
+        """ returns the number of times the submission the given uri
+            belongs to, if any, has been invalidated.
+        """
+        submission_uuid = _get_submission_uuid(uri)
+        if submission_uuid is None:
+            return 0
+        return self._write_generations[submission_uuid]
+
+    def get_bounties(self, **kwargs):
+        """ Returns bounties, as instances of the given model class if
+            one is provided.
+        """
+        bounties = self.get_json(self.get_api_uri('bounties'))['bounties']
+        model = kwargs.get('model', None)
+        if model is not None:
+            bounties = [model.from_dict(bounty) for bounty in bounties]
+        return bounties
+
+    def get_submissions(self, bounty, **kwargs):
+        """ Yields submissions for the given bounty or bounty uuid.
+            By providing a params parameter submissions can be filtered
+            as per https://docs.bugcrowd.com/v1.0/docs/submission .
+            At most prefetch_pages pages (default_prefetch_pages by default)
+            are requested ahead of the page currently being consumed.
+            Submissions are yielded as instances of the given model class,
+            such as models.Submission, if one is provided, keeping only the
+            given fields if any. Without a model, fields projects the
+            yielded dicts. When stream is set each page is parsed a
+            submission at a time as it is read rather than decoded whole,
+            and models are built without decoding their lazy fields.
+            A query.SubmissionQuery may be given as query, adding its
+            parameters to params and yielding only the submissions, and
+            fields, it selects.
+
+            Closing the generator, or timeout seconds passing from when
+            iteration starts, cancels the page requests not yet sent,
+            raising a TimeoutError in the latter case. The requests sent
+            and time spent are recorded in the instrumentation.CallStats
+            given as stats, if any.
+        """
+        stream = kwargs.get('stream', False)
+        query = kwargs.get('query', None)
+        stats = kwargs.get('stats', None) or CallStats()
+        stats.started_at = time.monotonic()
+        params, fields = _apply_query(
+            query, kwargs.get('params', None), kwargs.get('fields', None))
+        _, pages = self._get_submission_pages(
+            bounty, params,
+            kwargs.get('prefetch_pages', self.default_prefetch_pages),
+            stream=stream, stats=stats,
+            deadline=_get_deadline(stats, kwargs.get('timeout', None)))
+        try:
+            for page in pages:
+                for submission in _convert_submissions(
+                        page, stream, kwargs.get('model', None), fields,
+                        query):
+                    yield submission
+        finally:
+            pages.close()
+            stats.ended_at = time.monotonic()
+
+    def get_all_submissions(self, bounties=None, **kwargs):
+        """ Yields (bounty uuid, submission) tuples for the submissions of
+            the given bounties, or of every bounty if none are given.
+
+            Up to max_active_bounties bounties are paginated at once, each
+            with up to prefetch_pages pages in flight, sharing the client's
+            session and scheduler. With the default 'interleaved' ordering
+            pages from the active bounties are yielded in turn, with
+            'per_bounty' ordering every submission of a bounty is yielded
+            before those of the next. The given params are used for every
+            bounty and the model, fields, stream, query, timeout and stats
+            parameters behave as they do for get_submissions, with timeout
+            and stats covering every bounty.
+        """
+        stream = kwargs.get('stream', False)
+        stats = kwargs.get('stats', None) or CallStats()
+        stats.started_at = time.monotonic()
+        deadline = _get_deadline(stats, kwargs.get('timeout', None))
+        model = kwargs.get('model', None)
+        query = kwargs.get('query', None)
+        params, fields = _apply_query(
+            query, kwargs.get('params', None), kwargs.get('fields', None))
+        ordering = kwargs.get('ordering', 'interleaved')
+        if ordering not in ('interleaved', 'per_bounty'):
+            raise ValueError('Unknown ordering %s' % ordering)
+        max_active_bounties = kwargs.get('max_active_bounties', 5)
+        if max_active_bounties < 1:
+            raise ValueError('max_active_bounties must be at least 1')
+        prefetch_pages = kwargs.get('prefetch_pages',
+                                    self.default_prefetch_pages)
+        if bounties is None:
+            bounties = self.get_bounties()
+        bounties = iter(bounties)
+        active = collections.deque()
+
+        def activate_next_bounty():
+            bounty = next(bounties, None)
+            if bounty is not None:
+                bounty_params = None if params is None else dict(params)
+                initial_fetch, pages = self._get_submission_pages(
+                    bounty, bounty_params, prefetch_pages, eager=True,
+                    stream=stream, stats=stats, deadline=deadline)
+                active.append([_get_uuid(bounty), pages, initial_fetch])
+
+        try:
+            for _ in range(max_active_bounties):
+                activate_next_bounty()
+            while active:
+                entry = active[0]
+                bounty_uuid, pages = entry[0], entry[1]
+                # the pages own their first request once started.
+                entry[2] = None
+                page = next(pages, None)
+                if page is None:
+                    active.popleft()
+                    activate_next_bounty()
+                    continue
+                if ordering == 'interleaved':
+                    active.rotate(-1)
+                for submission in _convert_submissions(
+                        page, stream, model, fields, query):
+                    yield bounty_uuid, submission
+        finally:
+            for _, pages, initial_fetch in active:
+                if initial_fetch is not None:
+                    _cancel_fetches([initial_fetch], stats)
+                pages.close()
+            stats.ended_at = time.monotonic()
+
+    def _get_submission_pages(self, bounty, params, prefetch_pages,
+                              eager=False, stream=False, **kwargs):
+        """ Returns the request for the first page, when eager is set, and
+            an iterator of the pages of submissions for the given bounty.
+            When eager is set the first page is requested before the
+            iterator is first advanced, and the caller cancels the request
+            if the iterator is not started.
+        """
+        if prefetch_pages < 1:
+            raise ValueError('prefetch_pages must be at least 1')
+        submissions_uri = self.get_api_uri_for_bounty_submissions(bounty)
+        params = _get_submissions_params(params)
+        request_kwargs = {'deadline': kwargs.get('deadline', None)}
+        if stream:
+            request_kwargs['stream'] = True
+        initial_fetch = None
+        if eager:
+            initial_fetch = self.request(
+                'GET', submissions_uri, params=params, **request_kwargs)
+        return initial_fetch, self._iter_submission_pages(
+            submissions_uri, params, prefetch_pages, initial_fetch, stream,
+            **kwargs)
+
+    def _iter_submission_pages(self, submissions_uri, params, prefetch_pages,
+                               initial_fetch=None, stream=False, **kwargs):
+        """ Yields the submissions a page at a time, as lists of dicts or,
+            when streaming, iterators of undecoded json. Only the pages at
+            the given offsets are fetched if offsets are given, rather than
+            those following the first page. Page requests still pending
+            when the iterator is closed, or once the time.monotonic deadline
+            passes, are cancelled.
+        """
+        deadline = kwargs.get('deadline', None)
+        stats = kwargs.get('stats', None) or CallStats()
+        offsets = kwargs.get('offsets', None)
+        request_kwargs = {'deadline': deadline}
+        if stream:
+            request_kwargs['stream'] = True
+        pending_fetches = collections.deque()
+
+        def fetch_next_page():
+            offset = next(offsets, None)
+            if offset is not None:
+                request_params = params.copy()
+                request_params.update({'offset': offset})
+                pending_fetches.append(self.request(
+                    'GET', submissions_uri, params=request_params,
+                    **request_kwargs))
+
+        def read_meta(meta):
+            nonlocal offsets
+            offsets = iter(_get_remaining_page_offsets(params, meta))
+            for _ in range(prefetch_pages):
+                fetch_next_page()
+
+        pages = 0
+        try:
+            if offsets is not None:
+                offsets = iter(offsets)
+                for _ in range(prefetch_pages):
+                    fetch_next_page()
+            elif initial_fetch is not None:
+                pending_fetches.append(initial_fetch)
+            else:
+                pending_fetches.append(self.request(
+                    'GET', submissions_uri, params=params, **request_kwargs))
+            while pending_fetches:
+                future_fetch = pending_fetches[0]
+                if offsets is not None:
+                    fetch_next_page()
+                fetch = future_fetch.result(get_timeout(deadline))
+                pending_fetches.popleft()
+                stats.requests += getattr(future_fetch, 'attempts', 1)
+                fetch.raise_for_status()
+                pages += 1
+                stats.pages += 1
+                submissions = self._read_submissions_page(
+                    future_fetch, fetch, stream,
+                    read_meta if offsets is None else None)
+                del fetch
+                yield submissions
+                if offsets is None:
+                    # the rest of a streamed first page is read for its meta
+                    # data if it was not consumed.
+                    for _ in submissions:
+                        pass
+                del submissions
+        finally:
+            _cancel_fetches(pending_fetches, stats)
+            if self.instrumentation is not None:
+                self.instrumentation.pages_fetched(submissions_uri, pages)
+
+    def _read_submissions_page(self, request, resp, stream, on_meta=None):
+        """ Returns the submissions of a page, calling on_meta, if given,
+            with its meta data. When streaming, submissions are undecoded
+            json yielded as the response is read, and on_meta is called as
+            soon as the meta data has been read, wherever it appears.
+        """
+        if not stream:
+            data = self._decode_json(request, resp)
+            if on_meta is None:
+                return data['submissions']
+            on_meta(data['meta'])
+            return data.get('submissions', [])
+        events = iter_array_items(
+            resp.iter_content(chunk_size=self.stream_chunk_size),
+            'submissions')
+        return _stream_submissions(resp, events, on_meta)
+
+    def get_comments_for_submission(self, submission):
+        """ Returns comment information for the given submission or
+        submission uuid.
+        """
+        comments_uri = self.get_api_uri_for_submission_comments(submission)
+        return self.get_json(comments_uri)
+
+    def get_attachments_for_submission(self, submission):
+        """ Returns attachment information for the given submission or
+        submission uuid.
+        """
+        attach_uri = self.get_api_uri_for_submission_attachments(submission)
+        return self.get_json(attach_uri)
+
+    def enrich_submissions(self, submissions, **kwargs):
+        """ Yields a copy of each of the given submissions with its comments
+            and attachments, as selected by include, added under the
+            'comments' and 'attachments' keys. Sub-resources are fetched
+            concurrently for up to max_in_flight submissions ahead of the
+            submission being yielded and submissions are yielded in order.
+        """
+        include = kwargs.get('include', ('comments', 'attachments'))
+        max_in_flight = kwargs.get('max_in_flight', 10)
+        uri_getters = {
+            'comments': self.get_api_uri_for_submission_comments,
+            'attachments': self.get_api_uri_for_submission_attachments,
+        }
+        unknown = set(include) - set(uri_getters)
+        if unknown:
+            raise ValueError('Unknown sub-resources %s' % sorted(unknown))
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1')
+        submissions = iter(submissions)
+        pending = collections.deque()
+
+        def fetch_next_submission():
+            submission = next(submissions, None)
+            if submission is not None:
+                fetches = [(name, self.fetch_json(uri_getters[name](
+                    submission))) for name in include]
+                pending.append((submission, fetches))
+
+        for _ in range(max_in_flight):
+            fetch_next_submission()
+        while pending:
+            submission, fetches = pending.popleft()
+            fetch_next_submission()
+            enriched = dict(submission)
+            for name, fetch in fetches:
+                enriched[name] = fetch.result()
+            yield enriched
+
+    def create_submission(self, bounty, submission_fields,
+                          idempotency_key=None):
         """ Returns a future request creating a submission in the
             given bounty or bounty uuid.
         """
         uri = self.get_api_uri_for_bounty_submissions(_get_uuid(bounty))
-        required_fields = {'title', 'submitted_at'}
-        has_req_fields = required_fields & set(submission_fields.keys())
-        if len(has_req_fields) != 2:
-            raise ValueError('The %s field is required' %
-                             (required_fields - has_req_fields))
-        submitted_at = submission_fields['submitted_at']
-        if hasattr(submitted_at, 'isoformat'):
-            submission_fields = submission_fields.copy()
-            submission_fields['submitted_at'] = submitted_at.isoformat()
-        return self.session.post(uri, json={'submission': submission_fields})
+        payload = _get_create_submission_payload(submission_fields)
+        return self._write('POST', uri, payload, idempotency_key)
 
     def update_submission(self, submission, **kwargs):
         """ Returns a future request updating the given submission. """
         uri = self.get_api_uri_for_submission(submission)
-        fields = {}
-        for key in ['title', 'vrt_id', 'custom_fields', 'bug_url']:
-            val = kwargs.get(key, None)
-            if val:
-                fields[key] = val
-        payload = {'submission': fields}
-        return self.session.put(uri, json=payload)
+        idempotency_key = kwargs.pop('idempotency_key', None)
+        payload = _get_update_submission_payload(**kwargs)
+        return self._write('PUT', uri, payload, idempotency_key, submission)
 
     def comment_on_submission(self, submission, comment_text,
-                              comment_type='note'):
+                              comment_type='note', idempotency_key=None):
         """ Returns a future request commenting on the given submission. """
         uri = self.get_api_uri_for_submission_comments(submission)
-        payload = {
-            'comment': {
-                'body_markdown': comment_text,
-                'type': comment_type,
-            }
-        }
-        return self.session.post(uri, json=payload)
+        payload = _get_comment_payload(comment_text, comment_type)
+        return self._write('POST', uri, payload, idempotency_key,
+                           submission)
 
     def transition_submission(self, submission, state, **kwargs):
         """ Returns a future request transition the given
             submission or submission uuid to a different state.
         """
         uri = self.get_api_uri_for_submission(submission) + '/transition'
-        payload = {'substate': state}
-        duplicate_of = kwargs.get('duplicate_of', None)
-        if duplicate_of:
-            payload['duplicate_of'] = duplicate_of
-        if state == 'duplicate' and duplicate_of is None:
-            raise ValueError(
-                'The duplicate_of field is required when transitioning '
-                'a submission to a duplicate status.')
-        return self.session.post(uri, json=payload)
+        idempotency_key = kwargs.pop('idempotency_key', None)
+        payload = _get_transition_payload(state, **kwargs)
+        return self._write('POST', uri, payload, idempotency_key,
+                           submission)
+
+    def _write(self, method, uri, payload, idempotency_key,
+               submission=None):
+        """ Returns a future request sending the given json payload, with
+            an Idempotency-Key header if a key is given so that the api
+            can recognise a write that is sent again. The cached responses
+            of the given submission are removed both before the write is
+            sent and once it has been, so that a GET in flight meanwhile
+            can not leave the submission cached, or shared with later
+            fetches, as it was before the write.
+        """
+        if submission is not None:
+            self.invalidate_submission(submission)
+        if idempotency_key is None:
+            request = self.request(method, uri, json=payload)
+        else:
+            request = self.request(
+                method, uri, json=payload,
+                headers={'Idempotency-Key': idempotency_key})
+        if submission is not None:
+            request.add_done_callback(
+                lambda _: self.invalidate_submission(submission))
+        return request
+
+
+def _stream_submissions(resp, events, on_meta=None):
+    """ yields the submissions of the given events, calling on_meta, if
+        given, with the meta data once read, and closing the response once
+        done.
+    """
+    try:
+        for key, value in events:
+            if key == 'item':
+                yield value
+            elif on_meta is not None:
+                callback, on_meta = on_meta, None
+                callback(value)
+        if on_meta is not None:
+            raise ValueError('The submissions page has no meta data')
+    finally:
+        resp.close()
+
+
+def _get_deadline(stats, timeout):
+    """ returns the time.monotonic deadline of a call started as recorded in
+        stats and given timeout seconds, or None.
+    """
+    return None if timeout is None else stats.started_at + timeout
+
+
+def _cancel_fetches(fetches, stats):
+    """ cancels the given requests, counting those that were sent. """
+    for fetch in fetches:
+        stats.requests += getattr(fetch, 'attempts', 1)
+        if fetch.cancel():
+            stats.requests -= 1
+            stats.cancelled += 1
+
+
+def _apply_query(query, params, fields):
+    """ returns the params and fields to use for the given query, if any.
+    """
+    if query is None:
+        return params, fields
+    if fields is None:
+        fields = query.fields
+    return query.get_params(params), fields
+
+
+def _convert_submissions(page, stream, model, fields, query=None):
+    """ yields the submissions of a page matching the given query, if any,
+        as the given model or as dicts, projected to the given fields.
+    """
+    for submission in page:
+        decoded = not stream
+        if query is not None and query.conditions:
+            if not decoded:
+                submission = json.loads(submission)
+                decoded = True
+            if not query.matches(submission):
+                continue
+        if model is not None:
+            if decoded:
+                yield model.from_dict(submission, fields)
+            else:
+                yield model.from_json(submission, fields)
+            continue
+        if not decoded:
+            submission = json.loads(submission)
+        if fields is not None:
+            submission = {field: submission[field]
+                          for field in fields if field in submission}
+        yield submission
+
+
+class _JSONFetch(object):
+    """ A pending GET request that is decoded, and cached, on completion.
+        The result is decoded once and shared by every caller.
+    """
+
+    def __init__(self, client, uri, future, entry=None):
+        self._client = client
+        self._uri = uri
+        self._generation = client._get_write_generation(uri)
+        self._future = future
+        self._entry = entry
+        self._lock = threading.Lock()
+        self._resolved = False
+        self._data = None
+        self._error = None
+
+    def done(self):
+        """ Returns whether the request has finished. """
+        return (self._resolved or self._future is None or
+                self._future.done())
+
+    def add_done_callback(self, fn):
+        """ Calls fn with the fetch once its request has finished. """
+        if self._future is None:
+            fn(self)
+        else:
+            self._future.add_done_callback(lambda _: fn(self))
+
+    def result(self):
+        """ Returns the decoded response. """
+        with self._lock:
+            if not self._resolved:
+                try:
+                    self._data = self._resolve()
+                except Exception as e:
+                    self._error = e
+                self._resolved = True
+        if self._error is not None:
+            raise self._error
+        return self._data
+
+    def _resolve(self):
+        cache = self._client.cache
+        if self._future is None:
+            return self._entry.data
+        resp = self._future.result()
+        # a submission written since the request was sent may have changed.
+        current = (self._client._get_write_generation(self._uri) ==
+                   self._generation)
+        if self._entry is not None and resp.status_code == 304:
+            if current:
+                cache.refresh(self._uri)
+            return self._entry.data
+        resp.raise_for_status()
+        data = self._client._decode_json(self._future, resp)
+        if cache is not None and current:
+            cache.set(self._uri, data, etag=resp.headers.get('ETag'),
+                      last_modified=resp.headers.get('Last-Modified'))
+        return data
+
+
+def _get_submission_uuid(uri):
+    """ returns the uuid of the submission an api uri belongs to, or None.
+    """
+    segments = urlsplit(uri).path.strip('/').split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] == 'submissions':
+            return segments[i]
+    return None
+
+
+def _get_submissions_params(params):
+    """ returns the params to use when fetching the first page of
+        submissions.
+    """
+    if params is None:
+        params = {'sort': 'newest', 'offset': 0}
+    params['limit'] = params.get('limit', 250)
+    return params
+
+
+def _get_params_key(params):
+    """ returns a hashable key for the given request params. """
+    if params is None:
+        return None
+    items = params.items() if hasattr(params, 'items') else params
+    return tuple(sorted((key, str(value)) for key, value in items))
+
+
+def _get_remaining_page_offsets(params, meta):
+    """ returns the offsets of the submission pages following the page
+        described by the given meta data.
+    """
+    if meta['count'] >= meta['total_hits']:
+        return range(0)
+    step = params['limit']
+    return range(step, meta['total_hits'], step)
+
+
+def _get_create_submission_payload(submission_fields):
+    """ returns the payload for creating a submission with the given
+        fields.
+    """
+    required_fields = {'title', 'submitted_at'}
+    has_req_fields = required_fields & set(submission_fields.keys())
+    if len(has_req_fields) != 2:
+        raise ValueError('The %s field is required' %
+                         (required_fields - has_req_fields))
+    submitted_at = submission_fields['submitted_at']
+    if hasattr(submitted_at, 'isoformat'):
+        submission_fields = submission_fields.copy()
+        submission_fields['submitted_at'] = submitted_at.isoformat()
+    return {'submission': submission_fields}
+
+
+def _get_update_submission_payload(**kwargs):
+    """ returns the payload for updating a submission. """
+    fields = {}
+    for key in ['title', 'vrt_id', 'custom_fields', 'bug_url']:
+        val = kwargs.get(key, None)
+        if val:
+            fields[key] = val
+    return {'submission': fields}
+
+
+def _get_comment_payload(comment_text, comment_type):
+    """ returns the payload for commenting on a submission. """
+    return {
+        'comment': {
+            'body_markdown': comment_text,
+            'type': comment_type,
+        }
+    }
+
+
+def _get_transition_payload(state, **kwargs):
+    """ returns the payload for transitioning a submission to the
+        given state.
+    """
+    payload = {'substate': state}
+    duplicate_of = kwargs.get('duplicate_of', None)
+    if duplicate_of:
+        payload['duplicate_of'] = duplicate_of
+    if state == 'duplicate' and duplicate_of is None:
+        raise ValueError(
+            'The duplicate_of field is required when transitioning '
+            'a submission to a duplicate status.')
+    return payload
 
 
 def _convert_datetime_to_submission_creation_format(date_time):
     return date_time.isoformat()
 
 
+def _get_timestamp(value):
+    """ returns the given string or datetime as a submitted_at string. """
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        return value.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (
+            value.microsecond // 1000)
+    return value
+
+
 def get_uri_for_bounty_submission(submission):
-    """ returns the uri for a given bounty submission. """
+    """ returns the uri for a given bounty submission or submission model.
+    """
     return 'https://tracker.bugcrowd.com/%s/submissions/%s' % (
         url_quote(submission['bounty_code']),
         url_quote(submission['reference_number'])
@@ -0,0 +1,306 @@
+import argparse
+import csv
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from .client import BugcrowdClient, _get_submissions_params
+from .scheduler import RequestScheduler
+
+
+# The supported export formats.
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+
+def export_submissions(submissions, output, **kwargs):
+    """ Writes the given submissions to output, a path or a file-like
+        object, one at a time and returns the number written.
+
+        format may be ndjson (the default) or csv. fields selects the
+        submission fields to write, which defaults to every field for
+        ndjson and the fields of the first submission for csv. Output is
+        gzip compressed when compress is set or output is a path ending in
+        .gz.
+    """
+    export_format = kwargs.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format %s' % export_format)
+    fields = kwargs.get('fields', None)
+    compress = kwargs.get('compress', None)
+    if isinstance(output, (str, os.PathLike)):
+        if compress is None:
+            compress = os.fspath(output).endswith('.gz')
+        with open(output, 'wb') as f:
+            return _export(submissions, f, export_format, fields, compress)
+    return _export(submissions, output, export_format, fields, compress)
+
+
+def export_bounty_submissions(client, bounty, output, **kwargs):
+    """ Exports every submission of the given bounty or bounty uuid to
+        output, a path or a file-like object, using a pool of processes and
+        returns the number written.
+
+        The pages of submissions are split into one contiguous range of
+        offsets per process, up to processes of them (the number of cpus by
+        default). Each process fetches, decodes and writes its range to its
+        own shard file, with up to prefetch_pages requests in flight, and
+        the shards are then joined in order. transform, a picklable
+        function, is applied to each submission in the worker processes
+        before it is written. rate limits the requests a second sent by all
+        processes together. params, format, fields and compress behave as
+        they do for get_submissions and export_submissions, with csv fields
+        taken from the first submission if none are given.
+
+        Each process builds its own client from the given client's api
+        token and base uri. The client's transport, scheduler, archive,
+        cache and instrumentation are not carried into the processes, which
+        use a default transport and, if rate is given, a scheduler limited
+        to their share of it.
+    """
+    export_format = kwargs.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format %s' % export_format)
+    processes = kwargs.get('processes', None) or os.cpu_count() or 1
+    transform = kwargs.get('transform', None)
+    fields = kwargs.get('fields', None)
+    params = _get_submissions_params(dict(kwargs.get('params', None) or {
+        'sort': 'newest', 'offset': 0}))
+    submissions_uri = client.get_api_uri_for_bounty_submissions(bounty)
+    first_page = client.get_json(submissions_uri, dict(params, limit=1))
+    if export_format == 'csv' and fields is None:
+        if not first_page['submissions']:
+            fields = []
+        else:
+            submission = first_page['submissions'][0]
+            if transform is not None:
+                submission = transform(submission)
+            fields = list(submission.keys())
+    offsets = list(range(params.get('offset', 0),
+                         first_page['meta']['total_hits'], params['limit']))
+    shard_size = -(-len(offsets) // processes)
+    shards = [offsets[x:x + shard_size]
+              for x in range(0, len(offsets), shard_size or 1)]
+    rate = kwargs.get('rate', None)
+    settings = {
+        'api_token': client._api_token,
+        'base_uri': client.base_uri,
+        'submissions_uri': submissions_uri,
+        'params': params,
+        'format': export_format,
+        'fields': fields,
+        'transform': transform,
+        'prefetch_pages': kwargs.get(
+            'prefetch_pages', client.default_prefetch_pages),
+        'rate': rate / len(shards) if rate and shards else None,
+    }
+    directory = tempfile.mkdtemp()
+    try:
+        paths = [os.path.join(directory, 'shard-%d' % x)
+                 for x in range(len(shards))]
+        if shards:
+            with _create_process_pool(len(shards)) as executor:
+                counts = list(executor.map(
+                    _export_shard, [settings] * len(shards), shards, paths))
+        else:
+            counts = []
+        compress = kwargs.get('compress', None)
+        shards = [(path, count) for path, count in zip(paths, counts)
+                  if count]
+        if isinstance(output, (str, os.PathLike)):
+            if compress is None:
+                compress = os.fspath(output).endswith('.gz')
+            with open(output, 'wb') as f:
+                _merge_shards(shards, f, export_format, compress)
+        else:
+            _merge_shards(shards, output, export_format, compress)
+        return sum(counts)
+    finally:
+        shutil.rmtree(directory)
+
+
+def _create_process_pool(max_workers):
+    """ returns a process pool whose workers are spawned rather than
+        forked, since a fork copies locks held by the parent's threads, such
+        as those of the client's executor, and can deadlock the workers.
+        Python 3.6 pools can only fork.
+    """
+    if sys.version_info < (3, 7):
+        return ProcessPoolExecutor(max_workers=max_workers)
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn'))
+
+
+def _export_shard(settings, offsets, path):
+    """ writes the submissions of the pages at the given offsets to path
+        and returns the number written.
+    """
+    rate = settings['rate']
+    client = BugcrowdClient(
+        settings['api_token'],
+        scheduler=RequestScheduler(rate=rate) if rate else None)
+    client.base_uri = settings['base_uri']
+    try:
+        return export_submissions(
+            _iter_shard_submissions(client, settings, offsets), path,
+            format=settings['format'], fields=settings['fields'],
+            compress=False)
+    finally:
+        client.transport.close()
+
+
+def _iter_shard_submissions(client, settings, offsets):
+    """ yields the transformed submissions of the pages at the given
+        offsets, keeping up to prefetch_pages requests in flight and
+        cancelling those not yet sent when closed.
+    """
+    transform = settings['transform']
+    pages = client._iter_submission_pages(
+        settings['submissions_uri'], settings['params'],
+        settings['prefetch_pages'], offsets=offsets)
+    try:
+        for page in pages:
+            for submission in page:
+                yield (submission if transform is None
+                       else transform(submission))
+    finally:
+        pages.close()
+
+
+def _merge_shards(shards, output, export_format, compress):
+    """ writes the given shard files, in order, to the file-like output,
+        keeping only the first csv header.
+    """
+    if compress:
+        with gzip.GzipFile(fileobj=_get_binary_stream(output),
+                           mode='wb') as f:
+            return _merge_shards(shards, f, export_format, False)
+    stream = _get_text_stream(output)
+    try:
+        for x, (path, _) in enumerate(shards):
+            with open(path, encoding='utf-8', newline='') as f:
+                if export_format == 'csv' and x:
+                    f.readline()
+                shutil.copyfileobj(f, stream)
+    finally:
+        stream.flush()
+        if stream is not output:
+            stream.detach()
+
+
+def _export(submissions, output, export_format, fields, compress):
+    """ writes submissions to the file-like output. """
+    if compress:
+        with gzip.GzipFile(fileobj=_get_binary_stream(output),
+                           mode='wb') as f:
+            return _export(submissions, f, export_format, fields, False)
+    stream = _get_text_stream(output)
+    try:
+        if export_format == 'csv':
+            return _write_csv(submissions, stream, fields)
+        return _write_ndjson(submissions, stream, fields)
+    finally:
+        stream.flush()
+        if stream is not output:
+            stream.detach()
+
+
+def _get_binary_stream(output):
+    """ returns a binary stream writing to output. """
+    if isinstance(output, io.TextIOBase):
+        return output.buffer
+    return output
+
+
+def _get_text_stream(output):
+    """ returns a text stream writing to output. """
+    if isinstance(output, io.TextIOBase):
+        return output
+    return io.TextIOWrapper(output, encoding='utf-8', newline='')
+
+
+def _project(submission, fields):
+    """ returns the given fields of the submission. """
+    if fields is None:
+        return submission if isinstance(submission, dict) else dict(submission)
+    return {field: submission.get(field) for field in fields}
+
+
+def _write_ndjson(submissions, stream, fields):
+    """ writes submissions as newline delimited json. """
+    count = 0
+    for submission in submissions:
+        stream.write(json.dumps(_project(submission, fields)))
+        stream.write('\n')
+        count += 1
+    return count
+
+
+def _write_csv(submissions, stream, fields):
+    """ writes submissions as csv, encoding nested values as json. """
+    writer = None
+    count = 0
+    for submission in submissions:
+        if writer is None:
+            if fields is None:
+                fields = list(submission.keys())
+            writer = csv.DictWriter(stream, fieldnames=fields,
+                                    extrasaction='ignore')
+            writer.writeheader()
+        row = {}
+        for field, value in _project(submission, fields).items():
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value)
+            row[field] = value
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def main(argv=None):
+    """ Exports the submissions of a bounty. """
+    parser = argparse.ArgumentParser(
+        description='Export the submissions of a Bugcrowd bounty.')
+    parser.add_argument('bounty', help='the uuid of the bounty to export')
+    parser.add_argument(
+        '--output', '-o', default='-',
+        help='the file to write to, defaults to standard output')
+    parser.add_argument('--format', '-f', choices=EXPORT_FORMATS,
+                        default='ndjson')
+    parser.add_argument('--fields',
+                        help='a comma separated list of fields to export')
+    parser.add_argument('--gzip', action='store_true', default=None,
+                        help='gzip compress the output')
+    parser.add_argument(
+        '--processes', '-p', type=int,
+        help='export with this many processes, each writing a shard of the '
+             'submissions')
+    parser.add_argument(
+        '--token', default=os.environ.get('BUGCROWD_API_TOKEN'),
+        help='the api token, defaults to $BUGCROWD_API_TOKEN')
+    args = parser.parse_args(argv)
+    if not args.token:
+        parser.error('an api token is required')
+    fields = args.fields.split(',') if args.fields else None
+    client = BugcrowdClient(args.token)
+    output = sys.stdout.buffer if args.output == '-' else args.output
+    if args.processes:
+        count = export_bounty_submissions(
+            client, args.bounty, output, format=args.format, fields=fields,
+            compress=args.gzip, processes=args.processes)
+    else:
+        submissions = client.get_submissions(args.bounty)
+        count = export_submissions(submissions, output, format=args.format,
+                                   fields=fields, compress=args.gzip)
+    sys.stderr.write('Exported %d submissions\n' % count)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,252 @@
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeBugcrowdServer(object):
+    """ A local, in memory imitation of the Bugcrowd v3 api for testing and
+        benchmarking.
+
+        Serves bounties, paginated submissions, comments and attachments
+        and accepts the client's write requests. Submissions can be filtered
+        on field:value terms in a filter parameter, searched by title and
+        limited to a comma separated list of fields. Writes repeating an
+        Idempotency-Key are answered with the first response. Every
+        submission has one attachment of attachment_size bytes, served with
+        range support, and the first truncated_downloads of them are cut
+        off part way through their content. latency seconds are added to
+        every response, and rate_limit_ratio and error_ratio of requests are
+        answered with a 429 or 503 respectively.
+    """
+
+    def __init__(self, bounties=1, submissions_per_bounty=100, **kwargs):
+        self.latency = kwargs.get('latency', 0)
+        self.rate_limit_ratio = kwargs.get('rate_limit_ratio', 0)
+        self.error_ratio = kwargs.get('error_ratio', 0)
+        self.retry_after = kwargs.get('retry_after', 0)
+        self.description_size = kwargs.get('description_size', 1000)
+        self.attachment_content = bytes(
+            bytearray(x % 256 for x in range(
+                kwargs.get('attachment_size', 1024))))
+        self.truncated_downloads = kwargs.get('truncated_downloads', 0)
+        self._random = random.Random(kwargs.get('seed', 0))
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.requests = []
+        self.idempotent_responses = {}
+        self.bounties = []
+        self.submissions = {}
+        for _ in range(bounties):
+            bounty = {'uuid': str(uuid.uuid4()), 'name': 'bounty',
+                      'code': 'code-%s' % uuid.uuid4().hex[:8]}
+            self.bounties.append(bounty)
+            self.submissions[bounty['uuid']] = [
+                self._create_submission(bounty, x)
+                for x in range(submissions_per_bounty)]
+        self._server = None
+        self._thread = None
+
+    def _create_submission(self, bounty, number):
+        return {
+            'uuid': str(uuid.uuid4()),
+            'title': 'submission %d' % number,
+            'bounty_code': bounty['code'],
+            'reference_number': str(number),
+            'substate': 'unresolved',
+            'submitted_at': '2020-01-01T00:00:%02d.000Z' % (number % 60),
+            'description_markdown': 'x' * self.description_size,
+            'custom_fields': {},
+        }
+
+    @property
+    def base_uri(self):
+        """ Returns the base uri of the running server. """
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%d/' % (host, port)
+
+    def start(self):
+        """ Starts serving requests on a background thread. """
+        self._server = _ThreadingHTTPServer(
+            ('127.0.0.1', 0), _create_handler(self))
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stops the server. """
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(self, method, path, query, body, headers=None):
+        """ Returns the status code, headers and body for a request. The
+            body is bytes for attachment content and json otherwise.
+        """
+        with self._lock:
+            self.request_count += 1
+            self.requests.append((method, path))
+            roll = self._random.random()
+        if self.latency:
+            time.sleep(self.latency)
+        if roll < self.rate_limit_ratio:
+            return 429, {'Retry-After': str(self.retry_after)}, {}
+        if roll < self.rate_limit_ratio + self.error_ratio:
+            return 503, {}, {}
+        headers = headers or {}
+        key = headers.get('Idempotency-Key')
+        if key is not None and method != 'GET':
+            with self._lock:
+                if key in self.idempotent_responses:
+                    return self.idempotent_responses[key]
+        for pattern, handler in self._routes:
+            match = re.match(pattern, '%s %s' % (method, path))
+            if match:
+                response = handler(self, query, body, headers,
+                                   *match.groups())
+                break
+        else:
+            response = 404, {}, {'errors': ['not found']}
+        if key is not None and method != 'GET':
+            with self._lock:
+                self.idempotent_responses.setdefault(key, response)
+        return response
+
+    def _get_bounties(self, query, body, headers):
+        return 200, {}, {'bounties': self.bounties}
+
+    def _get_submissions(self, query, body, headers, bounty_uuid):
+        submissions = self.submissions.get(bounty_uuid)
+        if submissions is None:
+            return 404, {}, {}
+        for term in query.get('filter', [''])[0].split():
+            field, _, value = term.partition(':')
+            submissions = [submission for submission in submissions
+                           if str(submission.get(field)) == value]
+        search = query.get('search', [''])[0].lower()
+        if search:
+            submissions = [submission for submission in submissions
+                           if search in submission['title'].lower()]
+        offset = int(query.get('offset', ['0'])[0])
+        limit = int(query.get('limit', ['25'])[0])
+        page = submissions[offset:offset + limit]
+        if 'fields' in query:
+            fields = set(query['fields'][0].split(',')) | {'uuid'}
+            page = [{key: value for key, value in submission.items()
+                     if key in fields} for submission in page]
+        return 200, {}, {
+            'submissions': page,
+            'meta': {'count': len(page), 'offset': offset,
+                     'total_hits': len(submissions)},
+        }
+
+    def _create(self, query, body, headers, bounty_uuid):
+        return 201, {}, body
+
+    def _get_comments(self, query, body, headers, submission_uuid):
+        return 200, {}, {'notes': [{
+            'uuid': str(uuid.uuid4()),
+            'body_markdown': 'note on %s' % submission_uuid,
+        }], 'tester_messages': []}
+
+    def _get_attachments(self, query, body, headers, submission_uuid):
+        return 200, {}, {'file_attachments': [{
+            'file_name': 'evidence.png',
+            'file_size': len(self.attachment_content),
+            'file_type': 'image/png',
+            's3_signed_url': '%sfiles/%s/evidence.png?signature=x' % (
+                self.base_uri, submission_uuid),
+        }]}
+
+    def _get_file(self, query, body, headers, submission_uuid):
+        content = self.attachment_content
+        match = re.match(r'^bytes=(\d+)-$', headers.get('Range', ''))
+        if match is None:
+            return self._truncate(200, {}, content)
+        start = int(match.group(1))
+        if start >= len(content):
+            return 416, {}, b''
+        return self._truncate(206, {'Content-Range': 'bytes %d-%d/%d' % (
+            start, len(content) - 1, len(content))}, content[start:])
+
+    def _truncate(self, status, headers, content):
+        """ returns the response, cut off part way through its content if
+            downloads are still to be truncated.
+        """
+        with self._lock:
+            if not self.truncated_downloads:
+                return status, headers, content
+            self.truncated_downloads -= 1
+        headers = dict(headers, **{'Content-Length': str(len(content))})
+        return status, headers, content[:len(content) // 5]
+
+    def _write(self, query, body, headers, submission_uuid):
+        return 200, {}, body
+
+    _routes = [
+        (r'^GET /bounties$', _get_bounties),
+        (r'^GET /bounties/([^/]+)/submissions$', _get_submissions),
+        (r'^POST /bounties/([^/]+)/submissions$', _create),
+        (r'^GET /submissions/([^/]+)/comments$', _get_comments),
+        (r'^GET /submissions/([^/]+)/file_attachments$', _get_attachments),
+        (r'^GET /files/([^/]+)/[^/]+$', _get_file),
+        (r'^PUT /submissions/([^/]+)$', _write),
+        (r'^POST /submissions/([^/]+)/(?:comments|transition)$', _write),
+    ]
+
+
+def _create_handler(server):
+    """ returns a request handler class serving the given fake server. """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _handle(self):
+            url = urlsplit(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            body = json.loads(body.decode('utf-8')) if body else None
+            status, headers, content = server.handle(
+                self.command, url.path.rstrip('/'), parse_qs(url.query),
+                body, self.headers)
+            if isinstance(content, bytes):
+                data = content
+                content_type = 'application/octet-stream'
+            else:
+                data = json.dumps(content).encode('utf-8')
+                content_type = 'application/json'
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            if 'Content-Length' not in headers:
+                self.send_header('Content-Length', str(len(data)))
+            elif int(headers['Content-Length']) > len(data):
+                # the connection is closed to cut the content off.
+                self.close_connection = True
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = _handle
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
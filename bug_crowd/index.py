@@ -0,0 +1,324 @@
+import itertools
+import json
+import re
+import sqlite3
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+from .client import _get_timestamp
+from .sync import MemoryCursorStore, SQLiteCursorStore, sync_submissions
+
+
+_TOKEN_RE = re.compile(r'\w+', re.U)
+
+# The submission fields stored in their own, queryable, columns.
+INDEXED_FIELDS = ('bounty_code', 'substate', 'vrt_id', 'bug_url', 'title',
+                  'submitted_at')
+
+
+class SubmissionIndex(object):
+    """ A local sqlite index of submissions for querying and duplicate
+        detection without api requests.
+
+        Submissions are queryable on their indexed fields, with titles
+        searched by token through a full text index when sqlite supports
+        FTS5, and bug urls compared after normalisation. The index is
+        filled with add, or kept current with sync, which only fetches
+        submissions newer than those seen by its previous sync. Changes to
+        submissions already indexed, such as a new substate or vrt_id, are
+        not seen by sync and are only picked up by refresh, which fetches
+        every submission of a bounty again.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS submissions ('
+                'uuid TEXT PRIMARY KEY, bounty_code TEXT, substate TEXT, '
+                'vrt_id TEXT, bug_url TEXT, normalized_bug_url TEXT, '
+                'title TEXT, submitted_at TEXT, data TEXT NOT NULL)')
+            for column in ('bounty_code', 'substate', 'vrt_id',
+                           'normalized_bug_url', 'submitted_at'):
+                self._conn.execute(
+                    'CREATE INDEX IF NOT EXISTS submissions_%s '
+                    'ON submissions (%s)' % (column, column))
+            try:
+                self._conn.execute(
+                    'CREATE VIRTUAL TABLE IF NOT EXISTS submission_titles '
+                    'USING fts5(uuid UNINDEXED, title)')
+                self.full_text = True
+            except sqlite3.OperationalError:
+                self.full_text = False
+        if path == ':memory:':
+            self.cursor_store = MemoryCursorStore()
+        else:
+            self.cursor_store = SQLiteCursorStore(path)
+
+    def add(self, submissions, batch_size=500):
+        """ Adds, or replaces, the given submissions and returns the number
+            added. Submissions are written batch_size at a time, each batch
+            in one transaction, and the index is only locked while writing
+            so that it can be queried while a slow iterable is read.
+        """
+        count = 0
+        for batch in _iter_batches(submissions, batch_size):
+            rows = [_get_row(dict(submission)) for submission in batch]
+            with self._lock, self._conn:
+                self._write(rows)
+            count += len(rows)
+        return count
+
+    def _write(self, rows):
+        """ inserts or replaces the given rows. """
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO submissions (uuid, bounty_code, '
+            'substate, vrt_id, bug_url, normalized_bug_url, title, '
+            'submitted_at, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        if self.full_text:
+            self._conn.executemany(
+                'DELETE FROM submission_titles WHERE uuid = ?',
+                [(row[0],) for row in rows])
+            self._conn.executemany(
+                'INSERT INTO submission_titles (uuid, title) VALUES (?, ?)',
+                [(row[0], row[6] or '') for row in rows])
+
+    def remove(self, uuid):
+        """ Removes the submission with the given uuid. """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM submissions WHERE uuid = ?', (uuid,))
+            if self.full_text:
+                self._conn.execute(
+                    'DELETE FROM submission_titles WHERE uuid = ?', (uuid,))
+
+    def get(self, uuid):
+        """ Returns the submission with the given uuid or None. """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data FROM submissions WHERE uuid = ?',
+                (uuid,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def sync(self, client, bounty, **kwargs):
+        """ Adds the submissions of the given bounty or bounty uuid that are
+            newer than the previous sync and returns the number added.
+            kwargs are passed to sync_submissions, with the index's cursor
+            store used unless a store is given. The cursor is only advanced
+            once the submissions have been written.
+        """
+        store = kwargs.pop('store', self.cursor_store)
+        pending = _PendingCursorStore(store)
+        count = self.add(sync_submissions(client, bounty, pending, **kwargs))
+        pending.commit()
+        return count
+
+    def refresh(self, client, bounty, **kwargs):
+        """ Fetches every submission of the given bounty or bounty uuid,
+            replaces those that changed since they were indexed and adds
+            any missing, returning the number written. params and
+            prefetch_pages are passed to get_submissions and submissions are
+            compared and written batch_size at a time.
+        """
+        params = kwargs.get('params', None) or {'sort': 'newest',
+                                                'offset': 0}
+        submissions = client.get_submissions(
+            bounty, params=params,
+            prefetch_pages=kwargs.get('prefetch_pages', 1))
+        count = 0
+        try:
+            for batch in _iter_batches(
+                    submissions, kwargs.get('batch_size', 500)):
+                rows = [_get_row(dict(submission)) for submission in batch]
+                uuids = [row[0] for row in rows]
+                with self._lock, self._conn:
+                    stored = dict(self._conn.execute(
+                        'SELECT uuid, data FROM submissions WHERE uuid IN '
+                        '(%s)' % ', '.join('?' * len(uuids)), uuids))
+                    rows = [row for row in rows if row[0] not in stored or
+                            json.loads(stored[row[0]]) != json.loads(row[8])]
+                    self._write(rows)
+                count += len(rows)
+        finally:
+            submissions.close()
+        return count
+
+    def search(self, **kwargs):
+        """ Returns the submissions matching every given criterion, newest
+            first.
+
+            bounty_code, substate and vrt_id match exactly and may be
+            lists of values, bug_url matches after normalisation, title
+            matches submissions whose titles hold every token of the
+            given text and submitted_after and submitted_before, strings
+            or datetimes, bound submitted_at inclusively. At most limit
+            submissions are returned if a limit is given.
+        """
+        clauses = []
+        args = []
+        for field in ('bounty_code', 'substate', 'vrt_id'):
+            values = kwargs.get(field, None)
+            if values is None:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            values = list(values)
+            clauses.append('%s IN (%s)' % (
+                field, ', '.join('?' * len(values))))
+            args.extend(values)
+        if kwargs.get('bug_url', None) is not None:
+            clauses.append('normalized_bug_url = ?')
+            args.append(normalize_bug_url(kwargs['bug_url']))
+        if kwargs.get('submitted_after', None) is not None:
+            clauses.append('submitted_at >= ?')
+            args.append(_get_timestamp(kwargs['submitted_after']))
+        if kwargs.get('submitted_before', None) is not None:
+            clauses.append('submitted_at <= ?')
+            args.append(_get_timestamp(kwargs['submitted_before']))
+        if kwargs.get('title', None) is not None:
+            tokens = get_title_tokens(kwargs['title'])
+            if not tokens:
+                return []
+            clause, title_args = self._get_title_clause(tokens, 'AND')
+            clauses.append(clause)
+            args.extend(title_args)
+        sql = 'SELECT data FROM submissions'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY submitted_at DESC'
+        if kwargs.get('limit', None) is not None:
+            sql += ' LIMIT ?'
+            args.append(kwargs['limit'])
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def find_duplicates(self, submission, limit=10):
+        """ Returns indexed submissions that may duplicate the given one,
+            a submission or the fields of one about to be created.
+
+            Submissions with the same normalised bug url come first,
+            followed by those sharing title tokens, best matches first.
+            The submission itself, if indexed, is not returned.
+        """
+        uuid = submission.get('uuid')
+        duplicates = []
+        seen = {uuid}
+        bug_url = normalize_bug_url(submission.get('bug_url'))
+        if bug_url:
+            for candidate in self.search(bug_url=bug_url, limit=limit + 1):
+                if candidate['uuid'] not in seen:
+                    seen.add(candidate['uuid'])
+                    duplicates.append(candidate)
+        tokens = get_title_tokens(submission.get('title') or '')
+        if tokens and len(duplicates) < limit:
+            if self.full_text:
+                sql = ('SELECT s.data FROM submission_titles t JOIN '
+                       'submissions s ON s.uuid = t.uuid WHERE '
+                       'submission_titles MATCH ? ORDER BY bm25('
+                       'submission_titles) LIMIT ?')
+                args = [_get_match_query(tokens, 'OR')]
+            else:
+                clause, args = self._get_title_clause(tokens, 'OR')
+                sql = ('SELECT data FROM submissions WHERE %s '
+                       'ORDER BY submitted_at DESC LIMIT ?' % clause)
+            args.append(limit + len(seen))
+            with self._lock:
+                rows = self._conn.execute(sql, args).fetchall()
+            for row in rows:
+                candidate = json.loads(row[0])
+                if candidate['uuid'] not in seen:
+                    seen.add(candidate['uuid'])
+                    duplicates.append(candidate)
+        return duplicates[:limit]
+
+    def _get_title_clause(self, tokens, operator):
+        """ returns a where clause, and its args, matching titles holding
+            all, for AND, or any, for OR, of the given tokens.
+        """
+        if self.full_text:
+            return ('uuid IN (SELECT uuid FROM submission_titles '
+                    'WHERE submission_titles MATCH ?)',
+                    [_get_match_query(tokens, operator)])
+        clause = (' %s ' % operator).join(
+            "(' ' || lower(title) || ' ') LIKE ?" for _ in tokens)
+        return '(%s)' % clause, ['%% %s %%' % token for token in tokens]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM submissions').fetchone()[0]
+
+    def close(self):
+        """ Closes the underlying database connection. """
+        self._conn.close()
+        close_store = getattr(self.cursor_store, 'close', None)
+        if close_store is not None:
+            close_store()
+
+
+def get_title_tokens(title):
+    """ Returns the distinct lower case word tokens of a title. """
+    tokens = []
+    for token in _TOKEN_RE.findall(title.lower()):
+        if token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def normalize_bug_url(bug_url):
+    """ Returns the bug url with its scheme and host lower cased and any
+        fragment and trailing slash removed, or None.
+    """
+    if not bug_url:
+        return None
+    url = urlsplit(bug_url.strip())
+    return urlunsplit((url.scheme.lower(), url.netloc.lower(),
+                       url.path.rstrip('/'), url.query, ''))
+
+
+class _PendingCursorStore(object):
+    """ a cursor store holding the cursors set on it until committed to
+        the store it wraps.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._cursors = {}
+
+    def get(self, bounty_uuid):
+        if bounty_uuid in self._cursors:
+            return self._cursors[bounty_uuid]
+        return self.store.get(bounty_uuid)
+
+    def set(self, bounty_uuid, cursor):
+        self._cursors[bounty_uuid] = cursor
+
+    def commit(self):
+        for bounty_uuid, cursor in self._cursors.items():
+            self.store.set(bounty_uuid, cursor)
+        self._cursors.clear()
+
+
+def _get_row(submission):
+    """ returns the submissions table row of a submission. """
+    values = [submission.get(field) for field in INDEXED_FIELDS]
+    values.insert(4, normalize_bug_url(submission.get('bug_url')))
+    return tuple([submission['uuid']] + values + [json.dumps(submission)])
+
+
+def _iter_batches(items, batch_size):
+    """ yields lists of up to batch_size of the given items. """
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _get_match_query(tokens, operator):
+    """ returns an fts5 query for the given tokens joined by operator. """
+    return (' %s ' % operator).join('"%s"' % token for token in tokens)
@@ -0,0 +1,293 @@
+import bisect
+import json
+import sys
+import threading
+import time
+
+
+# Path segments followed by a uuid in api uris.
+_UUID_PARENTS = frozenset(['bounties', 'submissions'])
+
+
+def get_endpoint(method, path):
+    """ Returns the endpoint name for a request, with uuids in the given
+        api path replaced by a placeholder.
+    """
+    segments = path.strip('/').split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] in _UUID_PARENTS:
+            segments[i] = '{uuid}'
+    return '%s /%s' % (method.upper(), '/'.join(segments))
+
+
+class RequestSpan(object):
+    """ Timings and sizes of a request, including any retries. """
+
+    __slots__ = ('method', 'uri', 'endpoint', 'queue_depth', 'started_at',
+                 'responded_at', 'ended_at', 'elapsed', 'status_code',
+                 'bytes_sent', 'bytes_received', 'retries', 'error')
+
+    def __init__(self, method, uri, endpoint, queue_depth=0):
+        self.method = method
+        self.uri = uri
+        self.endpoint = endpoint
+        self.queue_depth = queue_depth
+        self.started_at = time.monotonic()
+        self.responded_at = None
+        self.ended_at = None
+        self.elapsed = None
+        self.status_code = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.error = None
+
+    def on_response(self, resp, *args, **kwargs):
+        """ A requests response hook recording when the response of the
+            latest attempt arrived.
+        """
+        self.responded_at = time.monotonic()
+        elapsed = getattr(resp, 'elapsed', None)
+        if elapsed is not None:
+            self.elapsed = elapsed.total_seconds()
+        return resp
+
+    def finish(self, resp=None, error=None):
+        """ Records the final response, or error, of the request. """
+        self.ended_at = self.responded_at or time.monotonic()
+        self.error = error
+        if resp is not None:
+            self.status_code = resp.status_code
+            self.bytes_received = _get_body_size(resp)
+            request = getattr(resp, 'request', None)
+            body = getattr(request, 'body', None)
+            self.bytes_sent = len(body) if body else 0
+
+    @property
+    def latency(self):
+        """ Returns the seconds between sending the request and receiving
+            its final response.
+        """
+        if self.ended_at is None:
+            return None
+        return self.ended_at - self.started_at
+
+    @property
+    def queue_time(self):
+        """ Returns an estimate of the seconds spent waiting for the
+            session's thread pool, being the latency of the final attempt
+            not accounted for by the response's elapsed time.
+        """
+        if self.ended_at is None or self.elapsed is None or self.retries:
+            return None
+        return max(0.0, self.latency - self.elapsed)
+
+
+def _get_body_size(resp):
+    """ returns the size of a response's body without reading a streamed
+        body, which is left to its caller, taking its Content-Length
+        instead.
+    """
+    if getattr(resp, '_content_consumed', True):
+        return len(resp.content or b'')
+    try:
+        return int(resp.headers.get('Content-Length', 0))
+    except ValueError:
+        return 0
+
+
+class CallStats(object):
+    """ The requests sent and time spent by a get_submissions or
+        get_all_submissions call given it as stats. It is updated as
+        submissions are consumed and is final once the call has finished,
+        been closed or timed out.
+
+        requests counts every attempt sent, including retries, and
+        cancelled the page requests cancelled before being sent.
+    """
+
+    __slots__ = ('requests', 'cancelled', 'pages', 'started_at', 'ended_at')
+
+    def __init__(self):
+        self.requests = 0
+        self.cancelled = 0
+        self.pages = 0
+        self.started_at = None
+        self.ended_at = None
+
+    @property
+    def seconds(self):
+        """ Returns the seconds spent by the call so far. """
+        if self.started_at is None:
+            return 0.0
+        return (self.ended_at or time.monotonic()) - self.started_at
+
+    def __repr__(self):
+        return 'CallStats(requests=%d, cancelled=%d, pages=%d, ' \
+               'seconds=%.3f)' % (self.requests, self.cancelled, self.pages,
+                                  self.seconds)
+
+
+class Instrumentation(object):
+    """ Receives events from a BugcrowdClient. Subclasses override the
+        callbacks they are interested in.
+    """
+
+    def request_started(self, span):
+        """ Called when a request is first sent. """
+
+    def request_finished(self, span):
+        """ Called with the final response, or error, of a request. """
+
+    def response_decoded(self, span, seconds):
+        """ Called once the json body of a response has been decoded. """
+
+    def request_coalesced(self, endpoint):
+        """ Called when a GET shares the request of an identical GET
+            already in flight rather than being sent.
+        """
+
+    def pages_fetched(self, submissions_uri, pages):
+        """ Called when the pages of a get_submissions call are finished
+            with.
+        """
+
+
+class Histogram(object):
+    """ A fixed memory histogram of positive values. """
+
+    # Bucket upper bounds, in seconds, from 1ms to about 2 minutes.
+    default_bounds = tuple(0.001 * 2 ** x for x in range(18))
+
+    def __init__(self, bounds=None):
+        self.bounds = tuple(bounds or self.default_bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """ Records a value. """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        """ Returns the upper bound of the bucket holding the given
+            percentile, capped by the largest value seen.
+        """
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        """ Returns summary statistics of the recorded values. """
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': self.total / self.count,
+            'min': self.min,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class _EndpointMetrics(object):
+    """ metrics for a single endpoint. """
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.queue_time = Histogram()
+        self.decode_time = Histogram()
+        self.errors = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def summary(self):
+        return {
+            'latency': self.latency.summary(),
+            'queue_time': self.queue_time.summary(),
+            'decode_time': self.decode_time.summary(),
+            'errors': self.errors,
+            'retries': self.retries,
+            'coalesced': self.coalesced,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+        }
+
+
+class MetricsCollector(Instrumentation):
+    """ Collects request metrics in memory. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.queue_depth = Histogram(bounds=[2 ** x for x in range(12)])
+        self.pages = Histogram(bounds=[2 ** x for x in range(16)])
+
+    def _get_endpoint_metrics(self, endpoint):
+        metrics = self._endpoints.get(endpoint)
+        if metrics is None:
+            metrics = self._endpoints[endpoint] = _EndpointMetrics()
+        return metrics
+
+    def request_started(self, span):
+        with self._lock:
+            self.queue_depth.add(span.queue_depth)
+
+    def request_finished(self, span):
+        with self._lock:
+            metrics = self._get_endpoint_metrics(span.endpoint)
+            metrics.latency.add(span.latency)
+            if span.queue_time is not None:
+                metrics.queue_time.add(span.queue_time)
+            if span.error is not None or (span.status_code or 0) >= 400:
+                metrics.errors += 1
+            metrics.retries += span.retries
+            metrics.bytes_sent += span.bytes_sent
+            metrics.bytes_received += span.bytes_received
+
+    def response_decoded(self, span, seconds):
+        with self._lock:
+            self._get_endpoint_metrics(
+                span.endpoint).decode_time.add(seconds)
+
+    def request_coalesced(self, endpoint):
+        with self._lock:
+            self._get_endpoint_metrics(endpoint).coalesced += 1
+
+    def pages_fetched(self, submissions_uri, pages):
+        with self._lock:
+            self.pages.add(pages)
+
+    def summary(self):
+        """ Returns summary statistics of the collected metrics. """
+        with self._lock:
+            return {
+                'endpoints': {endpoint: metrics.summary() for endpoint,
+                              metrics in sorted(self._endpoints.items())},
+                'queue_depth': self.queue_depth.summary(),
+                'pages_per_get_submissions': self.pages.summary(),
+            }
+
+    def dump(self, stream=None):
+        """ Writes the summary statistics as json to stream, standard
+            output by default.
+        """
+        stream = stream or sys.stdout
+        json.dump(self.summary(), stream, indent=2, sort_keys=True)
+        stream.write('\n')
@@ -0,0 +1,196 @@
+import json
+import re
+from collections.abc import Mapping
+
+
+_STRING_RE = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+_SCALAR_RE = re.compile(r'[^,}\]\s]+')
+_STRUCTURE_RE = re.compile(r'[{}\[\]"]')
+_WHITESPACE_RE = re.compile(r'\s*')
+
+
+def _skip_whitespace(text, idx):
+    """ returns the index of the next non whitespace character. """
+    return _WHITESPACE_RE.match(text, idx).end()
+
+
+def _skip_value(text, idx):
+    """ returns the index after the json value starting at idx without
+        decoding it.
+    """
+    char = text[idx:idx + 1]
+    if char == '"':
+        match = _STRING_RE.match(text, idx)
+        if match is None:
+            raise ValueError('Unterminated string at %d' % idx)
+        return match.end()
+    if char in ('{', '['):
+        depth = 0
+        match = _STRUCTURE_RE.search(text, idx)
+        while match is not None:
+            token = match.group()
+            if token == '"':
+                end = _skip_value(text, match.start())
+            else:
+                depth += 1 if token in '{[' else -1
+                end = match.end()
+                if depth == 0:
+                    return end
+            match = _STRUCTURE_RE.search(text, end)
+        raise ValueError('Unterminated structure at %d' % idx)
+    match = _SCALAR_RE.match(text, idx)
+    if match is None:
+        raise ValueError('Expected a value at %d' % idx)
+    return match.end()
+
+
+def scan_object(text, idx=0):
+    """ Yields (key, start, end) for each member of the json object
+        starting at idx, where text[start:end] is the undecoded value.
+    """
+    idx = _skip_whitespace(text, idx)
+    if text[idx:idx + 1] != '{':
+        raise ValueError('Expected an object at %d' % idx)
+    idx = _skip_whitespace(text, idx + 1)
+    if text[idx:idx + 1] == '}':
+        return
+    while True:
+        key, idx = json.decoder.scanstring(text, idx + 1)
+        idx = _skip_whitespace(text, idx)
+        if text[idx:idx + 1] != ':':
+            raise ValueError('Expected : at %d' % idx)
+        start = _skip_whitespace(text, idx + 1)
+        end = _skip_value(text, start)
+        yield key, start, end
+        idx = _skip_whitespace(text, end)
+        char = text[idx:idx + 1]
+        if char == '}':
+            return
+        if char != ',':
+            raise ValueError('Expected , or } at %d' % idx)
+        idx = _skip_whitespace(text, idx + 1)
+
+
+class Model(Mapping):
+    """ A read only, memory efficient view of an api object.
+
+        The fields named in eager_fields are held in slots and the others
+        are held undecoded, when built from json, and decoded on first
+        access. Models behave as mappings, so fields can be read as items
+        or as attributes.
+    """
+
+    __slots__ = ('_raw', '_decoded')
+
+    # The fields decoded when the model is built.
+    eager_fields = ()
+
+    @classmethod
+    def from_dict(cls, data, fields=None):
+        """ Returns a model of the given decoded object, keeping only the
+            given fields, if any, and its uuid.
+        """
+        obj = cls.__new__(cls)
+        obj._raw = {}
+        obj._decoded = {}
+        for key, value in data.items():
+            if not cls._is_projected(key, fields):
+                continue
+            if key in cls.eager_fields:
+                setattr(obj, key, value)
+            else:
+                obj._decoded[key] = value
+        return obj
+
+    @classmethod
+    def from_json(cls, text, fields=None):
+        """ Returns a model of the given json object, keeping only the given
+            fields, if any, and its uuid. Only the eager fields are
+            decoded.
+        """
+        obj = cls.__new__(cls)
+        obj._raw = {}
+        obj._decoded = {}
+        for key, start, end in scan_object(text):
+            if not cls._is_projected(key, fields):
+                continue
+            if key in cls.eager_fields:
+                setattr(obj, key, json.loads(text[start:end]))
+            else:
+                obj._raw[key] = text[start:end]
+        return obj
+
+    @staticmethod
+    def _is_projected(key, fields):
+        return fields is None or key == 'uuid' or key in fields
+
+    def __getitem__(self, key):
+        if key in self.eager_fields:
+            try:
+                return object.__getattribute__(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        try:
+            return self._decoded[key]
+        except KeyError:
+            pass
+        raw = self._raw.pop(key)
+        value = self._decoded[key] = json.loads(raw)
+        return value
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __iter__(self):
+        for key in self.eager_fields:
+            if hasattr(self, key):
+                yield key
+        for key in self._decoded:
+            yield key
+        for key in list(self._raw):
+            yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        if key in self.eager_fields:
+            return hasattr(self, key)
+        return key in self._decoded or key in self._raw
+
+    def to_dict(self):
+        """ Returns the model as a dict, decoding every field. """
+        return {key: self[key] for key in self}
+
+    def __repr__(self):
+        return '%s(uuid=%r)' % (type(self).__name__, self.get('uuid'))
+
+
+class Bounty(Model):
+    """ A bounty. """
+
+    eager_fields = ('uuid', 'name', 'code', 'status', 'starts_at',
+                    'ends_at')
+    __slots__ = eager_fields
+
+
+class Submission(Model):
+    """ A submission. """
+
+    eager_fields = ('uuid', 'title', 'substate', 'bounty_code',
+                    'reference_number', 'submitted_at', 'vrt_id', 'bug_url',
+                    'priority', 'caption')
+    __slots__ = eager_fields
+
+
+class Comment(Model):
+    """ A comment on a submission. """
+
+    eager_fields = ('uuid', 'created_at', 'user_id', 'type',
+                    'file_attachments_count')
+    __slots__ = eager_fields
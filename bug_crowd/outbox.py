@@ -0,0 +1,292 @@
+import datetime
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import Mapping
+
+from .batch import BatchOperation, BatchReport, OperationResult, run_batch
+
+
+# The statuses of a queued operation.
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+class OutboundQueue(object):
+    """ A durable, sqlite backed queue of the client's write operations.
+
+        Operations are stored as soon as they are enqueued and sent later,
+        by drain or by a background drainer, in batches run with
+        run_batch so they are rate limited by the client's scheduler. Each
+        operation is sent with an idempotency key so that one sent again,
+        after a failure or a restart, is not applied twice. Operations
+        failing with a 4xx response, other than a 408 or 429, are marked
+        failed, and others are retried with backoff up to max_attempts
+        times.
+    """
+
+    def __init__(self, path=':memory:', **kwargs):
+        """ Opens the queue stored at the given path. Operations that were
+            being sent when the queue was last closed are sent again.
+        """
+        self.path = path
+        self.max_attempts = kwargs.get('max_attempts', 5)
+        self.retry_delay = kwargs.get('retry_delay', 1.0)
+        self.max_retry_delay = kwargs.get('max_retry_delay', 300.0)
+        self._clock = kwargs.get('clock', time.time)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.last_error = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS outbound_operations ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'idempotency_key TEXT UNIQUE NOT NULL, method TEXT NOT NULL, '
+                'args TEXT NOT NULL, kwargs TEXT NOT NULL, '
+                'status TEXT NOT NULL, attempts INTEGER NOT NULL, '
+                'next_attempt_at REAL NOT NULL, created_at REAL NOT NULL, '
+                'status_code INTEGER, error TEXT)')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS outbound_operations_ready '
+                'ON outbound_operations (status, next_attempt_at)')
+            self._conn.execute(
+                'UPDATE outbound_operations SET status = ? '
+                'WHERE status = ?', (PENDING, SENDING))
+
+    def enqueue(self, method, *args, **kwargs):
+        """ Stores a call to one of the client's write methods, as for a
+            BatchOperation, and returns its idempotency key. A key may be
+            given as idempotency_key, in which case an operation already
+            queued with that key is not queued again.
+        """
+        key = kwargs.pop('idempotency_key', None) or uuid.uuid4().hex
+        BatchOperation(method, *args, **kwargs)
+        now = self._clock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO outbound_operations (idempotency_key, '
+                'method, args, kwargs, status, attempts, next_attempt_at, '
+                'created_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?)',
+                (key, method, _dumps(args), _dumps(kwargs), PENDING, now,
+                 now))
+        return key
+
+    def get_status(self, idempotency_key):
+        """ Returns the status, attempts, last status code and last error
+            of the operation with the given key, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT status, attempts, status_code, error FROM '
+                'outbound_operations WHERE idempotency_key = ?',
+                (idempotency_key,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('status', 'attempts', 'status_code', 'error'), row))
+
+    def count(self, status=PENDING):
+        """ Returns the number of operations with the given status. """
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM outbound_operations WHERE status = ?',
+                (status,)).fetchone()[0]
+
+    def get_failed(self):
+        """ Returns the operations that failed, as BatchOperations with
+            their idempotency_key, oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT idempotency_key, method, args, kwargs FROM '
+                'outbound_operations WHERE status = ? ORDER BY id',
+                (FAILED,)).fetchall()
+        return [_get_operation(*row) for row in rows]
+
+    def retry_failed(self):
+        """ Queues the failed operations to be sent again. """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE outbound_operations SET status = ?, attempts = 0, '
+                'next_attempt_at = ? WHERE status = ?',
+                (PENDING, self._clock(), FAILED))
+
+    def purge(self, status=SENT):
+        """ Deletes the operations with the given status. """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM outbound_operations WHERE status = ?',
+                (status,))
+
+    def drain(self, client, **kwargs):
+        """ Sends operations that are due through the given client until
+            none remain and returns a BatchReport of their results.
+
+            Up to batch_size operations are taken at a time, in the order
+            they were queued, and sent with up to max_in_flight in
+            progress at once. The results do not keep their responses,
+            whose status codes are recorded for get_status; iter_drain
+            yields results in full without keeping them.
+        """
+        return BatchReport([
+            OperationResult(result.operation, error=result.error,
+                            latency=result.latency)
+            for result in self._drain(client, None, **kwargs)])
+
+    def iter_drain(self, client, **kwargs):
+        """ Drains the queue as for drain, yielding the result of each
+            operation once its batch has been sent and recorded.
+        """
+        return self._drain(client, None, **kwargs)
+
+    def _drain(self, client, stopped, **kwargs):
+        """ drains the queue as for iter_drain, returning early between
+            batches once the stopped event is set.
+        """
+        batch_size = kwargs.get('batch_size', 50)
+        max_in_flight = kwargs.get('max_in_flight', 10)
+        while stopped is None or not stopped.is_set():
+            operations = self._claim(batch_size)
+            if not operations:
+                break
+            report = run_batch(client, operations,
+                               max_in_flight=max_in_flight)
+            self._record(report)
+            for result in report:
+                yield result
+
+    def _claim(self, batch_size):
+        """ marks up to batch_size due operations as being sent and returns
+            them.
+        """
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                'SELECT idempotency_key, method, args, kwargs FROM '
+                'outbound_operations WHERE status = ? AND '
+                'next_attempt_at <= ? ORDER BY id LIMIT ?',
+                (PENDING, self._clock(), batch_size)).fetchall()
+            self._conn.executemany(
+                'UPDATE outbound_operations SET status = ?, '
+                'attempts = attempts + 1 WHERE idempotency_key = ?',
+                [(SENDING, row[0]) for row in rows])
+        return [_get_operation(*row) for row in rows]
+
+    def _record(self, report):
+        """ records the results of sent operations. """
+        now = self._clock()
+        with self._lock, self._conn:
+            for result in report:
+                key = result.operation.kwargs['idempotency_key']
+                status_code = getattr(result.response, 'status_code', None)
+                if result.ok:
+                    self._conn.execute(
+                        'UPDATE outbound_operations SET status = ?, '
+                        'status_code = ?, error = NULL '
+                        'WHERE idempotency_key = ?', (SENT, status_code, key))
+                    continue
+                attempts = self._conn.execute(
+                    'SELECT attempts FROM outbound_operations '
+                    'WHERE idempotency_key = ?', (key,)).fetchone()[0]
+                status = PENDING
+                if (attempts >= self.max_attempts or
+                        not _is_retryable(result.error, status_code)):
+                    status = FAILED
+                delay = min(self.max_retry_delay,
+                            self.retry_delay * 2 ** (attempts - 1))
+                self._conn.execute(
+                    'UPDATE outbound_operations SET status = ?, '
+                    'status_code = ?, error = ?, next_attempt_at = ? '
+                    'WHERE idempotency_key = ?',
+                    (status, status_code, repr(result.error), now + delay,
+                     key))
+
+    def start(self, client, interval=1.0, **kwargs):
+        """ Starts draining the queue through the given client every
+            interval seconds on a background thread. kwargs are passed to
+            drain. An exception raised while draining, such as a database
+            error, is kept as last_error and draining is tried again after
+            the interval.
+        """
+        if self._thread is not None:
+            raise RuntimeError('The queue is already being drained')
+        self._stopped.clear()
+        self.last_error = None
+
+        def run():
+            while not self._stopped.is_set():
+                try:
+                    for _ in self._drain(client, self._stopped, **kwargs):
+                        pass
+                except Exception as e:
+                    self.last_error = e
+                self._stopped.wait(interval)
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the background drainer once its current batch is sent,
+            without waiting for the rest of the queue. Operations still
+            queued are kept for the next drain.
+        """
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def close(self):
+        """ Stops any background drainer and closes the database. """
+        self.stop()
+        self._conn.close()
+
+
+def _is_retryable(error, status_code):
+    """ returns whether an operation failing with the given error and
+        status code may succeed if sent again.
+    """
+    if status_code is None:
+        return not isinstance(error, (TypeError, ValueError))
+    return status_code in (408, 429) or status_code >= 500
+
+
+def _get_operation(key, method, args, kwargs):
+    """ returns the BatchOperation of a stored operation. """
+    kwargs = json.loads(kwargs, object_hook=_decode_object)
+    kwargs['idempotency_key'] = key
+    return BatchOperation(
+        method, *json.loads(args, object_hook=_decode_object), **kwargs)
+
+
+def _dumps(value):
+    return json.dumps(value, default=_encode_object)
+
+
+def _encode_object(obj):
+    """ encodes the models and datetimes that write methods accept. """
+    if isinstance(obj, datetime.datetime):
+        offset = obj.utcoffset()
+        return {'__datetime__': [
+            obj.year, obj.month, obj.day, obj.hour, obj.minute, obj.second,
+            obj.microsecond], '__utcoffset__': (
+                None if offset is None else offset.total_seconds())}
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError('%r can not be queued' % (obj,))
+
+
+def _decode_object(obj):
+    if '__datetime__' not in obj:
+        return obj
+    offset = obj['__utcoffset__']
+    tzinfo = None
+    if offset is not None:
+        tzinfo = datetime.timezone(datetime.timedelta(seconds=offset))
+    return datetime.datetime(*obj['__datetime__'], tzinfo=tzinfo)
@@ -0,0 +1,193 @@
+import datetime
+
+from .client import _get_timestamp
+
+
+# The substates a submission may be in.
+SUBSTATES = ('new', 'triaged', 'unresolved', 'resolved', 'informational',
+             'not_applicable', 'not_reproducible', 'out_of_scope',
+             'duplicate', 'wont_fix')
+
+# The orders the api can sort submissions in.
+SORT_ORDERS = ('newest', 'oldest')
+
+# The operators conditions may use.
+OPERATORS = ('eq', 'ne', 'in', 'lt', 'lte', 'gt', 'gte', 'contains')
+
+
+class Condition(object):
+    """ A condition on a submission field. """
+
+    __slots__ = ('field', 'operator', 'value')
+
+    def __init__(self, field, operator, value):
+        self.field = field
+        self.operator = operator
+        self.value = value
+
+    def matches(self, submission):
+        """ Returns whether the given submission satisfies the condition. """
+        actual = submission.get(self.field)
+        value = self.value
+        if isinstance(actual, str) and isinstance(value, datetime.datetime):
+            value = _get_timestamp(value)
+        if self.operator == 'eq':
+            return actual == value
+        if self.operator == 'ne':
+            return actual != value
+        if self.operator == 'in':
+            return actual in value
+        if actual is None:
+            return False
+        if self.operator == 'contains':
+            return value.lower() in actual.lower()
+        if self.operator == 'lt':
+            return actual < value
+        if self.operator == 'lte':
+            return actual <= value
+        if self.operator == 'gt':
+            return actual > value
+        return actual >= value
+
+    def __repr__(self):
+        return 'Condition(%r, %r, %r)' % (
+            self.field, self.operator, self.value)
+
+
+class SubmissionQuery(object):
+    """ A query on submissions for get_submissions.
+
+        Queries are built by chaining filter, order_by and only, each
+        returning a new query. Conditions the api can evaluate, equality
+        on the fields in server_filters and a title search, are sent as
+        query parameters so fewer and smaller pages are fetched. Every
+        condition is also checked on the client as submissions are read,
+        so those the api can not express still apply.
+    """
+
+    # The types of the fields conditions may be placed on.
+    field_types = {
+        'uuid': str,
+        'title': str,
+        'substate': str,
+        'bounty_code': str,
+        'reference_number': str,
+        'vrt_id': str,
+        'bug_url': str,
+        'caption': str,
+        'priority': int,
+        'submitted_at': datetime.datetime,
+    }
+
+    # The fields the api filters on by equality.
+    server_filters = ('substate', 'priority')
+
+    def __init__(self):
+        self.conditions = ()
+        self.sort = None
+        self.fields = None
+
+    def _copy(self):
+        query = type(self)()
+        query.conditions = self.conditions
+        query.sort = self.sort
+        query.fields = self.fields
+        return query
+
+    def filter(self, **kwargs):
+        """ Returns a query with the given conditions added. Keywords are
+            a field name, optionally followed by two underscores and an
+            operator such as lte or in, as in priority__lte=2.
+        """
+        conditions = []
+        for key, value in sorted(kwargs.items()):
+            field, _, operator = key.partition('__')
+            conditions.append(self._get_condition(
+                field, operator or 'eq', value))
+        query = self._copy()
+        query.conditions = self.conditions + tuple(conditions)
+        return query
+
+    def _get_condition(self, field, operator, value):
+        """ returns a Condition after checking it is well typed. """
+        field_type = self.field_types.get(field)
+        if field_type is None:
+            raise ValueError('Unknown submission field %s' % field)
+        if operator not in OPERATORS:
+            raise ValueError('Unknown operator %s' % operator)
+        if operator == 'contains' and field_type is not str:
+            raise ValueError('%s can not be searched' % field)
+        values = value if operator == 'in' else [value]
+        if operator == 'in':
+            if isinstance(value, str):
+                raise ValueError('in expects a collection of values')
+            value = frozenset(value)
+        for item in values:
+            if item is None and operator in ('eq', 'ne', 'in'):
+                continue
+            if not isinstance(item, field_type) or (
+                    field_type is int and isinstance(item, bool)):
+                raise TypeError('%s expects %s values, not %r' % (
+                    field, field_type.__name__, item))
+            if field == 'substate' and item not in SUBSTATES:
+                raise ValueError('Unknown substate %s' % item)
+        return Condition(field, operator, value)
+
+    def order_by(self, sort):
+        """ Returns a query sorted in the given order, newest or oldest. """
+        if sort not in SORT_ORDERS:
+            raise ValueError('Unknown sort order %s' % sort)
+        query = self._copy()
+        query.sort = sort
+        return query
+
+    def only(self, *fields):
+        """ Returns a query yielding only the given fields, and the uuid,
+            of submissions and asking the api for only those.
+        """
+        query = self._copy()
+        query.fields = ('uuid',) + tuple(
+            field for field in fields if field != 'uuid')
+        return query
+
+    def get_params(self, params=None):
+        """ Returns the api query parameters for the query, added to the
+            given params.
+        """
+        params = dict(params or {'sort': 'newest', 'offset': 0})
+        if self.sort is not None:
+            params['sort'] = self.sort
+        terms = []
+        searches = []
+        for condition in self.conditions:
+            if (condition.operator == 'eq' and
+                    condition.field in self.server_filters and
+                    condition.value is not None):
+                terms.append('%s:%s' % (condition.field, condition.value))
+            elif (condition.operator == 'contains' and
+                    condition.field == 'title'):
+                searches.append(condition.value)
+        if terms:
+            params['filter'] = ' '.join(terms)
+        if searches:
+            params['search'] = ' '.join(searches)
+        if self.fields is not None:
+            fields = list(self.fields)
+            for condition in self.conditions:
+                if condition.field not in fields:
+                    fields.append(condition.field)
+            params['fields'] = ','.join(fields)
+        return params
+
+    def matches(self, submission):
+        """ Returns whether the given submission satisfies every condition
+            of the query.
+        """
+        for condition in self.conditions:
+            if not condition.matches(submission):
+                return False
+        return True
+
+    def __repr__(self):
+        return 'SubmissionQuery(conditions=%r, sort=%r, fields=%r)' % (
+            list(self.conditions), self.sort, self.fields)
@@ -0,0 +1,430 @@
+import collections
+import random
+import threading
+import time
+
+
+# Methods that are safe to send again after a failure.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+class TokenBucket(object):
+    """ A thread safe token bucket rate limiter.
+        A rate of None allows an unlimited number of requests.
+    """
+
+    def __init__(self, rate=None, capacity=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._sleep = sleep
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._paused_until = None
+
+    @property
+    def rate(self):
+        """ Returns the number of tokens added to the bucket a second. """
+        return self._rate
+
+    @property
+    def capacity(self):
+        """ Returns the maximum number of tokens held by the bucket. """
+        if self._capacity is not None:
+            return self._capacity
+        if self._rate is None:
+            return 1
+        return max(1, self._rate)
+
+    def set_rate(self, rate):
+        """ Changes the rate at which tokens are added to the bucket. """
+        with self._lock:
+            self._refill()
+            self._rate = rate
+            self._tokens = min(self._tokens, self.capacity)
+
+    def pause_until(self, when):
+        """ Prevents tokens being acquired before the given clock time. """
+        with self._lock:
+            if self._paused_until is None or when > self._paused_until:
+                self._paused_until = when
+
+    def try_acquire(self):
+        """ Takes a token if one is available now, returning whether it
+            did.
+        """
+        with self._lock:
+            if self._get_delay() > 0:
+                return False
+            if self._rate is not None:
+                self._tokens -= 1
+            return True
+
+    def acquire(self, timeout=None):
+        """ Blocks until a token is available and takes it. If no token
+            will be available within timeout seconds a TimeoutError is
+            raised without waiting.
+        """
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            with self._lock:
+                delay = self._get_delay()
+                if delay <= 0:
+                    if self._rate is not None:
+                        self._tokens -= 1
+                    return
+            if deadline is not None and self._clock() + delay > deadline:
+                from concurrent import futures
+                raise futures.TimeoutError()
+            self._sleep(delay)
+
+    def _refill(self):
+        now = self._clock()
+        if self._rate is not None:
+            elapsed = now - self._updated_at
+            self._tokens = min(
+                self.capacity, self._tokens + elapsed * self._rate)
+        self._updated_at = now
+
+    def _get_delay(self):
+        self._refill()
+        now = self._updated_at
+        if self._paused_until is not None and now < self._paused_until:
+            return self._paused_until - now
+        if self._rate is None or self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self._rate
+
+
+class RequestScheduler(object):
+    """ Sends requests subject to a shared rate limit, retrying requests
+        that failed because of rate limiting or server errors.
+
+        The rate limit adapts to the X-RateLimit-Remaining,
+        X-RateLimit-Reset and Retry-After headers sent by the server, and
+        is halved when a request is rate limited without them. GET
+        requests are retried with jittered exponential backoff after
+        connection errors, bodies cut off and 429 or 5xx responses, other
+        requests are only retried after a 429 response as the server did
+        not act on them.
+
+        Requests submitted while the rate limit holds are queued and sent
+        in turn from a dispatch thread, so that callers prefetching
+        several requests are not blocked until the last can be sent.
+    """
+
+    def __init__(self, rate=None, **kwargs):
+        """ Creates a request scheduler limited to rate requests a second.
+            A rate of None leaves requests unlimited until the server
+            indicates otherwise.
+        """
+        self._clock = kwargs.get('clock', time.monotonic)
+        self._sleep = kwargs.get('sleep', time.sleep)
+        self._random = kwargs.get('random', random.random)
+        self.bucket = TokenBucket(
+            rate, capacity=kwargs.get('burst', None),
+            clock=self._clock, sleep=self._sleep)
+        self.max_retries = kwargs.get('max_retries', 5)
+        self.backoff_factor = kwargs.get('backoff_factor', 0.5)
+        self.max_backoff = kwargs.get('max_backoff', 60)
+        self.min_rate = kwargs.get('min_rate', 0.1)
+        self.max_rate = kwargs.get('max_rate', None)
+        self.fallback_rate = kwargs.get('fallback_rate', 5)
+        self.retry_statuses = frozenset(
+            kwargs.get('retry_statuses', (429, 500, 502, 503, 504)))
+        self._dispatch_lock = threading.Lock()
+        self._waiting = collections.deque()
+        self._dispatcher = None
+
+    def submit(self, method, send, on_result=None, deadline=None):
+        """ Returns a future-like ScheduledRequest for the request sent by
+            calling send, which must return a future of a response.
+            on_result, if given, is called with the final response or
+            exception and the number of attempts made. A TimeoutError is
+            raised, when sending or waiting for the request, rather than
+            waiting for the rate limit or a retry past the given
+            time.monotonic deadline.
+        """
+        return ScheduledRequest(self, method.upper(), send, on_result,
+                                deadline)
+
+    def dispatch(self, send, deadline=None, block=True):
+        """ Waits for the rate limit and then calls send, raising a
+            TimeoutError if the wait would pass the given time.monotonic
+            deadline. Unless block is set, a request that would wait, or
+            that is submitted while others are waiting, is queued instead
+            and a future of its response returned at once. It fails with
+            the TimeoutError once the deadline passes.
+        """
+        timeout = get_timeout(deadline)
+        if block:
+            self.bucket.acquire(timeout)
+            return send()
+        with self._dispatch_lock:
+            if self._waiting or not self.bucket.try_acquire():
+                from concurrent.futures import Future
+                future = Future()
+                self._waiting.append((future, send, deadline))
+                if self._dispatcher is None:
+                    self._dispatcher = threading.Thread(
+                        target=self._dispatch_waiting)
+                    self._dispatcher.daemon = True
+                    self._dispatcher.start()
+                return future
+        return send()
+
+    def _dispatch_waiting(self):
+        """ sends the queued requests, in order, as the rate limit allows. """
+        from concurrent import futures
+        while True:
+            with self._dispatch_lock:
+                if not self._waiting:
+                    self._dispatcher = None
+                    return
+                future, send, deadline = self._waiting[0]
+            if not future.cancelled():
+                try:
+                    self.bucket.acquire(get_timeout(deadline))
+                except futures.TimeoutError as e:
+                    if future.set_running_or_notify_cancel():
+                        future.set_exception(e)
+                else:
+                    if future.set_running_or_notify_cancel():
+                        try:
+                            _chain(send(), future)
+                        except Exception as e:
+                            future.set_exception(e)
+            with self._dispatch_lock:
+                self._waiting.popleft()
+
+    def is_retryable(self, method, resp):
+        """ Returns whether the request resulting in resp can be retried. """
+        status = getattr(resp, 'status_code', None)
+        if status not in self.retry_statuses:
+            return False
+        return status == 429 or method in IDEMPOTENT_METHODS
+
+    def get_retry_delay(self, attempt, resp=None):
+        """ Returns the number of seconds to wait before the given retry
+            attempt.
+        """
+        retry_after = self._get_retry_after(resp)
+        if retry_after is not None:
+            return retry_after
+        backoff = min(self.max_backoff, self.backoff_factor * 2 ** attempt)
+        return self._random() * backoff
+
+    def update_from_response(self, resp):
+        """ Adjusts the rate limit using the headers of the response. """
+        status = getattr(resp, 'status_code', None)
+        retry_after = self._get_retry_after(resp)
+        if retry_after is not None:
+            self.bucket.pause_until(self._clock() + retry_after)
+        remaining = _parse_number(_get_header(resp, 'X-RateLimit-Remaining'))
+        reset = _parse_number(_get_header(resp, 'X-RateLimit-Reset'))
+        if remaining is not None and reset is not None:
+            if reset > 1000000000:
+                reset -= time.time()
+            self._set_rate(remaining / max(reset, 1))
+        elif status == 429:
+            rate = self.bucket.rate
+            self._set_rate(self.fallback_rate if rate is None else rate / 2)
+
+    def _set_rate(self, rate):
+        rate = max(self.min_rate, rate)
+        if self.max_rate is not None:
+            rate = min(self.max_rate, rate)
+        self.bucket.set_rate(rate)
+
+    def _get_retry_after(self, resp):
+        value = _get_header(resp, 'Retry-After')
+        seconds = _parse_number(value)
+        if seconds is None and isinstance(value, str):
+            import email.utils
+            try:
+                retry_at = email.utils.parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            if retry_at is None:
+                return None
+            seconds = retry_at.timestamp() - time.time()
+        if seconds is None:
+            return None
+        return min(self.max_backoff, max(0, seconds))
+
+
+class ScheduledRequest(object):
+    """ A future-like request sent by a RequestScheduler.
+        Retries are sent when the result is waited upon.
+    """
+
+    def __init__(self, scheduler, method, send, on_result=None,
+                 deadline=None):
+        self._scheduler = scheduler
+        self._method = method
+        self._send = send
+        self._on_result = on_result
+        self._deadline = deadline
+        self._response = None
+        self._cancelled = False
+        self._callbacks = []
+        self.attempts = 1
+        try:
+            self._future = scheduler.dispatch(send, deadline, block=False)
+        except Exception as e:
+            self._finish(None, e)
+            raise
+
+    def result(self, timeout=None):
+        """ Returns the response once no further retries are needed. The
+            timeout, in seconds, and the request's deadline bound the wait
+            for every attempt and the delays between them.
+        """
+        if self._response is not None:
+            return self._response
+        # imported here, once requests are being sent, so that importing the
+        # client does not import requests.
+        from concurrent import futures
+
+        import requests
+
+        if self._cancelled:
+            raise futures.CancelledError()
+        deadline = self._deadline
+        if timeout is not None:
+            deadline = min(deadline or float('inf'),
+                           time.monotonic() + timeout)
+        scheduler = self._scheduler
+        while True:
+            resp = None
+            try:
+                resp = self._future.result(get_timeout(deadline))
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                if (self._method not in IDEMPOTENT_METHODS or
+                        self.attempts > scheduler.max_retries):
+                    self._finish(None, e)
+                    raise
+            except futures.TimeoutError:
+                raise
+            except Exception as e:
+                self._finish(None, e)
+                raise
+            else:
+                scheduler.update_from_response(resp)
+                if (self.attempts > scheduler.max_retries or
+                        not scheduler.is_retryable(self._method, resp)):
+                    self._response = resp
+                    self._finish(resp, None)
+                    return resp
+            delay = scheduler.get_retry_delay(self.attempts - 1, resp)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                error = futures.TimeoutError()
+                self._finish(resp, error)
+                raise error
+            scheduler._sleep(delay)
+            try:
+                self._future = scheduler.dispatch(self._send, deadline)
+            except futures.TimeoutError as e:
+                self._finish(resp, e)
+                raise
+            self.attempts += 1
+            for fn in self._callbacks:
+                self._future.add_done_callback(fn)
+
+    def _finish(self, resp, error):
+        on_result, self._on_result = self._on_result, None
+        if on_result is not None:
+            on_result(resp, error, self.attempts)
+
+    def exception(self, timeout=None):
+        """ Returns the exception raised by the request, if any. """
+        try:
+            self.result(timeout)
+        except Exception as e:
+            return e
+        return None
+
+    def done(self):
+        """ Returns whether the current attempt has finished. """
+        return self._future.done()
+
+    def running(self):
+        """ Returns whether the current attempt is running. """
+        return self._future.running()
+
+    def cancel(self):
+        """ Cancels the request, so that no retries are sent and result
+            raises a CancelledError. Returns whether the current attempt was
+            cancelled before being sent. Otherwise its response is closed
+            once it arrives, releasing its connection.
+        """
+        self._cancelled = True
+        self._on_result = None
+        if self._future.cancel():
+            return True
+        self._future.add_done_callback(_close_response)
+        return False
+
+    def cancelled(self):
+        """ Returns whether the request was cancelled. """
+        return self._cancelled
+
+    def add_done_callback(self, fn):
+        """ Calls fn with the current attempt, and with each retry, once it
+            has finished.
+        """
+        self._callbacks.append(fn)
+        self._future.add_done_callback(fn)
+
+
+def get_timeout(deadline):
+    """ Returns the seconds left until the given time.monotonic deadline, or
+        None if there is none, raising a TimeoutError once it has passed.
+    """
+    if deadline is None:
+        return None
+    timeout = deadline - time.monotonic()
+    if timeout <= 0:
+        from concurrent import futures
+        raise futures.TimeoutError()
+    return timeout
+
+
+def _chain(source, future):
+    """ completes future with the outcome of source once it finishes. """
+    def copy(source):
+        if source.cancelled():
+            from concurrent import futures
+            future.set_exception(futures.CancelledError())
+        elif source.exception() is not None:
+            future.set_exception(source.exception())
+        else:
+            future.set_result(source.result())
+    source.add_done_callback(copy)
+
+
+def _close_response(future):
+    """ closes the response of a finished attempt, if it has one. """
+    if future.cancelled() or future.exception() is not None:
+        return
+    future.result().close()
+
+
+def _get_header(resp, name):
+    headers = getattr(resp, 'headers', None)
+    if headers is None:
+        return None
+    try:
+        return headers.get(name)
+    except (AttributeError, TypeError):
+        return None
+
+
+def _parse_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
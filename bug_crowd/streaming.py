@@ -0,0 +1,205 @@
+import codecs
+import json
+import re
+
+from .models import _STRUCTURE_RE, _skip_whitespace
+
+
+# The characters of a json string following its opening quote, up to its
+# closing quote or a backslash ending the text scanned.
+_STRING_BODY_RE = re.compile(r'(?:[^"\\]|\\.)*', re.S)
+
+# The characters of a number, true, false or null.
+_SCALAR_BODY_RE = re.compile(r'[^,}\]\s]*')
+
+
+class _ValueScanner(object):
+    """ finds the end of a json value read in pieces, resuming each scan
+        where the last one stopped so that no text is scanned twice.
+    """
+
+    __slots__ = ('scalar', 'depth', 'in_string', 'escaped')
+
+    def __init__(self, char):
+        self.scalar = char not in ('{', '[', '"')
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def scan(self, text, idx):
+        """ returns the index after the value's end in text, scanning from
+            idx, or None if text ends first.
+        """
+        if self.scalar:
+            end = _SCALAR_BODY_RE.match(text, idx).end()
+            return end if end < len(text) else None
+        while idx < len(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                    idx += 1
+                idx = _STRING_BODY_RE.match(text, idx).end()
+                if idx >= len(text):
+                    return None
+                if text[idx] == '\\':
+                    self.escaped = True
+                    return None
+                self.in_string = False
+                idx += 1
+                if self.depth == 0:
+                    return idx
+                continue
+            match = _STRUCTURE_RE.search(text, idx)
+            if match is None:
+                return None
+            idx = match.end()
+            token = match.group()
+            if token == '"':
+                self.in_string = True
+                continue
+            self.depth += 1 if token in '{[' else -1
+            if self.depth == 0:
+                return idx
+        return None
+
+
+class _StreamBuffer(object):
+    """ text decoded from a stream of byte chunks, read on demand. """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.exhausted = False
+
+    def _read_text(self):
+        """ returns the text decoded from the next chunks, or None once the
+            stream is exhausted.
+        """
+        while not self.exhausted:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self.exhausted = True
+                self._decoder.decode(b'', final=True)
+                return None
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            text = self._decoder.decode(chunk)
+            if text:
+                return text
+        return None
+
+    def read_more(self):
+        """ appends the next chunk to the buffer, returning False once the
+            stream is exhausted.
+        """
+        text = self._read_text()
+        if text is None:
+            return False
+        self.text += text
+        return True
+
+    def discard(self, idx):
+        """ drops the text before idx once it is at least half the buffer,
+            so that consumed text is dropped in bulk rather than the rest
+            being copied after every value, and returns the new index of
+            idx.
+        """
+        if idx * 2 < len(self.text):
+            return idx
+        self.text = self.text[idx:]
+        return 0
+
+    def char(self, idx):
+        """ returns the first non whitespace character at or after idx and
+            its index.
+        """
+        while True:
+            idx = _skip_whitespace(self.text, idx)
+            if idx < len(self.text) or not self.read_more():
+                return self.text[idx:idx + 1], idx
+
+    def value_end(self, idx):
+        """ returns the index after the json value starting at idx. Chunks
+            read while scanning are held in a list and joined once the
+            value's end is found.
+        """
+        char = self.text[idx:idx + 1]
+        if char in ('', ',', '}', ']'):
+            raise ValueError('Expected a value at %d' % idx)
+        scanner = _ValueScanner(char)
+        end = scanner.scan(self.text, idx)
+        if end is not None:
+            return end
+        parts = [self.text]
+        size = len(self.text)
+        while True:
+            text = self._read_text()
+            if text is None:
+                self.text = ''.join(parts)
+                if scanner.scalar:
+                    return size
+                raise ValueError('Unterminated value at %d' % idx)
+            parts.append(text)
+            end = scanner.scan(text, 0)
+            if end is not None:
+                self.text = ''.join(parts)
+                return size + end
+            size += len(text)
+
+    def string_end(self, idx):
+        """ returns the decoded json string starting at idx and the index
+            after it.
+        """
+        while True:
+            try:
+                return json.decoder.scanstring(self.text, idx + 1)
+            except ValueError:
+                if not self.read_more():
+                    raise
+
+
+def iter_array_items(chunks, array_key, meta_keys=('meta',)):
+    """ Yields ('item', text) for each member of the array held under
+        array_key in the json object read from the given byte chunks, and
+        (key, value) for each member of the object named in meta_keys, in
+        the order they appear. Items are yielded undecoded as soon as they
+        have been read, so the whole body is never held at once.
+    """
+    buf = _StreamBuffer(chunks)
+    char, idx = buf.char(0)
+    if char != '{':
+        raise ValueError('Expected an object at %d' % idx)
+    char, idx = buf.char(idx + 1)
+    if char == '}':
+        return
+    while True:
+        if char != '"':
+            raise ValueError('Expected a key at %d' % idx)
+        key, idx = buf.string_end(idx)
+        char, idx = buf.char(idx)
+        if char != ':':
+            raise ValueError('Expected : at %d' % idx)
+        char, idx = buf.char(idx + 1)
+        if key == array_key and char == '[':
+            char, idx = buf.char(idx + 1)
+            while char != ']':
+                end = buf.value_end(idx)
+                yield 'item', buf.text[idx:end]
+                char, idx = buf.char(buf.discard(end))
+                if char == ',':
+                    char, idx = buf.char(idx + 1)
+                elif char != ']':
+                    raise ValueError('Expected , or ] at %d' % idx)
+            idx += 1
+        else:
+            end = buf.value_end(idx)
+            if key in meta_keys:
+                yield key, json.loads(buf.text[idx:end])
+            idx = buf.discard(end)
+        char, idx = buf.char(idx)
+        if char == '}':
+            return
+        if char != ',':
+            raise ValueError('Expected , or } at %d' % idx)
+        char, idx = buf.char(idx + 1)
@@ -0,0 +1,139 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+from .client import _get_uuid
+
+
+class MemoryCursorStore(object):
+    """ Stores sync cursors in memory. """
+
+    def __init__(self):
+        self._cursors = {}
+
+    def get(self, bounty_uuid):
+        """ Returns the cursor for the given bounty uuid or None. """
+        return self._cursors.get(bounty_uuid)
+
+    def set(self, bounty_uuid, cursor):
+        """ Stores the cursor for the given bounty uuid. """
+        self._cursors[bounty_uuid] = cursor
+
+
+class JSONCursorStore(object):
+    """ Stores sync cursors in a json file. """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def get(self, bounty_uuid):
+        """ Returns the cursor for the given bounty uuid or None. """
+        with self._lock:
+            return self._load().get(bounty_uuid)
+
+    def set(self, bounty_uuid, cursor):
+        """ Stores the cursor for the given bounty uuid. """
+        with self._lock:
+            cursors = self._load()
+            cursors[bounty_uuid] = cursor
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(cursors, f)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+
+class SQLiteCursorStore(object):
+    """ Stores sync cursors in a sqlite database. """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS sync_cursors '
+                '(bounty_uuid TEXT PRIMARY KEY, cursor TEXT NOT NULL)')
+
+    def get(self, bounty_uuid):
+        """ Returns the cursor for the given bounty uuid or None. """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT cursor FROM sync_cursors WHERE bounty_uuid = ?',
+                (bounty_uuid,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, bounty_uuid, cursor):
+        """ Stores the cursor for the given bounty uuid. """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sync_cursors (bounty_uuid, cursor) '
+                'VALUES (?, ?)', (bounty_uuid, json.dumps(cursor)))
+
+    def close(self):
+        """ Closes the underlying database connection. """
+        self._conn.close()
+
+
+def sync_submissions(client, bounty, store, **kwargs):
+    """ Yields the submissions of the given bounty or bounty uuid that have
+        not been seen by a previous sync using the same store.
+
+        Submissions are fetched newest first and pagination stops on
+        reaching a submission older than the stored cursor. The cursor
+        holds the newest timestamp seen, read from the timestamp_field
+        (submitted_at by default) of each submission, along with the uuids
+        of the submissions with that timestamp, so that submissions sharing
+        it are yielded once whatever order the api returns them in. It is
+        only advanced once every new submission has been yielded. The given
+        params should sort submissions by timestamp_field, newest first.
+    """
+    timestamp_field = kwargs.get('timestamp_field', 'submitted_at')
+    params = kwargs.get('params', None)
+    if params is None:
+        params = {'sort': 'newest', 'offset': 0}
+    bounty_uuid = _get_uuid(bounty)
+    cursor = store.get(bounty_uuid)
+    seen_uuids = set(cursor['uuids']) if cursor else set()
+    newest_timestamp = None
+    newest_uuids = []
+    submissions = client.get_submissions(
+        bounty, params=params, prefetch_pages=kwargs.get('prefetch_pages', 1))
+    for submission in submissions:
+        timestamp = submission[timestamp_field]
+        if cursor is not None:
+            if timestamp < cursor['timestamp']:
+                break
+            if (timestamp == cursor['timestamp'] and
+                    submission['uuid'] in seen_uuids):
+                continue
+        if newest_timestamp is None:
+            newest_timestamp = timestamp
+        if timestamp == newest_timestamp:
+            newest_uuids.append(submission['uuid'])
+        yield submission
+    submissions.close()
+    if newest_timestamp is None:
+        return
+    if cursor is not None and cursor['timestamp'] == newest_timestamp:
+        newest_uuids = cursor['uuids'] + newest_uuids
+    store.set(bounty_uuid, {
+        'timestamp': newest_timestamp,
+        'uuids': newest_uuids,
+    })
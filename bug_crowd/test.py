@@ -1,16 +1,62 @@
+import asyncio
+import csv
 import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
 import uuid
+from concurrent import futures
 from unittest import mock
 from urllib.parse import quote as url_quote
 
 import requests
 
+from .archive import ResponseArchive
+from .async_client import AsyncBugcrowdClient, aiohttp
+from .attachments import download_attachments, _get_safe_file_name
+from .batch import BatchOperation, run_batch
+from .benchmark import benchmark_cold_start, run_benchmarks
+from .cache import ResponseCache
 from .client import (
     BugcrowdClient,
     get_uri_for_bounty_submission,
     _convert_datetime_to_submission_creation_format,
 )
+from .export import (
+    export_bounty_submissions,
+    export_submissions,
+    main as export_main,
+    _iter_shard_submissions,
+)
+from .fake_server import FakeBugcrowdServer
+from .index import SubmissionIndex, normalize_bug_url
+from .instrumentation import (
+    CallStats,
+    Histogram,
+    MetricsCollector,
+    RequestSpan,
+    get_endpoint,
+)
+from .models import Bounty, Submission, scan_object
+from .outbox import OutboundQueue
+from .query import SubmissionQuery
+from .scheduler import RequestScheduler, TokenBucket
+from .streaming import _ValueScanner, iter_array_items
+from .sync import (
+    JSONCursorStore,
+    MemoryCursorStore,
+    SQLiteCursorStore,
+    sync_submissions,
+)
+from .transport import Transport
+from .watch import watch_submissions
 
 
 class ClientTest(unittest.TestCase):
@@ -162,6 +208,37 @@ class BugcrowdClientTest(unittest.TestCase):
             self.assertFalse(offset in seen_offsets)
             seen_offsets.add(offset)
 
+    @mock.patch.object(requests.Session, 'get')
+    def test_get_submissions_bounds_pages_in_flight(self, mocked_method):
+        """ tests that the get_submissions method only requests up to
+            prefetch_pages pages ahead of the page being consumed.
+        """
+        num_submissions = 10
+        expected_submissions = [get_example_submission(uuid=str(x))
+                                for x in range(0, num_submissions)]
+        content = [create_bounty_submissions_response(
+            [submission], count=1, total_hits=num_submissions, offset=x)
+            for x, submission in enumerate(expected_submissions)]
+        setup_mock_response(mocked_method, content)
+        params = {'sort': 'newest', 'offset': 0, 'limit': 1}
+        submissions = self.client.get_submissions(
+            self._bounty, params=params, prefetch_pages=2)
+        self.assertEqual(next(submissions), expected_submissions[0])
+        self.assertEqual(len(mocked_method.mock_calls), 3)
+        self.assertEqual(next(submissions), expected_submissions[1])
+        self.assertEqual(len(mocked_method.mock_calls), 4)
+        self.assertEqual(list(submissions), expected_submissions[2:])
+        offsets = [kwargs['params']['offset']
+                   for name, args, kwargs in mocked_method.mock_calls]
+        self.assertEqual(offsets, list(range(0, num_submissions)))
+
+    def test_get_submissions_checks_prefetch_pages(self):
+        """ tests that the get_submissions method requires at least one
+            page to be prefetched.
+        """
+        with self.assertRaises(ValueError):
+            next(self.client.get_submissions(self._bounty, prefetch_pages=0))
+
     @mock.patch.object(requests.Session, 'get')
     def test_get_comments_for_submission(self, mocked_method):
         """ tests that the get_comments_for_submission method works as
@@ -280,6 +357,2114 @@ class BugcrowdClientTest(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.client.transition_submission(submission, state)
 
+    @mock.patch.object(requests.Session, 'get')
+    def test_get_bounties_retries_server_errors(self, mocked_method):
+        """ tests that the get_bounties method retries requests that fail
+            with a server error.
+        """
+        sleeps = []
+        self.client.scheduler = RequestScheduler(sleep=sleeps.append)
+        responses = [create_mock_response(503),
+                     create_mock_response(200, {'bounties': [self._bounty]})]
+        mocked_method.side_effect = [mock.Mock(**{'result.return_value': r})
+                                     for r in responses]
+        self.assertEqual(self.client.get_bounties(), [self._bounty])
+        self.assertEqual(len(mocked_method.mock_calls), 2)
+        self.assertEqual(len(sleeps), 1)
+
+    @mock.patch.object(requests.Session, 'get')
+    def test_get_comments_for_submission_uses_cache(self, mocked_method):
+        """ tests that cached comments are revalidated with a conditional
+            request and reused when unchanged.
+        """
+        self.client.cache = ResponseCache()
+        submission = get_example_submission()
+        uri = self.client.get_api_uri_for_submission_comments(submission)
+        comments = {'notes': [{'body_markdown': 'a note'}]}
+        responses = [
+            create_mock_response(200, comments, headers={'ETag': '"v1"'}),
+            create_mock_response(304)]
+        mocked_method.side_effect = [mock.Mock(**{'result.return_value': r})
+                                     for r in responses]
+        for _ in range(2):
+            self.assertEqual(
+                self.client.get_comments_for_submission(submission),
+                comments)
+        mocked_method.assert_called_with(
+            uri, headers={'If-None-Match': '"v1"'})
+
+    @mock.patch.object(requests.Session, 'post')
+    def test_comment_on_submission_invalidates_cache(self, mocked_method):
+        """ tests that commenting on a submission removes its cached
+            responses.
+        """
+        self.client.cache = ResponseCache()
+        submission = get_example_submission()
+        other = get_example_submission()
+        for s in [submission, other]:
+            self.client.cache.set(
+                self.client.get_api_uri_for_submission_comments(s), {})
+        self.client.comment_on_submission(submission, 'a comment')
+        self.assertIsNone(self.client.cache.get(
+            self.client.get_api_uri_for_submission_comments(submission)))
+        self.assertIsNotNone(self.client.cache.get(
+            self.client.get_api_uri_for_submission_comments(other)))
+
+    @mock.patch.object(requests.Session, 'post')
+    def test_write_invalidates_cache_once_sent(self, mocked_method):
+        """ tests that a response cached while a write is in flight is
+            removed once the write has been sent.
+        """
+        self.client.cache = ResponseCache()
+        submission = get_example_submission()
+        uri = self.client.get_api_uri_for_submission_comments(submission)
+        future = futures.Future()
+        mocked_method.return_value = future
+        request = self.client.transition_submission(submission, 'triaged')
+        self.client.cache.set(uri, {})
+        future.set_result(create_mock_response(200))
+        self.assertIsNone(self.client.cache.get(uri))
+        self.assertEqual(request.result().status_code, 200)
+
+    @mock.patch.object(requests.Session, 'post')
+    @mock.patch.object(requests.Session, 'get')
+    def test_get_sent_before_write_is_not_cached(self, mocked_get,
+                                                 mocked_post):
+        """ tests that the response to a GET sent before a write is not
+            cached when it is resolved after the write.
+        """
+        self.client.cache = ResponseCache(ttl=3600)
+        submission = get_example_submission()
+        uri = self.client.get_api_uri_for_submission_comments(submission)
+        old, new = {'notes': ['old']}, {'notes': ['old', 'new']}
+        mocked_get.side_effect = [
+            mock.Mock(**{'result.return_value': create_mock_response(
+                200, comments)}) for comments in (old, new)]
+        mocked_post.return_value = mock.Mock(
+            **{'result.return_value': create_mock_response(201)})
+        fetch = self.client.fetch_json(uri)
+        self.client.comment_on_submission(submission, 'new').result()
+        self.assertEqual(fetch.result(), old)
+        self.assertIsNone(self.client.cache.get(uri))
+        self.assertEqual(
+            self.client.get_comments_for_submission(submission), new)
+        self.assertEqual(mocked_get.call_count, 2)
+
+    @mock.patch.object(requests.Session, 'get')
+    def test_enrich_submissions(self, mocked_method):
+        """ tests that the enrich_submissions method adds the comments and
+            attachments of each submission, in order, while bounding the
+            number of submissions in flight.
+        """
+        submissions = [get_example_submission() for _ in range(5)]
+
+        def get(uri, **kwargs):
+            return mock.Mock(**{'result.return_value': create_mock_response(
+                200, {'uri': uri})})
+        mocked_method.side_effect = get
+        enriched = self.client.enrich_submissions(
+            submissions, max_in_flight=2)
+        first = next(enriched)
+        self.assertEqual(len(mocked_method.mock_calls), 6)
+        enriched = [first] + list(enriched)
+        self.assertEqual(len(mocked_method.mock_calls), 10)
+        self.assertEqual([e['uuid'] for e in enriched],
+                         [s['uuid'] for s in submissions])
+        for submission, result in zip(submissions, enriched):
+            self.assertNotIn('comments', submission)
+            self.assertEqual(result['comments'], {
+                'uri': self.client.get_api_uri_for_submission_comments(
+                    submission)})
+            self.assertEqual(result['attachments'], {
+                'uri': self.client.get_api_uri_for_submission_attachments(
+                    submission)})
+
+    def test_enrich_submissions_checks_include(self):
+        """ tests that the enrich_submissions method rejects unknown
+            sub-resources.
+        """
+        with self.assertRaises(ValueError):
+            next(self.client.enrich_submissions([], include=('votes',)))
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """ Tests for ResponseCache. """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResponseCache(ttl=10, max_entries=2, clock=self.clock)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_set_and_get(self):
+        """ tests that cached responses are returned with their
+            validators.
+        """
+        self.cache.set('uri', {'a': 1}, etag='"e"', last_modified='lm')
+        entry = self.cache.get('uri')
+        self.assertEqual(entry.data, {'a': 1})
+        self.assertEqual(entry.get_conditional_headers(), {
+            'If-None-Match': '"e"', 'If-Modified-Since': 'lm'})
+        self.assertIsNone(self.cache.get('other'))
+
+    def test_ttl(self):
+        """ tests that entries are only fresh within the ttl. """
+        self.cache.set('uri', {})
+        self.assertTrue(self.cache.is_fresh(self.cache.get('uri')))
+        self.clock.sleep(11)
+        self.assertFalse(self.cache.is_fresh(self.cache.get('uri')))
+        self.cache.refresh('uri')
+        self.assertTrue(self.cache.is_fresh(self.cache.get('uri')))
+
+    def test_evicts_least_recently_used(self):
+        """ tests that the least recently used entries are evicted. """
+        for uri in ['a', 'b']:
+            self.cache.set(uri, {})
+            self.clock.sleep(1)
+        self.cache.get('a')
+        self.clock.sleep(1)
+        self.cache.set('c', {})
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+
+
+class GetAllSubmissionsTest(unittest.TestCase):
+    """ Tests for BugcrowdClient.get_all_submissions. """
+
+    def setUp(self):
+        self.client = BugcrowdClient('api-token')
+        self.bounties = [get_example_bounty() for _ in range(3)]
+        self.submissions = {
+            bounty['uuid']: [get_example_submission() for _ in range(x + 1)]
+            for x, bounty in enumerate(self.bounties)}
+        patcher = mock.patch.object(requests.Session, 'get')
+        self.mocked_method = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mocked_method.side_effect = self._get
+
+    def _get(self, uri, **kwargs):
+        if uri == self.client.get_api_uri('bounties'):
+            content = create_bounty_bounties_response(self.bounties)
+        else:
+            bounty_uuid = uri.split('/')[-2]
+            submissions = self.submissions[bounty_uuid]
+            offset = kwargs['params']['offset']
+            content = create_bounty_submissions_response(
+                submissions[offset:offset + 1], total_hits=len(submissions),
+                offset=offset)
+        return mock.Mock(**{'result.return_value': create_mock_response(
+            200, content)})
+
+    def _get_all(self, **kwargs):
+        return list(self.client.get_all_submissions(
+            params={'sort': 'newest', 'offset': 0, 'limit': 1}, **kwargs))
+
+    def test_get_all_submissions_interleaved(self):
+        """ tests that pages of every bounty are yielded in turn. """
+        expected_order = [0, 1, 2, 1, 2, 2]
+        expected = []
+        offsets = [0, 0, 0]
+        for x in expected_order:
+            bounty_uuid = self.bounties[x]['uuid']
+            expected.append(
+                (bounty_uuid, self.submissions[bounty_uuid][offsets[x]]))
+            offsets[x] += 1
+        self.assertEqual(self._get_all(), expected)
+
+    def test_get_all_submissions_per_bounty(self):
+        """ tests that every submission of a bounty is yielded before
+            those of the next bounty.
+        """
+        expected = [(bounty['uuid'], submission)
+                    for bounty in self.bounties
+                    for submission in self.submissions[bounty['uuid']]]
+        self.assertEqual(self._get_all(ordering='per_bounty'), expected)
+
+    def test_get_all_submissions_starts_bounties_concurrently(self):
+        """ tests that the first page of each active bounty is requested
+            before any submission is yielded.
+        """
+        submissions = self.client.get_all_submissions(
+            self.bounties[:2], max_active_bounties=2)
+        next(submissions)
+        uris = [args[0] for _, args, _ in self.mocked_method.mock_calls]
+        self.assertEqual(uris, [
+            self.client.get_api_uri_for_bounty_submissions(bounty)
+            for bounty in self.bounties[:2]])
+
+    def test_get_all_submissions_checks_ordering(self):
+        """ tests that unknown orderings are rejected. """
+        with self.assertRaises(ValueError):
+            self._get_all(ordering='random')
+
+
+class CancellationTest(unittest.TestCase):
+    """ Tests for cancelling and timing out paginated calls. """
+
+    def setUp(self):
+        self.client = BugcrowdClient('api-token')
+        self.bounties = [get_example_bounty() for _ in range(3)]
+        self.submissions = [get_example_submission() for _ in range(6)]
+        self.params = {'sort': 'newest', 'offset': 0, 'limit': 1}
+        self.stats = CallStats()
+        patcher = mock.patch.object(requests.Session, 'get')
+        self.mocked_get = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mocked_get.side_effect = self._get
+        self.futures = []
+
+    def _get(self, uri, **kwargs):
+        """ returns a future of a page of submissions, only finished for
+            the first request.
+        """
+        offset = kwargs['params']['offset']
+        future = futures.Future()
+        future.response = create_mock_response(
+            200, create_bounty_submissions_response(
+                self.submissions[offset:offset + 1],
+                total_hits=len(self.submissions), offset=offset))
+        if not self.futures:
+            future.set_result(future.response)
+        self.futures.append(future)
+        return future
+
+    def _get_submissions(self, **kwargs):
+        return self.client.get_submissions(
+            self.bounties[0], params=self.params, prefetch_pages=3,
+            stats=self.stats, **kwargs)
+
+    def test_close_cancels_pending_pages(self):
+        """ tests that closing get_submissions cancels the page requests
+            that have not been sent.
+        """
+        submissions = self._get_submissions()
+        self.assertEqual(next(submissions), self.submissions[0])
+        self.assertEqual(len(self.futures), 4)
+        submissions.close()
+        self.assertTrue(all(f.cancelled() for f in self.futures[1:]))
+        self.assertEqual(
+            (self.stats.requests, self.stats.cancelled, self.stats.pages),
+            (1, 3, 1))
+        self.assertIsNotNone(self.stats.ended_at)
+        self.assertGreater(self.stats.seconds, 0)
+
+    def test_close_closes_sent_pages(self):
+        """ tests that the responses of page requests already sent when
+            get_submissions is closed are closed once they arrive.
+        """
+        submissions = self._get_submissions()
+        next(submissions)
+        self.futures[1].set_running_or_notify_cancel()
+        submissions.close()
+        self.futures[1].set_result(self.futures[1].response)
+        self.futures[1].response.close.assert_called_once_with()
+        self.assertEqual((self.stats.requests, self.stats.cancelled),
+                         (2, 2))
+
+    def test_timeout(self):
+        """ tests that get_submissions raises a TimeoutError and cancels
+            its pending pages once its timeout passes.
+        """
+        submissions = self._get_submissions(timeout=0.05)
+        next(submissions)
+        with self.assertRaises(futures.TimeoutError):
+            next(submissions)
+        self.assertGreaterEqual(self.stats.seconds, 0.05)
+        self.assertTrue(all(f.cancelled() for f in self.futures[1:]))
+
+    def test_timeout_covers_rate_limit(self):
+        """ tests that get_submissions does not wait for the rate limit
+            past its timeout.
+        """
+        self.client.scheduler = RequestScheduler(rate=1)
+        started_at = time.monotonic()
+        with self.assertRaises(futures.TimeoutError):
+            list(self._get_submissions(timeout=0.3))
+        self.assertLess(time.monotonic() - started_at, 0.3)
+        self.assertEqual(self.mocked_get.call_count, 1)
+
+    def test_close_get_all_submissions(self):
+        """ tests that closing get_all_submissions cancels the pending pages
+            of every active bounty, including bounties not yet started.
+        """
+        submissions = self.client.get_all_submissions(
+            self.bounties, params=self.params, prefetch_pages=2,
+            stats=self.stats)
+        next(submissions)
+        self.assertEqual(len(self.futures), 5)
+        submissions.close()
+        self.assertTrue(all(f.cancelled() for f in self.futures[1:]))
+        self.assertEqual((self.stats.requests, self.stats.cancelled),
+                         (1, 4))
+
+    def test_close_export_shard(self):
+        """ tests that closing an export shard's submissions cancels its
+            pending pages.
+        """
+        settings = {
+            'submissions_uri': self.client.get_api_uri_for_bounty_submissions(
+                self.bounties[0]),
+            'params': self.params,
+            'prefetch_pages': 3,
+            'transform': None,
+        }
+        submissions = _iter_shard_submissions(
+            self.client, settings, [1, 2, 3, 4])
+        self.assertEqual(next(submissions), self.submissions[1])
+        self.assertEqual(len(self.futures), 4)
+        submissions.close()
+        self.assertTrue(all(f.cancelled() for f in self.futures[1:]))
+
+
+class SingleFlightTest(unittest.TestCase):
+    """ Tests for coalescing identical GETs. """
+
+    def setUp(self):
+        self.collector = MetricsCollector()
+        self.uri = BugcrowdClient('api-token').get_api_uri('bounties')
+        patcher = mock.patch.object(requests.Session, 'get')
+        self.mocked_get = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.futures = []
+
+        def get(*args, **kwargs):
+            future = futures.Future()
+            self.futures.append(future)
+            return future
+        self.mocked_get.side_effect = get
+
+    def _finish(self, future, content):
+        resp = create_mock_response(200, content)
+        resp.elapsed = datetime.timedelta(0)
+        resp.content = b''
+        resp.request = None
+        future.set_result(resp)
+
+    def test_identical_gets_share_a_request(self):
+        """ tests that GETs made while an identical one is in flight share
+            its request and decoded result.
+        """
+        client = BugcrowdClient('api-token', instrumentation=self.collector)
+        first = client.fetch_json(self.uri)
+        second = client.fetch_json(self.uri)
+        other = client.fetch_json(self.uri, params={'offset': 1})
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        self.assertEqual(self.mocked_get.call_count, 2)
+        self._finish(self.futures[0], {'bounties': []})
+        self.assertIs(first.result(), second.result())
+        summary = self.collector.summary()['endpoints']['GET /bounties']
+        self.assertEqual(summary['coalesced'], 1)
+
+        third = client.fetch_json(self.uri)
+        self.assertIsNot(third, first)
+        self.assertEqual(self.mocked_get.call_count, 3)
+
+    def test_errors_are_shared(self):
+        """ tests that every caller sees the error of a shared request. """
+        client = BugcrowdClient('api-token')
+        first = client.fetch_json(self.uri)
+        second = client.fetch_json(self.uri)
+        self.futures[0].set_exception(ValueError('failed'))
+        for fetch in [first, second]:
+            with self.assertRaises(ValueError):
+                fetch.result()
+        self.assertEqual(self.mocked_get.call_count, 1)
+
+    @mock.patch.object(requests.Session, 'post')
+    def test_write_stops_sharing_earlier_gets(self, mocked_post):
+        """ tests that a fetch made after a write does not share a GET of
+            the submission sent before it.
+        """
+        client = BugcrowdClient('api-token')
+        submission = get_example_submission()
+        uri = client.get_api_uri_for_submission_comments(submission)
+        mocked_post.return_value = mock.Mock(
+            **{'result.return_value': create_mock_response(201)})
+        first = client.fetch_json(uri)
+        client.comment_on_submission(submission, 'new').result()
+        second = client.fetch_json(uri)
+        self.assertIsNot(first, second)
+        self.assertEqual(self.mocked_get.call_count, 2)
+
+    def test_single_flight_can_be_disabled(self):
+        """ tests that identical GETs are all sent when single_flight is
+            unset.
+        """
+        client = BugcrowdClient('api-token', single_flight=False)
+        client.fetch_json(self.uri)
+        client.fetch_json(self.uri)
+        self.assertEqual(self.mocked_get.call_count, 2)
+
+
+class InstrumentationTest(unittest.TestCase):
+    """ Tests for the instrumentation module. """
+
+    def test_get_endpoint(self):
+        """ tests that uuids are removed from endpoint names. """
+        self.assertEqual(
+            get_endpoint('get', '/bounties/abc/submissions'),
+            'GET /bounties/{uuid}/submissions')
+        self.assertEqual(
+            get_endpoint('POST', '/submissions/abc/transition'),
+            'POST /submissions/{uuid}/transition')
+
+    def test_histogram(self):
+        """ tests that the histogram summarises the values added. """
+        histogram = Histogram(bounds=[1, 2, 4, 8])
+        for value in [0.5, 1.5, 3, 3, 7]:
+            histogram.add(value)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 5)
+        self.assertEqual(summary['p50'], 4)
+        self.assertEqual(summary['p99'], 7)
+        self.assertAlmostEqual(summary['mean'], 3.0)
+        self.assertEqual(Histogram().summary(), {'count': 0})
+
+    def test_span_leaves_streamed_body_unread(self):
+        """ tests that a streamed response's body is sized without being
+            read.
+        """
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.headers['Content-Length'] = '5'
+        resp.raw = io.BytesIO(b'12345')
+        span = RequestSpan('GET', '/bounties', 'GET /bounties')
+        span.finish(resp)
+        self.assertEqual(span.bytes_received, 5)
+        self.assertEqual(resp.raw.tell(), 0)
+        self.assertEqual(b''.join(resp.iter_content(2)), b'12345')
+
+    @mock.patch.object(requests.Session, 'get')
+    def test_metrics_collector(self, mocked_method):
+        """ tests that the metrics collector records client requests. """
+        collector = MetricsCollector()
+        client = BugcrowdClient('api-token', instrumentation=collector)
+        bounty = get_example_bounty()
+        submissions = [get_example_submission() for _ in range(3)]
+
+        def get(uri, **kwargs):
+            self.assertIn('response', kwargs['hooks'])
+            offset = kwargs['params']['offset']
+            resp = create_mock_response(
+                200, create_bounty_submissions_response(
+                    submissions[offset:offset + 1], total_hits=3))
+            resp.content = b'12345'
+            resp.elapsed = datetime.timedelta(0)
+            resp.request.body = None
+            kwargs['hooks']['response'](resp)
+            return mock.Mock(**{'result.return_value': resp})
+        mocked_method.side_effect = get
+        params = {'sort': 'newest', 'offset': 0, 'limit': 1}
+        self.assertEqual(
+            list(client.get_submissions(bounty, params=params)), submissions)
+        summary = collector.summary()
+        endpoint = summary['endpoints']['GET /bounties/{uuid}/submissions']
+        self.assertEqual(endpoint['latency']['count'], 3)
+        self.assertEqual(endpoint['decode_time']['count'], 3)
+        self.assertEqual(endpoint['bytes_received'], 15)
+        self.assertEqual(endpoint['errors'], 0)
+        self.assertEqual(summary['pages_per_get_submissions']['max'], 3)
+        self.assertEqual(summary['queue_depth']['count'], 3)
+        output = io.StringIO()
+        collector.dump(output)
+        self.assertEqual(json.loads(output.getvalue()), summary)
+
+
+class OutboundQueueTest(unittest.TestCase):
+    """ Tests for OutboundQueue. """
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'outbox.db')
+        self.server = FakeBugcrowdServer(submissions_per_bounty=2).start()
+        self.addCleanup(self.server.stop)
+        self.client = BugcrowdClient('api-token')
+        self.client.base_uri = self.server.base_uri
+        self.bounty = self.server.bounties[0]
+        self.submissions = self.server.submissions[self.bounty['uuid']]
+
+    def _get_writes(self):
+        return [request for request in self.server.requests
+                if request[0] != 'GET']
+
+    def test_operations_survive_restarts(self):
+        """ tests that queued operations are stored and sent with their
+            idempotency keys once drained.
+        """
+        queue = OutboundQueue(self.path)
+        keys = [
+            queue.enqueue('transition_submission', self.submissions[0],
+                          'triaged'),
+            queue.enqueue('comment_on_submission', self.submissions[1],
+                          'a comment', idempotency_key='comment-1'),
+            queue.enqueue('create_submission', self.bounty, {
+                'title': 'new', 'submitted_at': datetime.datetime(2020, 1, 1),
+            }),
+        ]
+        queue.enqueue('comment_on_submission', self.submissions[1],
+                      'a comment', idempotency_key='comment-1')
+        self.assertEqual(keys[1], 'comment-1')
+        with self.assertRaises(ValueError):
+            queue.enqueue('get_bounties')
+        queue.close()
+        self.assertEqual(self._get_writes(), [])
+
+        queue = OutboundQueue(self.path)
+        self.addCleanup(queue.close)
+        self.assertEqual(queue.count(), 3)
+        report = queue.drain(self.client, batch_size=2)
+        self.assertEqual(len(report.succeeded), 3)
+        self.assertEqual(queue.count(), 0)
+        self.assertEqual(queue.count('sent'), 3)
+        self.assertEqual(queue.get_status(keys[0])['status_code'], 200)
+        self.assertEqual(sorted(self.server.idempotent_responses),
+                         sorted(keys))
+        self.assertEqual(len(self._get_writes()), 3)
+        queue.purge()
+        self.assertEqual(queue.count('sent'), 0)
+
+    def test_iter_drain(self):
+        """ tests that iter_drain sends a batch only once the results of
+            the one before are taken, and that drain keeps no responses.
+        """
+        queue = OutboundQueue(self.path)
+        self.addCleanup(queue.close)
+        for submission in self.submissions:
+            queue.enqueue('transition_submission', submission, 'triaged')
+        results = queue.iter_drain(self.client, batch_size=1)
+        self.assertEqual(next(results).response.status_code, 200)
+        self.assertEqual(queue.count('sent'), 1)
+        self.assertEqual(len(self._get_writes()), 1)
+        self.assertEqual(len(list(results)), 1)
+        self.assertEqual(queue.count('sent'), 2)
+        queue.enqueue('transition_submission', self.submissions[0], 'new')
+        result, = queue.drain(self.client)
+        self.assertTrue(result.ok)
+        self.assertIsNone(result.response)
+
+    def test_interrupted_operations_are_resent(self):
+        """ tests that operations being sent when the process stopped are
+            sent again with the same key.
+        """
+        queue = OutboundQueue(self.path)
+        key = queue.enqueue('transition_submission', self.submissions[0],
+                            'triaged')
+        with mock.patch.object(OutboundQueue, '_record',
+                               side_effect=RuntimeError('crashed')):
+            with self.assertRaises(RuntimeError):
+                queue.drain(self.client)
+        queue.close()
+        queue = OutboundQueue(self.path)
+        self.addCleanup(queue.close)
+        self.assertEqual(queue.get_status(key)['status'], 'pending')
+        self.assertEqual(len(queue.drain(self.client).succeeded), 1)
+        self.assertEqual(len(self._get_writes()), 2)
+        self.assertEqual(list(self.server.idempotent_responses), [key])
+
+    @mock.patch.object(requests.Session, 'post')
+    def test_failures_are_retried_with_backoff(self, mocked_method):
+        """ tests that retryable failures are sent again after a delay
+            and others are marked failed.
+        """
+        clock = FakeClock()
+        statuses = {'a': [503, 200], 'b': [404]}
+
+        def post(uri, **kwargs):
+            resp = create_mock_response(statuses[uri.split('/')[-2]].pop(0))
+            if resp.status_code >= 400:
+                resp.raise_for_status.side_effect = requests.HTTPError()
+            return mock.Mock(**{'result.return_value': resp})
+        mocked_method.side_effect = post
+        queue = OutboundQueue(retry_delay=10, clock=clock)
+        self.addCleanup(queue.close)
+        retried = queue.enqueue('transition_submission', 'a', 'triaged')
+        failed = queue.enqueue('transition_submission', 'b', 'triaged')
+        report = queue.drain(self.client)
+        self.assertEqual(len(report.failed), 2)
+        self.assertEqual(queue.get_status(retried)['status'], 'pending')
+        self.assertEqual(queue.get_status(failed)['status'], 'failed')
+        self.assertEqual(len(queue.drain(self.client)), 0)
+        clock.sleep(10)
+        self.assertEqual(len(queue.drain(self.client).succeeded), 1)
+        self.assertEqual(queue.get_status(retried), {
+            'status': 'sent', 'attempts': 2, 'status_code': 200,
+            'error': None})
+        operation, = queue.get_failed()
+        self.assertEqual(operation.args, ('b', 'triaged'))
+        self.assertEqual(operation.kwargs, {'idempotency_key': failed})
+        mocked_method.assert_called_with(
+            mock.ANY, json={'substate': 'triaged'}, data=None,
+            headers={'Idempotency-Key': retried})
+        queue.retry_failed()
+        self.assertEqual(queue.count(), 1)
+
+    def test_background_drainer(self):
+        """ tests that a started queue sends operations as they are
+            queued.
+        """
+        queue = OutboundQueue(self.path)
+        self.addCleanup(queue.close)
+        queue.start(self.client, interval=0.01)
+        with self.assertRaises(RuntimeError):
+            queue.start(self.client)
+        queue.enqueue('transition_submission', self.submissions[0],
+                      'triaged')
+        for _ in range(500):
+            if queue.count('sent') == 1:
+                break
+            time.sleep(0.01)
+        queue.stop()
+        self.assertEqual(queue.count('sent'), 1)
+
+    def test_stop_leaves_the_backlog(self):
+        """ tests that stopping the drainer waits for the current batch
+            only.
+        """
+        queue = OutboundQueue(self.path)
+        self.addCleanup(queue.close)
+        for submission in self.submissions:
+            queue.enqueue('transition_submission', submission, 'triaged')
+        batches = []
+
+        def send_batch(*args, **kwargs):
+            batches.append(args[1])
+            if len(batches) == 1:
+                threading.Thread(target=queue.stop).start()
+                self.assertTrue(queue._stopped.wait(5))
+            return run_batch(*args, **kwargs)
+
+        with mock.patch('bug_crowd.outbox.run_batch', send_batch):
+            queue.start(self.client, interval=0.01, batch_size=1)
+            for _ in range(500):
+                if queue._thread is None:
+                    break
+                time.sleep(0.01)
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(queue.count('sent'), 1)
+        self.assertEqual(queue.count(), 1)
+
+    def test_background_drainer_keeps_errors(self):
+        """ tests that an error while draining is kept and draining
+            continues.
+        """
+        queue = OutboundQueue(self.path)
+        self.addCleanup(queue.close)
+        queue.enqueue('transition_submission', self.submissions[0],
+                      'triaged')
+        error = sqlite3.OperationalError('database is locked')
+        errors = [error]
+        claim = queue._claim
+
+        def fail_once(batch_size):
+            if errors:
+                raise errors.pop()
+            return claim(batch_size)
+
+        with mock.patch.object(queue, '_claim', side_effect=fail_once):
+            queue.start(self.client, interval=0.01)
+            for _ in range(500):
+                if queue.count('sent') == 1:
+                    break
+                time.sleep(0.01)
+            queue.stop()
+        self.assertIs(queue.last_error, error)
+        self.assertEqual(queue.count('sent'), 1)
+
+
+class RunBatchTest(unittest.TestCase):
+    """ Tests for run_batch. """
+
+    def setUp(self):
+        self.client = BugcrowdClient('api-token')
+
+    @mock.patch.object(requests.Session, 'post')
+    def test_run_batch(self, mocked_method):
+        """ tests that the run_batch method reports the outcome of every
+            operation without stopping on failures.
+        """
+        ok = create_mock_response(200)
+        error = create_mock_response(404)
+        error.raise_for_status.side_effect = requests.HTTPError()
+        responses = {'a': ok, 'b': error}
+
+        def post(uri, **kwargs):
+            submission_uuid = uri.split('/')[-2]
+            return mock.Mock(**{'result.return_value': responses[
+                submission_uuid]})
+        mocked_method.side_effect = post
+        operations = [
+            BatchOperation('transition_submission', 'a', 'resolved'),
+            BatchOperation('transition_submission', 'b', 'resolved'),
+            BatchOperation('transition_submission', 'a', 'duplicate'),
+            BatchOperation('comment_on_submission', 'a', 'a comment'),
+        ]
+        report = run_batch(self.client, operations, max_in_flight=2)
+        self.assertEqual([r.operation for r in report], operations)
+        self.assertEqual([r.ok for r in report], [True, False, False, True])
+        self.assertIs(report.results[0].response, ok)
+        self.assertIs(report.results[1].response, error)
+        self.assertIsInstance(report.results[1].error, requests.HTTPError)
+        self.assertIsInstance(report.results[2].error, ValueError)
+        self.assertEqual(len(report.succeeded), 2)
+        self.assertEqual(len(report.failed), 2)
+        self.assertTrue(all(r.latency >= 0 for r in report))
+
+    def test_batch_operation_checks_method(self):
+        """ tests that only write methods can be used in a batch. """
+        with self.assertRaises(ValueError):
+            BatchOperation('get_bounties')
+
+
+class ExportSubmissionsTest(unittest.TestCase):
+    """ Tests for export_submissions. """
+
+    def setUp(self):
+        self.submissions = [get_example_submission() for _ in range(3)]
+        self.submissions[0]['custom_fields'] = {'a': 1}
+
+    def test_export_ndjson(self):
+        """ tests that submissions are exported as ndjson. """
+        output = io.BytesIO()
+        count = export_submissions(iter(self.submissions), output)
+        self.assertEqual(count, 3)
+        lines = output.getvalue().decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         self.submissions)
+
+    def test_export_ndjson_fields(self):
+        """ tests that only the selected fields are exported. """
+        output = io.StringIO()
+        export_submissions(self.submissions, output, fields=['uuid'])
+        lines = output.getvalue().splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'uuid': s['uuid']} for s in self.submissions])
+
+    def test_export_csv(self):
+        """ tests that submissions are exported as csv. """
+        output = io.StringIO()
+        fields = ['uuid', 'custom_fields']
+        export_submissions(self.submissions, output, format='csv',
+                           fields=fields)
+        rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+        self.assertEqual([row['uuid'] for row in rows],
+                         [s['uuid'] for s in self.submissions])
+        self.assertEqual(json.loads(rows[0]['custom_fields']), {'a': 1})
+        self.assertEqual(rows[1]['custom_fields'], '')
+
+    def test_export_gzip_path(self):
+        """ tests that exports to a .gz path are compressed. """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'submissions.ndjson.gz')
+            export_submissions(self.submissions, path)
+            with gzip.open(path, 'rt') as f:
+                self.assertEqual([json.loads(line) for line in f],
+                                 self.submissions)
+
+    def test_export_checks_format(self):
+        """ tests that unknown formats are rejected. """
+        with self.assertRaises(ValueError):
+            export_submissions(self.submissions, io.BytesIO(), format='xml')
+
+    def test_export_bounty_submissions(self):
+        """ tests that a sharded export writes every submission in order. """
+        with FakeBugcrowdServer(submissions_per_bounty=45,
+                                description_size=10) as server:
+            client = BugcrowdClient('api-token')
+            client.base_uri = server.base_uri
+            bounty = server.bounties[0]
+            expected = server.submissions[bounty['uuid']]
+            params = {'sort': 'newest', 'offset': 0, 'limit': 7}
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'submissions.ndjson.gz')
+                count = export_bounty_submissions(
+                    client, bounty, path, processes=3, params=params)
+                self.assertEqual(count, 45)
+                with gzip.open(path, 'rt') as f:
+                    self.assertEqual([json.loads(line) for line in f],
+                                     expected)
+            output = io.StringIO()
+            export_bounty_submissions(
+                client, bounty, output, processes=2, params=params,
+                format='csv', transform=_get_export_row)
+            rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+            self.assertEqual(rows, [_get_export_row(submission)
+                                    for submission in expected])
+
+    @mock.patch.object(BugcrowdClient, 'get_submissions')
+    def test_main(self, mocked_method):
+        """ tests that the export console entry point works as expected. """
+        mocked_method.return_value = iter(self.submissions)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'submissions.csv')
+            with mock.patch('sys.stderr', new=io.StringIO()):
+                export_main(['bounty-uuid', '--token', 'api-token',
+                             '--format', 'csv', '--fields', 'uuid,title',
+                             '-o', path])
+            with open(path) as f:
+                rows = list(csv.DictReader(f))
+        mocked_method.assert_called_once_with('bounty-uuid')
+        self.assertEqual(rows, [{'uuid': s['uuid'], 'title': s['title']}
+                                for s in self.submissions])
+
+
+class FakeBugcrowdServerTest(unittest.TestCase):
+    """ Tests for FakeBugcrowdServer and the benchmarks. """
+
+    def test_client_against_fake_server(self):
+        """ tests that the client can read from and write to the fake
+            server, retrying rate limited requests.
+        """
+        with FakeBugcrowdServer(submissions_per_bounty=30,
+                                rate_limit_ratio=0.3) as server:
+            client = BugcrowdClient(
+                'api-token', scheduler=RequestScheduler(fallback_rate=1000))
+            client.base_uri = server.base_uri
+            bounties = client.get_bounties()
+            self.assertEqual(bounties, server.bounties)
+            params = {'sort': 'newest', 'offset': 0, 'limit': 7}
+            submissions = list(client.get_submissions(
+                bounties[0], params=params))
+            self.assertEqual(submissions,
+                             server.submissions[bounties[0]['uuid']])
+            comments = client.get_comments_for_submission(submissions[0])
+            self.assertEqual(len(comments['notes']), 1)
+            resp = client.transition_submission(
+                submissions[0], 'triaged').result()
+            resp.raise_for_status()
+            self.assertEqual(resp.json(), {'substate': 'triaged'})
+            self.assertGreater(server.request_count, 8)
+
+    def test_run_benchmarks(self):
+        """ tests that every benchmark scenario reports its results. """
+        results = run_benchmarks(
+            submissions=20, write_count=5, page_sizes=[10],
+            worker_counts=[2], latency=0)
+        self.assertEqual([r['scenario'] for r in results],
+                         ['get_submissions', 'bulk_writes', 'enrichment'])
+        self.assertEqual([r['items'] for r in results], [20, 5, 5])
+        self.assertEqual([r['requests'] for r in results], [2, 5, 10])
+        for result in results:
+            self.assertGreater(result['requests_per_second'], 0)
+            self.assertLessEqual(result['p50_latency'],
+                                 result['p99_latency'])
+
+    def test_benchmark_cold_start(self):
+        """ tests that importing the client and creating one does not import
+            requests, and that the cold start benchmark reports its times.
+        """
+        with FakeBugcrowdServer(submissions_per_bounty=0) as server:
+            result = benchmark_cold_start(server, runs=1)
+        self.assertFalse(result['requests_imported'])
+        for name in ('import_seconds', 'client_seconds',
+                     'first_request_seconds'):
+            self.assertGreater(result[name], 0)
+
+
+class DownloadAttachmentsTest(unittest.TestCase):
+    """ Tests for download_attachments. """
+
+    def setUp(self):
+        self.server = FakeBugcrowdServer(
+            submissions_per_bounty=3, attachment_size=5000).start()
+        self.addCleanup(self.server.stop)
+        self.client = BugcrowdClient('api-token')
+        self.client.base_uri = self.server.base_uri
+        self.submissions = self.server.submissions[
+            self.server.bounties[0]['uuid']]
+        self.directory = tempfile.mkdtemp()
+
+    def _download(self, **kwargs):
+        return download_attachments(self.client, self.submissions,
+                                    self.directory, chunk_size=1000,
+                                    **kwargs)
+
+    def _get_file_requests(self):
+        return [path for _, path in self.server.requests
+                if path.startswith('/files/')]
+
+    def test_downloads_and_deduplicates(self):
+        """ tests that attachments are saved per submission, their content
+            stored once and that they are skipped once downloaded.
+        """
+        report = self._download()
+        self.assertEqual(len(report.succeeded), 3)
+        self.assertEqual(sorted(r.status for r in report),
+                         ['downloaded', 'duplicate', 'duplicate'])
+        for result, submission in zip(report, self.submissions):
+            self.assertEqual(result.path, os.path.join(
+                self.directory, submission['uuid'], 'evidence.png'))
+            with open(result.path, 'rb') as f:
+                self.assertEqual(f.read(), self.server.attachment_content)
+        self.assertEqual(
+            len(os.listdir(os.path.join(self.directory, '.objects'))), 1)
+        report = self._download()
+        self.assertEqual([r.status for r in report], ['skipped'] * 3)
+        self.assertEqual(len(self._get_file_requests()), 3)
+
+    def test_leaves_the_transport_open(self):
+        """ tests that the client's connection pool is still open after
+            downloading.
+        """
+        adapter = self.client.transport.adapter
+        with mock.patch.object(adapter, 'close') as close:
+            self._download()
+        close.assert_not_called()
+        self.assertEqual(len(list(self.client.get_submissions(
+            self.server.bounties[0]))), 3)
+
+    def test_resumes_partial_downloads(self):
+        """ tests that a partial download is continued with a range
+            request.
+        """
+        content = self.server.attachment_content
+        self.submissions = self.submissions[:1]
+        partial_path = os.path.join(
+            self.directory, '.partial',
+            '%s-evidence.png.part' % self.submissions[0]['uuid'])
+        os.makedirs(os.path.dirname(partial_path))
+        with open(partial_path, 'wb') as f:
+            f.write(content[:1234])
+        report = self._download()
+        self.assertEqual(report.results[0].status, 'resumed')
+        self.assertEqual(len(self._get_file_requests()), 1)
+        with open(report.results[0].path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertFalse(os.path.exists(partial_path))
+
+        with open(partial_path, 'wb') as f:
+            f.write(content + b'extra')
+        report = self._download(verify=False)
+        self.assertEqual(report.results[0].status, 'skipped')
+        os.unlink(report.results[0].path)
+        report = self._download()
+        self.assertEqual(report.results[0].status, 'duplicate')
+        self.assertEqual(len(self._get_file_requests()), 3)
+
+    def test_retries_cut_off_downloads(self):
+        """ tests that a download cut off part way is resumed with a range
+            request, up to max_attempts times.
+        """
+        self.submissions = self.submissions[:1]
+        self.server.truncated_downloads = 2
+        report = self._download(max_attempts=3)
+        self.assertEqual(report.results[0].status, 'resumed')
+        self.assertEqual(len(self._get_file_requests()), 3)
+        with open(report.results[0].path, 'rb') as f:
+            self.assertEqual(f.read(), self.server.attachment_content)
+
+        shutil.rmtree(self.directory)
+        self.server.truncated_downloads = 2
+        report = self._download(max_attempts=2)
+        self.assertIsInstance(report.results[0].error,
+                              requests.exceptions.ChunkedEncodingError)
+        self.assertEqual(len(self._get_file_requests()), 5)
+
+    def test_checks_size(self):
+        """ tests that a download of the wrong size fails. """
+        enrich_submissions = self.client.enrich_submissions
+
+        def enrich_with_wrong_sizes(*args, **kwargs):
+            for submission in enrich_submissions(*args, **kwargs):
+                for attachment in submission['attachments'][
+                        'file_attachments']:
+                    attachment['file_size'] += 1
+                yield submission
+        with mock.patch.object(self.client, 'enrich_submissions',
+                               enrich_with_wrong_sizes):
+            report = self._download()
+        self.assertEqual(len(report.failed), 3)
+        self.assertIsInstance(report.failed[0].error, ValueError)
+        self.assertEqual(
+            os.listdir(os.path.join(self.directory, '.partial')), [])
+
+    def test_clashing_file_names(self):
+        """ tests that attachments of a submission whose names are, or are
+            made, the same are saved to paths of their own.
+        """
+        enrich_submissions = self.client.enrich_submissions
+        names = ['evidence.png', 'Evidence.png', 'a?b.png', 'a_b.png']
+
+        def enrich_with_clashing_names(*args, **kwargs):
+            for submission in enrich_submissions(*args, **kwargs):
+                attachment = submission['attachments']['file_attachments'][0]
+                submission['attachments']['file_attachments'] = [
+                    dict(attachment, file_name=name) for name in names]
+                yield submission
+        self.submissions = self.submissions[:1]
+        with mock.patch.object(self.client, 'enrich_submissions',
+                               enrich_with_clashing_names):
+            report = self._download()
+            self.assertEqual(len(report.succeeded), 4)
+            self.assertEqual(
+                [os.path.basename(r.path) for r in report],
+                ['evidence.png', 'Evidence-2.png', 'a_b.png', 'a_b-2.png'])
+            for result in report:
+                with open(result.path, 'rb') as f:
+                    self.assertEqual(f.read(),
+                                     self.server.attachment_content)
+            report = self._download()
+        self.assertEqual([r.status for r in report], ['skipped'] * 4)
+
+    def test_get_safe_file_name(self):
+        """ tests that file names can not escape the directory. """
+        self.assertEqual(_get_safe_file_name('../../etc/passwd'), 'passwd')
+        self.assertEqual(_get_safe_file_name('..'), 'attachment')
+        self.assertEqual(_get_safe_file_name('a b?.png'), 'a b_.png')
+
+
+class TransportTest(unittest.TestCase):
+    """ Tests for Transport. """
+
+    def test_clients_share_transport(self):
+        """ tests that clients sharing a transport share its executor and
+            connection pool but not their credentials.
+        """
+        transport = Transport(max_workers=10)
+        clients = [BugcrowdClient('token-%d' % x, transport=transport)
+                   for x in range(2)]
+        sessions = [client.session for client in clients]
+        self.assertIs(sessions[0].executor, sessions[1].executor)
+        self.assertIs(sessions[0].get_adapter('https://api.bugcrowd.com/'),
+                      sessions[1].get_adapter('https://api.bugcrowd.com/'))
+        self.assertEqual(
+            [session.headers['Authorization'] for session in sessions],
+            ['Token token-0', 'Token token-1'])
+        self.assertEqual(transport.adapter._pool_maxsize, 10)
+        transport.close()
+
+    def test_transport_headers(self):
+        """ tests that keep-alive and compression can be disabled. """
+        session = Transport(keep_alive=False,
+                            compression=False).create_session()
+        self.assertEqual(session.headers['Connection'], 'close')
+        self.assertEqual(session.headers['Accept-Encoding'], 'identity')
+
+    @mock.patch.object(requests.adapters.HTTPAdapter, 'send')
+    def test_transport_timeouts(self, mocked_method):
+        """ tests that the transport's timeouts are used by default. """
+        transport = Transport(connect_timeout=3, read_timeout=30)
+        transport.adapter.send(mock.Mock(), timeout=None)
+        mocked_method.assert_called_once_with(mock.ANY, timeout=(3, 30))
+        transport.adapter.send(mock.Mock(), timeout=1)
+        mocked_method.assert_called_with(mock.ANY, timeout=1)
+
+    def test_close_keeps_given_executor(self):
+        """ tests that closing a transport leaves an executor given to it
+            running.
+        """
+        executor = futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        transport = Transport(executor=executor)
+        self.assertIs(transport.executor, executor)
+        transport.close()
+        self.assertEqual(executor.submit(lambda: 1).result(), 1)
+
+    def test_transport_is_created_lazily(self):
+        """ tests that a client's session, executor and connection pool are
+            only created once a request is sent.
+        """
+        transport = Transport()
+        client = BugcrowdClient('api-token', transport=transport)
+        client.get_api_uri_for_submission(get_example_submission())
+        self.assertIsNone(client._session)
+        self.assertIsNone(transport._executor)
+        self.assertIsNone(transport._adapter)
+        self.assertIs(client.session, client.session)
+        self.assertIsNotNone(transport._executor)
+        self.assertIsNotNone(transport._adapter)
+        transport.close()
+
+
+class ModelsTest(unittest.TestCase):
+    """ Tests for the models module. """
+
+    def setUp(self):
+        self.submission = get_example_submission()
+        self.submission.update({
+            'description_markdown': 'a "long" description\n',
+            'custom_fields': {'a': [1, {'b': '}]'}]},
+            'vrt_id': None,
+        })
+
+    def test_scan_object(self):
+        """ tests that scan_object finds the undecoded members of an
+            object.
+        """
+        text = json.dumps(self.submission, indent=1)
+        members = {key: json.loads(text[start:end])
+                   for key, start, end in scan_object(text)}
+        self.assertEqual(members, self.submission)
+        self.assertEqual(list(scan_object(' {} ')), [])
+        with self.assertRaises(ValueError):
+            list(scan_object('{"a": [1, 2}'))
+
+    def test_from_json_decodes_lazily(self):
+        """ tests that only eager fields are decoded when a model is built
+            from json.
+        """
+        model = Submission.from_json(json.dumps(self.submission))
+        self.assertEqual(model.title, self.submission['title'])
+        self.assertEqual(set(model._raw),
+                         {'description_markdown', 'custom_fields'})
+        self.assertEqual(model['custom_fields'],
+                         self.submission['custom_fields'])
+        self.assertEqual(set(model._raw), {'description_markdown'})
+        self.assertEqual(model.description_markdown,
+                         self.submission['description_markdown'])
+        self.assertEqual(model, self.submission)
+        self.assertEqual(model.to_dict(), self.submission)
+        self.assertFalse(hasattr(model, '__dict__'))
+
+    def test_projection(self):
+        """ tests that only projected fields, and the uuid, are kept. """
+        for build in [Submission.from_dict, Submission.from_json]:
+            data = self.submission
+            if build == Submission.from_json:
+                data = json.dumps(data)
+            model = build(data, fields=['title', 'custom_fields'])
+            self.assertEqual(set(model),
+                             {'uuid', 'title', 'custom_fields'})
+            self.assertNotIn('substate', model)
+            with self.assertRaises(AttributeError):
+                model.bounty_code
+            with self.assertRaises(KeyError):
+                model['description_markdown']
+
+    def test_helpers_accept_models(self):
+        """ tests that the client helpers accept models. """
+        client = BugcrowdClient('api-token')
+        model = Submission.from_dict(self.submission)
+        self.assertEqual(get_uri_for_bounty_submission(model),
+                         get_uri_for_bounty_submission(self.submission))
+        self.assertEqual(client.get_api_uri_for_submission(model),
+                         client.get_api_uri_for_submission(self.submission))
+        bounty = Bounty.from_dict(get_example_bounty())
+        self.assertIn(bounty.uuid,
+                      client.get_api_uri_for_bounty_submissions(bounty))
+
+    def test_iter_array_items(self):
+        """ tests that array items and meta data are read from any
+            chunking of a body.
+        """
+        content = create_bounty_submissions_response(
+            [self.submission, get_example_submission()])
+        content['title'] = 'caf\u00e9 [{"'
+        body = json.dumps(content, indent=1).encode('utf-8')
+        for size in [1, 2, 7, len(body)]:
+            chunks = [body[x:x + size] for x in range(0, len(body), size)]
+            events = list(iter_array_items(chunks, 'submissions'))
+            self.assertEqual([key for key, _ in events],
+                             ['item', 'item', 'meta'])
+            self.assertEqual(json.loads(events[0][1]), self.submission)
+            self.assertEqual(events[2][1], content['meta'])
+        with self.assertRaises(ValueError):
+            list(iter_array_items([b'{"submissions": [{"a": 1}'],
+                                  'submissions'))
+
+    def test_iter_array_items_scans_once(self):
+        """ tests that a large item read in small chunks is scanned once. """
+        item = {'text': 'a \\"}] b' * 20000, 'list': [1, True, None]}
+        body = json.dumps({'submissions': [item, 'x\\', 2]}).encode('utf-8')
+        chunks = [body[x:x + 64] for x in range(0, len(body), 64)]
+        scan = _ValueScanner.scan
+        scanned = []
+
+        def count_scan(scanner, text, idx):
+            scanned.append(len(text) - idx)
+            return scan(scanner, text, idx)
+
+        with mock.patch.object(_ValueScanner, 'scan', count_scan):
+            events = list(iter_array_items(chunks, 'submissions'))
+        self.assertEqual([json.loads(text) for _, text in events],
+                         [item, 'x\\', 2])
+        self.assertLess(sum(scanned), len(body) * 2)
+
+    @mock.patch.object(requests.Session, 'get')
+    def test_stream_yields_before_meta(self, mocked_method):
+        """ tests that a streamed first page yields its submissions before
+            the meta data following them has been read.
+        """
+        submissions = [get_example_submission() for _ in range(5)]
+        body = json.dumps(create_bounty_submissions_response(
+            submissions)).encode('utf-8')
+        self.assertLess(body.index(b'"submissions"'), body.index(b'"meta"'))
+        read = []
+
+        def iter_content(chunk_size):
+            for x in range(0, len(body), 100):
+                read.append(x)
+                yield body[x:x + 100]
+        resp = create_mock_response(200)
+        resp.iter_content.side_effect = iter_content
+        mocked_method.return_value = mock.Mock(
+            **{'result.return_value': resp})
+        client = BugcrowdClient('api-token')
+        streamed = client.get_submissions(
+            get_example_bounty(), stream=True,
+            params={'sort': 'newest', 'offset': 0, 'limit': 5})
+        self.assertEqual(next(streamed), submissions[0])
+        self.assertLess(read[-1] + 100, body.index(b'"meta"'))
+        self.assertEqual(list(streamed), submissions[1:])
+
+    def test_get_submissions_stream(self):
+        """ tests that get_submissions streams pages from a server. """
+        with FakeBugcrowdServer(submissions_per_bounty=12) as server:
+            client = BugcrowdClient('api-token')
+            client.base_uri = server.base_uri
+            client.stream_chunk_size = 100
+            bounty = server.bounties[0]
+            params = {'sort': 'newest', 'offset': 0, 'limit': 5}
+            expected = server.submissions[bounty['uuid']]
+            submissions = list(client.get_submissions(
+                bounty, params=params, stream=True))
+            self.assertEqual(submissions, expected)
+            models = list(client.get_submissions(
+                bounty, params=params, stream=True, model=Submission))
+            self.assertIn('description_markdown', models[0]._raw)
+            self.assertEqual([model.to_dict() for model in models],
+                             expected)
+            self.assertEqual(server.request_count, 6)
+
+    @mock.patch.object(requests.Session, 'get')
+    def test_get_submissions_model(self, mocked_method):
+        """ tests that get_submissions yields projected models. """
+        client = BugcrowdClient('api-token')
+        content = [create_bounty_submissions_response([self.submission])]
+        setup_mock_response(mocked_method, content)
+        submissions = list(client.get_submissions(
+            'bounty', model=Submission, fields=['title']))
+        self.assertIsInstance(submissions[0], Submission)
+        self.assertEqual(dict(submissions[0]), {
+            'uuid': self.submission['uuid'],
+            'title': self.submission['title']})
+
+
+class FakeClock(object):
+    """ A clock that only advances when slept upon. """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+    """ Tests for TokenBucket. """
+
+    def test_acquire_limits_rate(self):
+        """ tests that tokens are only acquired at the bucket's rate. """
+        clock = FakeClock()
+        bucket = TokenBucket(2, clock=clock, sleep=clock.sleep)
+        for _ in range(6):
+            bucket.acquire()
+        self.assertAlmostEqual(clock.now, 2.0)
+
+    def test_acquire_unlimited(self):
+        """ tests that a bucket without a rate never waits. """
+        clock = FakeClock()
+        bucket = TokenBucket(clock=clock, sleep=clock.sleep)
+        for _ in range(100):
+            bucket.acquire()
+        self.assertEqual(clock.sleeps, [])
+        bucket.set_rate(1)
+        bucket.acquire()
+        self.assertEqual(clock.sleeps, [])
+
+    def test_pause_until(self):
+        """ tests that no tokens are acquired while the bucket is paused. """
+        clock = FakeClock()
+        bucket = TokenBucket(clock=clock, sleep=clock.sleep)
+        bucket.pause_until(5)
+        bucket.acquire()
+        self.assertEqual(clock.now, 5)
+
+    def test_acquire_timeout(self):
+        """ tests that acquire fails at once when no token will be
+            available within its timeout.
+        """
+        clock = FakeClock()
+        bucket = TokenBucket(1, clock=clock, sleep=clock.sleep)
+        bucket.acquire(timeout=0.5)
+        with self.assertRaises(futures.TimeoutError):
+            bucket.acquire(timeout=0.5)
+        bucket.pause_until(10)
+        with self.assertRaises(futures.TimeoutError):
+            bucket.acquire(timeout=5)
+        self.assertEqual(clock.sleeps, [])
+        bucket.acquire(timeout=10)
+        self.assertEqual(clock.now, 10)
+
+
+class RequestSchedulerTest(unittest.TestCase):
+    """ Tests for RequestScheduler. """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = RequestScheduler(
+            clock=self.clock, sleep=self.clock.sleep, random=lambda: 1.0,
+            max_retries=3)
+
+    def _submit(self, method, responses):
+        sent = []
+        responses = iter(responses)
+
+        def send():
+            sent.append(1)
+            future = mock.Mock()
+            response = next(responses)
+            if isinstance(response, Exception):
+                future.result.side_effect = response
+            else:
+                future.result.return_value = response
+            return future
+        return self.scheduler.submit(method, send), sent
+
+    def test_retries_get_with_backoff(self):
+        """ tests that GET requests are retried with exponential backoff. """
+        ok = create_mock_response(200)
+        request, sent = self._submit('GET', [
+            create_mock_response(500), create_mock_response(502), ok])
+        self.assertIs(request.result(), ok)
+        self.assertEqual(request.result(), ok)
+        self.assertEqual(len(sent), 3)
+        self.assertEqual(self.clock.sleeps, [0.5, 1.0])
+
+    def test_gives_up_after_max_retries(self):
+        """ tests that the last response is returned once retries have been
+            exhausted.
+        """
+        responses = [create_mock_response(503) for _ in range(5)]
+        request, sent = self._submit('GET', responses)
+        self.assertIs(request.result(), responses[3])
+        self.assertEqual(len(sent), 4)
+
+    def test_retries_connection_errors_for_get(self):
+        """ tests that GET requests are retried after connection errors. """
+        ok = create_mock_response(200)
+        request, sent = self._submit(
+            'GET', [requests.ConnectionError(), ok])
+        self.assertIs(request.result(), ok)
+        self.assertEqual(len(sent), 2)
+
+    def test_retries_cut_off_bodies_for_get(self):
+        """ tests that GET requests whose bodies were cut off are retried.
+        """
+        ok = create_mock_response(200)
+        request, sent = self._submit(
+            'GET', [requests.exceptions.ChunkedEncodingError(), ok])
+        self.assertIs(request.result(), ok)
+        self.assertEqual(len(sent), 2)
+
+    def test_submit_does_not_wait_for_rate_limit(self):
+        """ tests that requests submitted while the rate limit holds are
+            queued rather than blocking the caller, and may be cancelled.
+        """
+        scheduler = RequestScheduler(rate=1)
+        sent = []
+
+        def send():
+            sent.append(1)
+            future = futures.Future()
+            future.set_result(create_mock_response(200))
+            return future
+        started_at = time.monotonic()
+        scheduled = [scheduler.submit('GET', send) for _ in range(3)]
+        self.assertLess(time.monotonic() - started_at, 0.5)
+        self.assertEqual(scheduled[0].result().status_code, 200)
+        self.assertTrue(scheduled[2].cancel())
+        scheduled[1].cancel()
+        self.assertEqual(len(sent), 1)
+
+    def test_does_not_retry_server_errors_for_post(self):
+        """ tests that non idempotent requests are not retried after
+            server errors.
+        """
+        error = create_mock_response(500)
+        request, sent = self._submit('POST', [error])
+        self.assertIs(request.result(), error)
+        self.assertEqual(len(sent), 1)
+
+    def test_retries_rate_limited_post(self):
+        """ tests that rate limited requests are retried after the
+            Retry-After period and the rate limit is lowered.
+        """
+        ok = create_mock_response(200)
+        limited = create_mock_response(429, headers={'Retry-After': '7'})
+        request, sent = self._submit('POST', [limited, ok])
+        self.assertIs(request.result(), ok)
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(self.clock.now, 7)
+        self.assertEqual(self.scheduler.bucket.rate,
+                         self.scheduler.fallback_rate)
+
+    def test_rate_adapts_to_rate_limit_headers(self):
+        """ tests that the rate limit follows the rate limit headers. """
+        headers = {'X-RateLimit-Remaining': '30',
+                   'X-RateLimit-Reset': '10'}
+        request, _ = self._submit('GET', [
+            create_mock_response(200, headers=headers)])
+        request.result()
+        self.assertEqual(self.scheduler.bucket.rate, 3)
+
+    def test_cancel(self):
+        """ tests that a cancelled request is not retried and has no
+            result.
+        """
+        request, sent = self._submit('GET', [create_mock_response(500)])
+        request._future.cancel.return_value = True
+        self.assertTrue(request.cancel())
+        self.assertTrue(request.cancelled())
+        with self.assertRaises(futures.CancelledError):
+            request.result()
+        self.assertEqual(len(sent), 1)
+
+    def test_timeout_covers_retries(self):
+        """ tests that a retry that would not be sent before the timeout
+            passes is not sent.
+        """
+        request, sent = self._submit('GET', [
+            create_mock_response(500), create_mock_response(200)])
+        with self.assertRaises(futures.TimeoutError):
+            request.result(timeout=0.1)
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(self.clock.sleeps, [])
+
+
+class SubmissionQueryTest(unittest.TestCase):
+    """ Tests for SubmissionQuery. """
+
+    def test_filter_checks_types(self):
+        """ tests that conditions are checked against the field types. """
+        query = SubmissionQuery()
+        with self.assertRaises(ValueError):
+            query.filter(colour='red')
+        with self.assertRaises(ValueError):
+            query.filter(substate='fixed')
+        with self.assertRaises(ValueError):
+            query.filter(priority__near=1)
+        with self.assertRaises(ValueError):
+            query.filter(priority__contains=1)
+        with self.assertRaises(TypeError):
+            query.filter(priority__lte='2')
+        with self.assertRaises(TypeError):
+            query.filter(submitted_at__gte='2020-01-01')
+        with self.assertRaises(ValueError):
+            query.order_by('priority')
+
+    def test_get_params(self):
+        """ tests that conditions the api supports become parameters. """
+        query = SubmissionQuery().filter(
+            substate='triaged', priority=1, vrt_id='other',
+            title__contains='XSS').order_by('oldest').only('title')
+        self.assertEqual(query.get_params({'offset': 0, 'limit': 10}), {
+            'offset': 0,
+            'limit': 10,
+            'sort': 'oldest',
+            'filter': 'priority:1 substate:triaged',
+            'search': 'XSS',
+            'fields': 'uuid,title,priority,substate,vrt_id',
+        })
+        self.assertEqual(SubmissionQuery().get_params(),
+                         {'sort': 'newest', 'offset': 0})
+
+    def test_matches(self):
+        """ tests that every condition is checked on the client. """
+        submission = get_example_submission()
+        submission.update(priority=2, substate='triaged',
+                          title='Stored XSS')
+        query = SubmissionQuery().filter(
+            substate__in=['triaged', 'new'], priority__lte=3,
+            submitted_at__gte=datetime.datetime(2020, 1, 1),
+            title__contains='xss', vrt_id=None)
+        self.assertTrue(query.matches(submission))
+        for kwargs in [{'priority__gt': 2}, {'substate__ne': 'triaged'},
+                       {'caption__contains': 'a'},
+                       {'submitted_at__lt': datetime.datetime(2020, 1, 1)}]:
+            self.assertFalse(query.filter(**kwargs).matches(submission))
+
+    @mock.patch.object(requests.Session, 'get')
+    def test_get_submissions_applies_query(self, mocked_method):
+        """ tests that conditions the api ignores are applied on the
+            client.
+        """
+        client = BugcrowdClient('api-token')
+        submissions = [get_example_submission() for _ in range(3)]
+        submissions[1]['substate'] = 'triaged'
+        setup_mock_response(mocked_method, [
+            create_bounty_submissions_response(submissions)])
+        query = SubmissionQuery().filter(substate='triaged').only('title')
+        results = list(client.get_submissions('bounty', query=query))
+        self.assertEqual(results, [{'uuid': submissions[1]['uuid'],
+                                    'title': submissions[1]['title']}])
+        self.assertEqual(mocked_method.call_args[1]['params'], {
+            'sort': 'newest', 'offset': 0, 'limit': 250,
+            'filter': 'substate:triaged', 'fields': 'uuid,title,substate'})
+
+    def test_query_against_fake_server(self):
+        """ tests that a query fetches fewer pages and yields the same
+            submissions whether or not it is streamed.
+        """
+        with FakeBugcrowdServer(submissions_per_bounty=40) as server:
+            client = BugcrowdClient('api-token')
+            client.base_uri = server.base_uri
+            bounty = server.bounties[0]
+            for submission in server.submissions[bounty['uuid']][::4]:
+                submission['substate'] = 'triaged'
+            query = SubmissionQuery().filter(
+                substate='triaged',
+                submitted_at__gte=datetime.datetime(2020, 1, 1, 0, 0, 20),
+            ).only('reference_number')
+            params = {'sort': 'newest', 'offset': 0, 'limit': 4}
+            expected = [{'uuid': submission['uuid'],
+                         'reference_number': submission['reference_number']}
+                        for submission in server.submissions[bounty['uuid']]
+                        if submission['substate'] == 'triaged' and
+                        int(submission['reference_number']) >= 20]
+            for stream in [False, True]:
+                results = list(client.get_submissions(
+                    bounty, params=dict(params), query=query, stream=stream,
+                    model=Submission if stream else None))
+                self.assertEqual([dict(result) for result in results],
+                                 expected)
+            self.assertEqual(server.request_count, 6)
+
+
+class SubmissionIndexTest(unittest.TestCase):
+    """ Tests for SubmissionIndex. """
+
+    def setUp(self):
+        self.submissions = [
+            get_example_submission(
+                submitted_at='2020-01-0%dT00:00:00.000Z' % day)
+            for day in range(1, 5)]
+        fields = [
+            ('Reflected XSS in search', 'https://Example.com/search/',
+             'unresolved', 'cross_site_scripting_xss'),
+            ('SQL injection in login', 'https://example.com/login',
+             'triaged', 'server_side_injection'),
+            ('Stored XSS in profile', 'https://example.com/profile',
+             'triaged', 'cross_site_scripting_xss'),
+            ('Open redirect', None, 'resolved', 'open_redirect'),
+        ]
+        for submission, (title, bug_url, substate, vrt_id) in zip(
+                self.submissions, fields):
+            submission.update(title=title, bug_url=bug_url,
+                              substate=substate, vrt_id=vrt_id)
+        self.index = SubmissionIndex()
+        self.addCleanup(self.index.close)
+        self.assertEqual(self.index.add(self.submissions), 4)
+
+    def _get_titles(self, submissions):
+        return [submission['title'] for submission in submissions]
+
+    def test_search(self):
+        """ tests that submissions can be queried on indexed fields. """
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(
+            self.index.get(self.submissions[0]['uuid']), self.submissions[0])
+        self.assertIsNone(self.index.get('missing'))
+        self.assertEqual(self._get_titles(self.index.search(
+            substate='triaged')), ['Stored XSS in profile',
+                                   'SQL injection in login'])
+        self.assertEqual(self._get_titles(self.index.search(
+            vrt_id='cross_site_scripting_xss', substate=['unresolved'])),
+            ['Reflected XSS in search'])
+        self.assertEqual(self._get_titles(self.index.search(
+            bug_url='https://example.com/search#top')),
+            ['Reflected XSS in search'])
+        self.assertEqual(self._get_titles(self.index.search(title='xss')),
+                         ['Stored XSS in profile',
+                          'Reflected XSS in search'])
+        self.assertEqual(self._get_titles(self.index.search(
+            title='XSS search')), ['Reflected XSS in search'])
+        self.assertEqual(self._get_titles(self.index.search(
+            submitted_after=datetime.datetime(2020, 1, 2),
+            submitted_before='2020-01-03T00:00:00.000Z')),
+            ['Stored XSS in profile', 'SQL injection in login'])
+        self.assertEqual(len(self.index.search(limit=1)), 1)
+
+    def test_find_duplicates(self):
+        """ tests that duplicates are found by bug url and then title. """
+        duplicates = self.index.find_duplicates({
+            'title': 'XSS in the profile page',
+            'bug_url': 'HTTPS://EXAMPLE.COM/search',
+        })
+        self.assertEqual(self._get_titles(duplicates), [
+            'Reflected XSS in search', 'Stored XSS in profile',
+            'SQL injection in login'])
+        self.assertEqual(self.index.find_duplicates(self.submissions[3]), [])
+        self.assertEqual(len(self.index.find_duplicates(
+            {'title': 'in'}, limit=2)), 2)
+
+    def test_updates_and_removes(self):
+        """ tests that re-adding a submission replaces it. """
+        submission = dict(self.submissions[0], title='Reflected HTML')
+        self.index.add([submission])
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.search(title='xss search'), [])
+        self.assertEqual(self.index.search(title='html'), [submission])
+        self.index.remove(submission['uuid'])
+        self.assertEqual(self.index.search(title='html'), [])
+        self.assertEqual(len(self.index), 3)
+
+    def test_normalize_bug_url(self):
+        """ tests that bug urls are normalised. """
+        self.assertEqual(normalize_bug_url(' HTTP://A.com/b/?c=1#d '),
+                         'http://a.com/b?c=1')
+        self.assertIsNone(normalize_bug_url(''))
+
+    def test_sync(self):
+        """ tests that sync only adds submissions newer than the last. """
+        with FakeBugcrowdServer(submissions_per_bounty=5) as server:
+            client = BugcrowdClient('api-token')
+            client.base_uri = server.base_uri
+            bounty = server.bounties[0]
+            submissions = server.submissions[bounty['uuid']]
+            submissions.reverse()
+            self.assertEqual(self.index.sync(client, bounty), 5)
+            self.assertEqual(len(self.index), 9)
+            new = server._create_submission(bounty, 59)
+            submissions.insert(0, new)
+            self.assertEqual(self.index.sync(client, bounty), 1)
+            self.assertEqual(self.index.get(new['uuid']), new)
+
+    def test_sync_advances_cursor_once_written(self):
+        """ tests that sync stores its cursor after the submissions. """
+        with FakeBugcrowdServer(submissions_per_bounty=5) as server:
+            client = BugcrowdClient('api-token')
+            client.base_uri = server.base_uri
+            bounty = server.bounties[0]
+            store = MemoryCursorStore()
+            lengths = []
+            store.set = lambda *args: lengths.append(len(self.index))
+            self.assertEqual(self.index.sync(client, bounty, store=store), 5)
+            self.assertEqual(lengths, [9])
+
+    def test_refresh(self):
+        """ tests that refresh picks up changes to indexed submissions. """
+        with FakeBugcrowdServer(submissions_per_bounty=5) as server:
+            client = BugcrowdClient('api-token')
+            client.base_uri = server.base_uri
+            bounty = server.bounties[0]
+            submissions = server.submissions[bounty['uuid']]
+            submissions.reverse()
+            self.index.sync(client, bounty)
+            submissions[2]['substate'] = 'resolved'
+            self.assertEqual(self.index.sync(client, bounty), 0)
+            self.assertEqual(
+                self.index.refresh(client, bounty, batch_size=2), 1)
+            self.assertEqual(
+                self.index.get(submissions[2]['uuid'])['substate'],
+                'resolved')
+            self.assertEqual(self.index.refresh(client, bounty), 0)
+
+    def test_add_reads_submissions_unlocked(self):
+        """ tests that the index can be queried while add reads its
+            submissions.
+        """
+        def generate():
+            for submission in self.submissions:
+                self.assertIsNotNone(self.index.get(submission['uuid']))
+                yield dict(submission, title='Updated')
+
+        self.assertEqual(self.index.add(generate(), batch_size=3), 4)
+        self.assertEqual(len(self.index.search(title='updated')), 4)
+
+
+class ResponseArchiveTest(unittest.TestCase):
+    """ Tests for ResponseArchive. """
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'traffic.bca')
+        self.params = {'sort': 'newest', 'offset': 0, 'limit': 4}
+        with FakeBugcrowdServer(submissions_per_bounty=10) as server:
+            self.base_uri = server.base_uri
+            with ResponseArchive(self.path, 'a') as archive:
+                client = self._create_client(archive)
+                self.bounties = client.get_bounties()
+                self.submissions = list(client.get_submissions(
+                    self.bounties[0], params=self.params))
+                self.comments = client.get_comments_for_submission(
+                    self.submissions[0])
+                self.attachments = client.get_attachments_for_submission(
+                    self.submissions[0])
+                client.transport.close()
+
+    def _create_client(self, archive):
+        client = BugcrowdClient('api-token', archive=archive)
+        client.base_uri = self.base_uri
+        return client
+
+    def _assert_replays(self):
+        with ResponseArchive(self.path) as archive:
+            self.assertEqual(len(archive), 6)
+            client = self._create_client(archive)
+            self.assertEqual(client.get_bounties(), self.bounties)
+            self.assertEqual(list(client.get_submissions(
+                self.bounties[0], params=self.params)), self.submissions)
+            self.assertEqual(
+                [dict(s) for s in client.get_submissions(
+                    self.bounties[0], params=self.params, stream=True)],
+                self.submissions)
+            self.assertEqual(client.get_comments_for_submission(
+                self.submissions[0]), self.comments)
+            self.assertEqual(client.get_attachments_for_submission(
+                self.submissions[0]), self.attachments)
+            self.assertIsNone(client._session)
+
+    def test_replay(self):
+        """ tests that recorded responses are replayed, once the server has
+            stopped, without a session being created.
+        """
+        self.assertEqual(len(self.submissions), 10)
+        self._assert_replays()
+
+    def test_replay_unknown_request(self):
+        """ tests that replaying a request that was not recorded fails. """
+        with ResponseArchive(self.path) as archive:
+            client = self._create_client(archive)
+            with self.assertRaises(LookupError):
+                client.get_comments_for_submission(self.submissions[1])
+            self.assertIsNone(archive.get(
+                'GET', self.base_uri + '/bounties', params={'limit': 1}))
+
+    def test_not_modified_is_not_recorded(self):
+        """ tests that a 304 revalidation does not replace the recorded
+            response.
+        """
+        with ResponseArchive(self.path, 'a') as archive:
+            uri = self._create_client(
+                archive).get_api_uri_for_submission_comments(
+                    self.submissions[0])
+            recorded = archive.get('GET', uri)
+            resp = requests.Response()
+            resp.status_code = 304
+            resp.request = recorded.request
+            resp._content = b''
+            archive.record(resp)
+            self.assertEqual(len(archive), 6)
+            self.assertEqual(archive.get('GET', uri).json(), recorded.json())
+        self._assert_replays()
+
+    def test_recover_interrupted_recording(self):
+        """ tests that records missing from the index are indexed and a
+            partly written record is discarded when an archive is opened.
+        """
+        os.remove(self.path + '.idx')
+        with open(self.path, 'ab') as data_file:
+            data_file.write(b'\x00\x00\x00\x10\x00')
+        size = os.path.getsize(self.path)
+        with ResponseArchive(self.path, 'a') as archive:
+            self.assertEqual(len(archive), 6)
+        self.assertEqual(os.path.getsize(self.path), size - 5)
+        self._assert_replays()
+
+    def test_open_other_file(self):
+        """ tests that files other than archives are rejected. """
+        with open(self.path, 'wb') as data_file:
+            data_file.write(b'not an archive')
+        with self.assertRaises(ValueError):
+            ResponseArchive(self.path)
+
+
+class WatchSubmissionsTest(unittest.TestCase):
+    """ Tests for watch_submissions. """
+
+    def setUp(self):
+        self.server = FakeBugcrowdServer(submissions_per_bounty=3).start()
+        self.addCleanup(self.server.stop)
+        self.client = BugcrowdClient('api-token')
+        self.client.base_uri = self.server.base_uri
+        self.bounty = self.server.bounties[0]
+        self.submissions = self.server.submissions[self.bounty['uuid']]
+        self.sleeps = []
+        self.changes = []
+
+    def _sleep(self, seconds):
+        self.sleeps.append(seconds)
+        if self.changes:
+            self.changes.pop(0)()
+
+    def _watch(self, **kwargs):
+        return [(event.type, event.submission['uuid'],
+                 event.previous_substate)
+                for event in watch_submissions(
+                    self.client, self.bounty, interval=1, max_interval=4,
+                    sleep=self._sleep, **kwargs)]
+
+    def test_yields_changes(self):
+        """ tests that only created, transitioned and updated submissions
+            are yielded, with polling backing off while nothing changes.
+        """
+        new = self.server._create_submission(self.bounty, 3)
+
+        def transition():
+            self.submissions[0]['substate'] = 'triaged'
+            self.submissions[1]['title'] = 'renamed'
+        self.changes = [
+            lambda: None, lambda: None, lambda: None, lambda: None,
+            lambda: self.submissions.insert(0, new), transition,
+            lambda: self.submissions.pop(),
+        ]
+        events = self._watch(max_polls=7)
+        self.assertEqual(events, [
+            ('created', new['uuid'], None),
+            ('transitioned', self.submissions[0]['uuid'], 'unresolved'),
+            ('updated', self.submissions[1]['uuid'], None),
+        ])
+        self.assertEqual(self.sleeps, [1, 2, 4, 4, 4, 1, 1])
+
+    def test_watches_only_given_fields(self):
+        """ tests that changes to unwatched fields are ignored and that
+            existing submissions can be included.
+        """
+        def update():
+            self.submissions[0]['title'] = 'renamed'
+            self.submissions[1]['substate'] = 'resolved'
+        self.changes = [update]
+        events = self._watch(max_polls=2, fields=['reference_number'],
+                             include_existing=True, stream=True)
+        self.assertEqual(events, [
+            ('created', submission['uuid'], None)
+            for submission in self.submissions] + [
+            ('transitioned', self.submissions[1]['uuid'], 'unresolved')])
+
+
+class SyncSubmissionsTest(unittest.TestCase):
+    """ Tests for sync_submissions. """
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.store = MemoryCursorStore()
+        self._bounty = get_example_bounty()
+        self.submissions = []
+
+    def _add_submissions(self, *timestamps):
+        new = [get_example_submission(submitted_at=timestamp)
+               for timestamp in timestamps]
+        self.submissions = new + self.submissions
+
+        def get_submissions(bounty, **kwargs):
+            return (submission for submission in self.submissions)
+        self.client.get_submissions.side_effect = get_submissions
+        return new
+
+    def _sync(self):
+        return list(sync_submissions(self.client, self._bounty, self.store))
+
+    def test_sync_yields_only_new_submissions(self):
+        """ tests that only submissions newer than the cursor are yielded
+            and that pagination stops at the cursor.
+        """
+        first = self._add_submissions('2020-01-02', '2020-01-01')
+        self.assertEqual(self._sync(), first)
+        self.assertEqual(self._sync(), [])
+        second = self._add_submissions('2020-01-04', '2020-01-03')
+        consumed = []
+        original = self.client.get_submissions.side_effect
+
+        def get_submissions(bounty, **kwargs):
+            for submission in original(bounty, **kwargs):
+                consumed.append(submission)
+                yield submission
+        self.client.get_submissions.side_effect = get_submissions
+        self.assertEqual(self._sync(), second)
+        self.assertEqual(len(consumed), 4)
+        self.assertEqual(self.store.get(self._bounty['uuid']), {
+            'timestamp': '2020-01-04', 'uuids': [second[0]['uuid']]})
+
+    def test_sync_handles_submissions_sharing_the_cursor_timestamp(self):
+        """ tests that new submissions with the same timestamp as the
+            cursor are yielded.
+        """
+        first = self._add_submissions('2020-01-01')
+        self.assertEqual(self._sync(), first)
+        second = self._add_submissions('2020-01-01')
+        self.assertEqual(self._sync(), second)
+        self.assertEqual(
+            self.store.get(self._bounty['uuid'])['uuids'],
+            [first[0]['uuid'], second[0]['uuid']])
+        self.assertEqual(self._sync(), [])
+
+    def test_sync_yields_submissions_sorted_after_the_cursor(self):
+        """ tests that a new submission with the cursor's timestamp is
+            yielded when the api sorts it after the submissions already
+            seen.
+        """
+        first = self._add_submissions('2020-01-01')
+        self.assertEqual(self._sync(), first)
+        second = get_example_submission(submitted_at='2020-01-01')
+        self.submissions.append(second)
+        self.assertEqual(self._sync(), [second])
+        self.assertEqual(self._sync(), [])
+
+
+class CursorStoreTest(unittest.TestCase):
+    """ Tests for the sync cursor stores. """
+
+    def _check_store(self, store):
+        cursor = {'timestamp': '2020-01-01', 'uuids': ['a', 'b']}
+        self.assertIsNone(store.get('bounty'))
+        store.set('bounty', cursor)
+        self.assertEqual(store.get('bounty'), cursor)
+
+    def test_json_cursor_store(self):
+        """ tests that the JSONCursorStore persists cursors. """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cursors.json')
+            self._check_store(JSONCursorStore(path))
+            self.assertEqual(JSONCursorStore(path).get('bounty')['uuids'],
+                             ['a', 'b'])
+
+    def test_sqlite_cursor_store(self):
+        """ tests that the SQLiteCursorStore persists cursors. """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cursors.db')
+            store = SQLiteCursorStore(path)
+            self._check_store(store)
+            store.close()
+            store = SQLiteCursorStore(path)
+            self.assertEqual(store.get('bounty')['uuids'], ['a', 'b'])
+            store.close()
+
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class AsyncBugcrowdClientTest(unittest.TestCase):
+    """ Tests for AsyncBugcrowdClient. """
+
+    def setUp(self):
+        from aiohttp import test_utils, web
+        self.loop = asyncio.new_event_loop()
+        self.requests = []
+        self.responses = {}
+        app = web.Application()
+        app.router.add_route('*', '/{path:.*}', self._handle)
+        self.server = test_utils.TestServer(app)
+        self.loop.run_until_complete(self.server.start_server())
+        self.client = AsyncBugcrowdClient('api-token', max_concurrency=2)
+        self.client.base_uri = str(self.server.make_url('/'))
+        self._bounty = get_example_bounty()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.client.close())
+        self.loop.run_until_complete(self.server.close())
+        self.loop.close()
+
+    async def _handle(self, request):
+        from aiohttp import web
+        body = await request.text()
+        self.requests.append((request.method, request.path,
+                              dict(request.query), body, request.headers))
+        key = (request.method, request.path, request.query.get('offset'))
+        if key not in self.responses:
+            key = (request.method, request.path, None)
+        return web.json_response(self.responses[key])
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def _collect(self, async_iter):
+        async def collect():
+            return [item async for item in async_iter]
+        return self._run(collect())
+
+    def test_close_keeps_given_session(self):
+        """ tests that a session given to the client is neither closed nor
+            replaced by close.
+        """
+        async def create_session():
+            return aiohttp.ClientSession()
+        session = self._run(create_session())
+        try:
+            client = AsyncBugcrowdClient('api-token', session=session)
+            client.base_uri = self.client.base_uri
+            self._run(client.close())
+            self.assertFalse(session.closed)
+            self.assertIs(client.session, session)
+            self.responses[('GET', '/bounties', None)] = \
+                create_bounty_bounties_response([self._bounty])
+            self.assertEqual(self._run(client.get_bounties()),
+                             [self._bounty])
+        finally:
+            self._run(session.close())
+
+    def test_get_bounties(self):
+        """ tests that the get_bounties method works as expected. """
+        self.responses[('GET', '/bounties', None)] = \
+            create_bounty_bounties_response([self._bounty])
+        self.assertEqual(self._run(self.client.get_bounties()),
+                         [self._bounty])
+        headers = self.requests[0][-1]
+        self.assertEqual(headers['Accept'],
+                         'application/vnd.bugcrowd.v3+json')
+        self.assertEqual(headers['Authorization'], 'Token api-token')
+
+    def test_get_submissions_retrieval_multiple_pages(self):
+        """ tests that the get_submissions method correctly retrieves
+            submissions in order when there are multiple pages.
+        """
+        num_submissions = 7
+        expected_submissions = [get_example_submission(uuid=str(x))
+                                for x in range(0, num_submissions)]
+        path = '/bounties/%s/submissions' % self._bounty['uuid']
+        for offset in range(0, num_submissions, 2):
+            self.responses[('GET', path, str(offset))] = \
+                create_bounty_submissions_response(
+                    expected_submissions[offset:offset + 2],
+                    total_hits=num_submissions, offset=offset)
+        params = {'sort': 'newest', 'offset': 0, 'limit': 2}
+        submissions = self._collect(self.client.get_submissions(
+            self._bounty, params=params, prefetch_pages=2))
+        self.assertEqual(submissions, expected_submissions)
+        offsets = sorted(int(query['offset'])
+                         for _, _, query, _, _ in self.requests)
+        self.assertEqual(offsets, [0, 2, 4, 6])
+
+    def test_get_comments_and_attachments_for_submission(self):
+        """ tests that the comments and attachments of a submission can be
+            retrieved.
+        """
+        submission = get_example_submission()
+        path = '/submissions/%s' % submission['uuid']
+        attachments = get_example_attachments()
+        self.responses[('GET', path + '/comments', None)] = {'notes': []}
+        self.responses[('GET', path + '/file_attachments', None)] = \
+            attachments
+        self.assertEqual(
+            self._run(self.client.get_comments_for_submission(submission)),
+            {'notes': []})
+        self.assertEqual(
+            self._run(self.client.get_attachments_for_submission(
+                submission)), attachments)
+
+    def test_transition_submission(self):
+        """ tests that the transition_submission method works as expected. """
+        submission = get_example_submission()
+        path = '/submissions/%s/transition' % submission['uuid']
+        self.responses[('POST', path, None)] = {}
+        self._run(self.client.transition_submission(
+            submission, 'duplicate', duplicate_of='original'))
+        method, req_path, _, body, _ = self.requests[0]
+        self.assertEqual((method, req_path), ('POST', path))
+        self.assertEqual(json.loads(body), {
+            'substate': 'duplicate', 'duplicate_of': 'original'})
+        with self.assertRaises(ValueError):
+            self._run(self.client.transition_submission(
+                submission, 'duplicate'))
+
+    def test_request_raises_for_error_status(self):
+        """ tests that error responses raise an exception. """
+        with self.assertRaises(aiohttp.ClientResponseError):
+            self._run(self.client.get_bounties())
+
 
 def setup_example_bounties_response(mocked_method, bounties=None):
     """ setups up an example bounties response. """
@@ -339,6 +2524,8 @@ def get_example_submission(**kwargs):
         'bounty_code': kwargs.get('bounty_code', 'code-%s' % uuid.uuid4()),
         'reference_number': kwargs.get('reference_number',
                                        'ref-n-%s' % uuid.uuid4()),
+        'submitted_at': kwargs.get('submitted_at',
+                                   '2020-01-01T00:00:00.000Z'),
     }
 
 
@@ -413,6 +2600,13 @@ def get_example_attachments():
     }
 
 
+def _get_export_row(submission):
+    """ returns the row exported for a submission by the sharded export
+        test, in a worker process.
+    """
+    return {'uuid': submission['uuid'], 'title': submission['title'].upper()}
+
+
 def setup_mock_response(mocked_method, json_contents, headers=None):
     """ setups up a mock response for testing purposes. """
     m_async_request = mock.Mock(name='async_request')
@@ -425,5 +2619,14 @@ def setup_mock_response(mocked_method, json_contents, headers=None):
     return mocked_method
 
 
+def create_mock_response(status_code, json_content=None, headers=None):
+    """ returns a mock response with the given status code. """
+    m_response = mock.Mock(name='response')
+    m_response.status_code = status_code
+    m_response.headers = headers or {}
+    m_response.json.return_value = json_content
+    return m_response
+
+
 if __name__ == '__main__':
     unittest.main()
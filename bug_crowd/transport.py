@@ -0,0 +1,115 @@
+import threading
+
+
+def _create_timeout_adapter(timeout, **kwargs):
+    """ returns an HTTPAdapter applying a default timeout to requests.
+        requests is imported here so that importing the client is cheap.
+    """
+    from requests.adapters import HTTPAdapter
+
+    class _TimeoutHTTPAdapter(HTTPAdapter):
+
+        def send(self, request, **kwargs):
+            if kwargs.get('timeout') is None:
+                kwargs['timeout'] = self.timeout
+            return super(_TimeoutHTTPAdapter, self).send(request, **kwargs)
+
+    adapter = _TimeoutHTTPAdapter(**kwargs)
+    adapter.timeout = timeout
+    return adapter
+
+
+class Transport(object):
+    """ The thread pool and connection pool used to send requests.
+
+        A transport may be shared by several clients, each with their own
+        credentials, so that they share worker threads and reuse each
+        other's keep-alive connections. The thread pool and connection pool
+        are only created, and requests only imported, when first used.
+    """
+
+    def __init__(self, max_workers=5, **kwargs):
+        """ Creates a transport sending up to max_workers requests at once.
+
+            pool_connections is the number of hosts to keep connection
+            pools for and pool_maxsize the number of connections kept per
+            host, which defaults to max_workers. When pool_block is set
+            requests wait for a pooled connection rather than opening an
+            extra one. keep_alive may be unset to close connections after
+            each request. connect_timeout and read_timeout, in seconds,
+            apply to every request. compression may be unset to ask for
+            uncompressed responses. An existing executor may be given to
+            run requests on instead of creating a thread pool, in which
+            case it is not shut down by close.
+        """
+        self.max_workers = max_workers
+        self.keep_alive = kwargs.get('keep_alive', True)
+        self.compression = kwargs.get('compression', True)
+        self._lock = threading.Lock()
+        self._executor = kwargs.get('executor', None)
+        self._owns_executor = self._executor is None
+        self._adapter = None
+        timeout = (kwargs.get('connect_timeout', None),
+                   kwargs.get('read_timeout', None))
+        self._timeout = None if timeout == (None, None) else timeout
+        self._adapter_kwargs = {
+            'pool_connections': kwargs.get('pool_connections', 10),
+            'pool_maxsize': kwargs.get('pool_maxsize', max_workers),
+            'pool_block': kwargs.get('pool_block', False),
+        }
+
+    @property
+    def executor(self):
+        """ Returns the executor requests are run on, creating a thread
+            pool on first use.
+        """
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers)
+            return self._executor
+
+    @property
+    def adapter(self):
+        """ Returns the HTTPAdapter holding the connection pool, creating
+            it on first use.
+        """
+        with self._lock:
+            if self._adapter is None:
+                self._adapter = _create_timeout_adapter(
+                    self._timeout, **self._adapter_kwargs)
+            return self._adapter
+
+    def get_default_headers(self):
+        """ Returns the headers implied by the transport's settings. """
+        headers = {}
+        if not self.keep_alive:
+            headers['Connection'] = 'close'
+        if not self.compression:
+            headers['Accept-Encoding'] = 'identity'
+        return headers
+
+    def create_session(self, headers=None):
+        """ Returns a FuturesSession sending requests with the given headers
+            through the transport's executor and connection pool.
+        """
+        from requests_futures.sessions import FuturesSession
+
+        session = FuturesSession(executor=self.executor)
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        session.headers.update(self.get_default_headers())
+        session.headers.update(headers or {})
+        return session
+
+    def close(self):
+        """ Closes pooled connections and shuts down the executor, if they
+            were created by the transport.
+        """
+        with self._lock:
+            adapter, executor = self._adapter, self._executor
+        if adapter is not None:
+            adapter.close()
+        if executor is not None and self._owns_executor:
+            executor.shutdown()
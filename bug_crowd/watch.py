@@ -0,0 +1,99 @@
+import hashlib
+import json
+import time
+
+
+# The types of SubmissionEvent.
+CREATED = 'created'
+UPDATED = 'updated'
+TRANSITIONED = 'transitioned'
+
+
+class SubmissionEvent(object):
+    """ A change to a submission seen by watch_submissions.
+
+        type is 'created', 'transitioned' when the substate changed, with
+        previous_substate holding the old one, or 'updated' when any other
+        watched field changed.
+    """
+
+    __slots__ = ('type', 'submission', 'previous_substate')
+
+    def __init__(self, type, submission, previous_substate=None):
+        self.type = type
+        self.submission = submission
+        self.previous_substate = previous_substate
+
+    def __repr__(self):
+        return 'SubmissionEvent(%r, %r)' % (
+            self.type, self.submission.get('uuid'))
+
+
+def watch_submissions(client, bounty, **kwargs):
+    """ Yields a SubmissionEvent for each submission of the given bounty or
+        bounty uuid that is created, transitioned or updated.
+
+        The bounty's submissions are polled and compared with an 8 byte
+        fingerprint kept for each, of its fields or only the given fields
+        along with its substate. Polls are interval seconds apart while
+        submissions change, and the wait grows by backoff times after each
+        poll without changes, up to max_interval seconds. Submissions that
+        exist when watching starts are only yielded, as created, if
+        include_existing is set. params, prefetch_pages and stream are
+        passed to get_submissions. Watching stops after max_polls polls if
+        given.
+    """
+    interval = kwargs.get('interval', 30.0)
+    max_interval = kwargs.get('max_interval', interval * 10)
+    backoff = kwargs.get('backoff', 2.0)
+    max_polls = kwargs.get('max_polls', None)
+    sleep = kwargs.get('sleep', time.sleep)
+    params = kwargs.get('params', None) or {'sort': 'newest', 'offset': 0}
+    fields = kwargs.get('fields', None)
+    if fields is not None:
+        fields = ['uuid', 'substate'] + [
+            field for field in fields if field not in ('uuid', 'substate')]
+    submissions_kwargs = {
+        'fields': fields,
+        'stream': kwargs.get('stream', False),
+        'prefetch_pages': kwargs.get(
+            'prefetch_pages', client.default_prefetch_pages),
+    }
+    fingerprints = None
+    if not kwargs.get('include_existing', False):
+        fingerprints = {}
+        for submission in client.get_submissions(
+                bounty, params=dict(params), **submissions_kwargs):
+            fingerprints[submission['uuid']] = _get_fingerprint(submission)
+    delay = interval
+    polls = 0
+    while max_polls is None or polls < max_polls:
+        if fingerprints is not None:
+            sleep(delay)
+        polls += 1
+        previous = fingerprints or {}
+        fingerprints = {}
+        changed = False
+        for submission in client.get_submissions(
+                bounty, params=dict(params), **submissions_kwargs):
+            uuid = submission['uuid']
+            fingerprint = fingerprints[uuid] = _get_fingerprint(submission)
+            old_fingerprint = previous.get(uuid)
+            if old_fingerprint == fingerprint:
+                continue
+            changed = True
+            if old_fingerprint is None:
+                yield SubmissionEvent(CREATED, submission)
+            elif old_fingerprint[0] != fingerprint[0]:
+                yield SubmissionEvent(TRANSITIONED, submission,
+                                      old_fingerprint[0])
+            else:
+                yield SubmissionEvent(UPDATED, submission)
+        delay = interval if changed else min(max_interval, delay * backoff)
+
+
+def _get_fingerprint(submission):
+    """ returns the substate and a digest of the fields of a submission. """
+    data = json.dumps(dict(submission), sort_keys=True, default=str)
+    digest = hashlib.blake2b(data.encode('utf-8'), digest_size=8).digest()
+    return submission.get('substate'), digest